@@ -0,0 +1,222 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class QuotaExceededError(RuntimeError):
+	pass
+
+
+class DailyUsage:
+	"""
+	Requests counted per UTC day. Given a path, the counts are kept in a SQLite file (opened on first use),
+	so restarts and processes sharing it (e.g. a crawl & the query service) draw on the same daily quota.
+	Without one, they're only counted in memory.
+	"""
+	def __init__(self, path: Optional[str] = None) -> None:
+		self.path = path
+		self.lock = threading.Lock()
+		self.counts: Dict[str, int] = {}
+		self._connection: Optional[sqlite3.Connection] = None
+
+	@staticmethod
+	def _today() -> str:
+		return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+	def _connect(self) -> sqlite3.Connection:
+		if self._connection is None:
+			os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+			self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+			self._connection.execute('CREATE TABLE IF NOT EXISTS usage (day TEXT PRIMARY KEY, requests INTEGER NOT NULL)')
+		return self._connection
+
+	def today(self) -> int:
+		day = self._today()
+		with self.lock:
+			if self.path is None:
+				return self.counts.get(day, 0)
+			row = self._connect().execute('SELECT requests FROM usage WHERE day = ?', (day,)).fetchone()
+			return 0 if row is None else row[0]
+
+	def take(self, quota: Optional[int] = None) -> int:
+		"""Counts a request, returning today's count, or raises QuotaExceededError once quota requests were made today"""
+		day = self._today()
+		with self.lock:
+			if self.path is None:
+				used = self.counts.get(day, 0)
+				if quota is not None and used >= quota:
+					raise QuotaExceededError(f"Daily quota of {quota} requests used up")
+				self.counts[day] = used + 1
+				return used + 1
+			connection = self._connect()
+			connection.execute('BEGIN IMMEDIATE') # Other processes wait, so the check & count are atomic
+			try:
+				row = connection.execute('SELECT requests FROM usage WHERE day = ?', (day,)).fetchone()
+				used = 0 if row is None else row[0]
+				if quota is not None and used >= quota:
+					raise QuotaExceededError(f"Daily quota of {quota} requests used up ({self.path})")
+				connection.execute('INSERT OR REPLACE INTO usage VALUES (?, ?)', (day, used + 1))
+				connection.execute('COMMIT')
+			except BaseException:
+				connection.execute('ROLLBACK')
+				raise
+			return used + 1
+
+
+class TokenBucket:
+	"""
+	Allows bursts of up to capacity requests, refilled at rate requests/sec, shared by threads & event loops.
+	Each request reserves the next token and then waits for it, so requests are served in order and a burst can't starve earlier waiters.
+	The daily quota (e.g. a BabelNet key's babelcoins) is counted separately by usage, which resets at midnight UTC.
+	"""
+	def __init__(self, rate: float, capacity: int, daily_quota: Optional[int] = None, usage: Optional[DailyUsage] = None) -> None:
+		self.rate = rate
+		self.capacity = capacity
+		self.daily_quota = daily_quota
+		self.usage = usage or DailyUsage()
+		self.tokens = float(capacity)
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	@property
+	def used_today(self) -> int:
+		return self.usage.today()
+
+	def reserve(self) -> float:
+		"""Takes a token (and one of today's quota), returning how many seconds to wait before using it"""
+		self.usage.take(self.daily_quota)
+		with self.lock:
+			now = time.monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+			self.tokens -= 1 # Goes negative while tokens are reserved ahead of the refill
+			return max(0.0, -self.tokens / self.rate)
+
+	async def acquire(self) -> None:
+		delay = self.reserve()
+		if delay > 0:
+			await asyncio.sleep(delay)
+
+	def acquire_blocking(self) -> None:
+		"""acquire for sync code, sleeping the calling thread"""
+		delay = self.reserve()
+		if delay > 0:
+			time.sleep(delay)
+
+
+class AsyncBabelNet:
+	"""
+	Concurrent, rate limited front for a blocking BabelNet client (see BabelNetClient in synset_retriever & FakeBabelNet).
+	At most concurrency calls run at once (per event loop), concurrent calls with the same arguments share a single request,
+	and calls the client reports as cached don't use up any tokens.
+	Clients that set rate_limited (i.e. BabelNetClient) wait for their own limiter where they reach BabelNet, so they aren't limited twice.
+	Sync code (i.e. from other threads) can use run, which executes coroutines on a shared background event loop.
+	"""
+	def __init__(self, client, concurrency=8, rate=10.0, burst=20, daily_quota: Optional[int] = 1000, bucket: Optional[TokenBucket] = None) -> None:
+		self.logger = logging.getLogger(__name__)
+		self.client = client
+		self.concurrency = concurrency
+		self.bucket = bucket or TokenBucket(rate, burst, daily_quota)
+		self.inflight: Dict[Hashable, asyncio.Future] = {}
+		self.requests = 0
+		self.coalesced = 0
+		# Semaphores & futures belong to the event loop they were made in, so each loop gets its own
+		self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+		self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix='babelnet')
+		self._loop: Optional[asyncio.AbstractEventLoop] = None
+		self._loop_lock = threading.Lock()
+
+	async def _call(self, method: str, *args) -> Any:
+		loop = asyncio.get_running_loop()
+		key = (loop, method, *args)
+		if key in self.inflight:
+			self.coalesced += 1
+			return await asyncio.shield(self.inflight[key])
+		future = loop.create_future()
+		self.inflight[key] = future
+		try:
+			result = await self._request(method, *args)
+			future.set_result(result)
+			return result
+		except BaseException as e:
+			future.set_exception(e)
+			future.exception() # Marks the exception as retrieved when no one else is waiting
+			raise
+		finally:
+			del self.inflight[key]
+
+	async def _request(self, method: str, *args) -> Any:
+		loop = asyncio.get_running_loop()
+		with self._loop_lock:
+			semaphore = self._semaphores.get(loop)
+			if semaphore is None:
+				self._semaphores = {other: semaphore for other, semaphore in self._semaphores.items() if not other.is_closed()}
+				semaphore = self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+		is_cached = getattr(self.client, 'is_cached', None)
+		async with semaphore:
+			if is_cached is None or not is_cached(method, *args):
+				if not getattr(self.client, 'rate_limited', False):
+					await self.bucket.acquire()
+				self.requests += 1
+			function: Callable = getattr(self.client, method)
+			return await loop.run_in_executor(self._executor, function, *args)
+
+	async def get_synset(self, babel_id):
+		return await self._call('get_synset', babel_id)
+
+	async def get_wiki_synset(self, wiki_id: str):
+		return await self._call('get_wiki_synset', wiki_id.lower())
+
+	async def search_synsets(self, name: str) -> list:
+		return await self._call('search_synsets', name)
+
+	async def get_synsets(self, babel_ids: Iterable, return_exceptions=False) -> list:
+		"""Synsets for each id, in order. With return_exceptions, failed fetches are returned as their exception instead of failing the rest"""
+		return await asyncio.gather(*(self.get_synset(babel_id) for babel_id in babel_ids), return_exceptions=return_exceptions)
+
+	async def get_wiki_synsets(self, wiki_ids: Iterable[str]) -> list:
+		"""Synsets for each Wikipedia title (None for titles that aren't concepts), in order"""
+		return await asyncio.gather(*(self.get_wiki_synset(wiki_id) for wiki_id in wiki_ids))
+
+	def run(self, coroutine: Awaitable[T]) -> T:
+		"""Blocks until the coroutine finishes on the background event loop"""
+		with self._loop_lock:
+			if self._loop is None:
+				self._loop = asyncio.new_event_loop()
+				threading.Thread(target=self._loop.run_forever, name='babelnet-loop', daemon=True).start()
+		return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+	def stats(self) -> Dict[str, int]:
+		return {'requests': self.requests, 'coalesced': self.coalesced, 'used_today': self.bucket.used_today}
+
+	def close(self) -> None:
+		if self._loop is not None:
+			self._loop.call_soon_threadsafe(self._loop.stop)
+			self._loop = None
+		self._executor.shutdown()
+
+
+async def benchmark(babelnet: AsyncBabelNet, wiki_ids: List[str]) -> Dict[str, float]:
+	"""Throughput of fetching the titles' synsets, with repeated titles coalesced"""
+	start = time.perf_counter()
+	synsets = await babelnet.get_wiki_synsets(wiki_ids)
+	elapsed = time.perf_counter() - start
+	found = sum(synset is not None for synset in synsets)
+	return {'titles': len(wiki_ids), 'found': found, 'seconds': elapsed, 'titles_per_sec': len(wiki_ids) / max(elapsed, 1e-9), **babelnet.stats()}
+
+
+if __name__ == '__main__':
+	from fake_babelnet import FakeBabelNet
+	titles = [f'Category_{i % 500}' for i in range(2000)]
+	for concurrency in (1, 8, 32):
+		babelnet = AsyncBabelNet(FakeBabelNet(latency=0.02), concurrency=concurrency, rate=1000, burst=1000, daily_quota=None)
+		print(concurrency, asyncio.run(benchmark(babelnet, titles)))
+		babelnet.close()
@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from category_map import CategoryMap
+from category_map_generation import generate_category_map, get_category_depth, get_category_map, get_child_tree, get_raw_relations, make_graph_acyclic
+from fake_babelnet import FakeBabelNet, FakeBabelNetAPI
+from sqldump_to_csv import benchmark_parsers
+from synthetic_data import synthetic_category_links, synthetic_categorylinks_dump, synthetic_clickstream
+
+
+def best_of(function: Callable[[], Any], repeat=3) -> float:
+	"""Best wall time of repeat calls, in seconds"""
+	best = float('inf')
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		best = min(best, time.perf_counter() - start)
+	return best
+
+def _parent_tree(num_categories: int, seed=0) -> Dict[str, set]:
+	links = synthetic_category_links(num_categories, seed=seed)
+	return links.groupby('item')['category'].apply(set).to_dict()
+
+def synset_like_workload(categories: List[str], num_queries=2000, candidates=5, zipf=1.3, seed=0) -> List[Tuple[List[str], List[List[str]]]]:
+	"""
+	Queries shaped like find_synset_like's: a gloss' categories & the category lists of each candidate synset.
+	Categories are drawn from a Zipf distribution, so a few (like Control_theory in a real crawl) appear in most queries.
+	"""
+	rng = np.random.default_rng(seed)
+	def sample(size: int) -> List[str]:
+		ranks = np.minimum(rng.zipf(zipf, size=size), len(categories)) - 1
+		return [categories[rank] for rank in ranks]
+	return [(sample(rng.integers(2, 7)), [sample(rng.integers(1, 5)) for _ in range(rng.integers(1, candidates + 1))]) for _ in range(num_queries)]
+
+@contextmanager
+def offline_babelnet(fake: FakeBabelNet, cache_path: str) -> Iterator[None]:
+	"""Points synset_retriever's BabelNet calls at a FakeBabelNet, with a fresh synset cache & no rate limit or quota"""
+	import synset_retriever
+	from async_babelnet import TokenBucket
+	from synset_cache import SynsetCache
+	from babelnet.synset import SynsetType
+	from babelnet.resources import BabelSynsetID
+	saved = synset_retriever.bn, synset_retriever.cache, synset_retriever.limiter
+	synset_retriever.bn = FakeBabelNetAPI(fake)
+	synset_retriever.limiter = TokenBucket(rate=1e9, capacity=10**9) # Not counted against the real day's usage
+	synset_retriever.cache = SynsetCache(cache_path, id_factory=BabelSynsetID, type_factory=SynsetType.__getitem__)
+	try:
+		yield
+	finally:
+		synset_retriever.cache.close()
+		synset_retriever.bn, synset_retriever.cache, synset_retriever.limiter = saved
+
+def _unlimited_fetcher():
+	"""Async BabelNet layer without the rate limit & daily quota, which would otherwise dominate the timings"""
+	from async_babelnet import AsyncBabelNet
+	from synset_retriever import BabelNetClient
+	return AsyncBabelNet(BabelNetClient(), rate=1e9, burst=10**9, daily_quota=None)
+
+
+def benchmark_category_graph(num_categories=100_000, repeat=3, seed=0) -> Dict[str, Any]:
+	"""Times get_category_depth & make_graph_acyclic on a synthetic category graph"""
+	links = synthetic_category_links(num_categories, seed=seed)
+	children = get_child_tree(links)
+	depths = get_category_depth(children)
+	return {'categories': len(children), 'links': len(links),
+	        'seconds': {'get_category_depth': best_of(lambda: get_category_depth(children), repeat),
+	                    'make_graph_acyclic': best_of(lambda: make_graph_acyclic(links, depths), repeat)}}
+
+def peak_memory(function: Callable[[], Any]) -> int:
+	"""Peak memory traced while calling function, in bytes (tracing slows it down, so it's timed separately)"""
+	tracemalloc.start()
+	try:
+		function()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+def benchmark_category_map_generation(directory: str, num_categories=100_000, repeat=3, seed=0) -> Dict[str, Any]:
+	"""Times & traces the peak memory of a full category map rebuild from a raw relations TSV, through the string-keyed & integer-coded pipelines"""
+	source_path = os.path.join(directory, 'enwiki-categories.tsv')
+	synthetic_category_links(num_categories, seed=seed).assign(relation='subcat').to_csv(source_path, sep='\t', index=False)
+	def integer_coded() -> None:
+		output = tempfile.mkdtemp(dir=directory) # Empty, so the map is rebuilt rather than read back
+		get_category_map(source_path, os.path.join(output, 'valid_category_links.tsv'), os.path.join(output, 'category_depths.tsv'), os.path.join(output, 'category_graph'))
+	def string_keyed() -> None: # get_category_map before integer codes
+		output = tempfile.mkdtemp(dir=directory)
+		links, depths = generate_category_map(get_raw_relations(source_path))
+		links.to_csv(os.path.join(output, 'valid_category_links.tsv'), sep='\t', index=False)
+		depths.to_csv(os.path.join(output, 'category_depths.tsv'), sep='\t')
+	pipelines = {'string_keyed': string_keyed, 'integer_coded': integer_coded}
+	return {'categories': num_categories,
+	        'seconds': {name: best_of(pipeline, repeat) for name, pipeline in pipelines.items()},
+	        'peak_megabytes': {name: peak_memory(pipeline) / 2**20 for name, pipeline in pipelines.items()}}
+
+def benchmark_category_memo(num_categories=100_000, num_queries=2000, memo_size=100_000, seed=0) -> Dict[str, Dict]:
+	"""Times the find_synset_like workload (batch commonality, distances & root paths) with & without CategoryMap's memo"""
+	tree = _parent_tree(num_categories, seed)
+	rng = np.random.default_rng(seed)
+	categories = list(rng.permutation(sorted(tree)))
+	workload = synset_like_workload(categories, num_queries, seed=seed)
+	results = {}
+	for name, size in (('no_memo', None), ('memo', memo_size)):
+		category_map = CategoryMap(memo_size=size, categories=tree)
+		category_map.index # Built outside of the timings
+		timings = {}
+		start = time.perf_counter()
+		for reference, candidate_lists in workload:
+			category_map.batch_commonality(reference, candidate_lists)
+		timings['batch_commonality'] = time.perf_counter() - start
+		start = time.perf_counter()
+		for reference, candidate_lists in workload:
+			for candidate_list in candidate_lists:
+				category_map.categorical_commonality(candidate_list, reference)
+		timings['categorical_commonality'] = time.perf_counter() - start
+		start = time.perf_counter()
+		for reference, _ in workload:
+			for category in reference:
+				category_map.category_path(category, category_map.root)
+		timings['category_path'] = time.perf_counter() - start
+		results[name] = {'seconds': timings, 'memo': category_map.memo_stats()}
+	return results
+
+def benchmark_candidate_prefilter(num_categories=100_000, num_queries=2000, candidates=(30, 1_000), shortlist=4, seed=0) -> Dict[str, Any]:
+	"""
+	Times CategoryMap.best_candidate with & without the signature shortlist, counting the candidates scored exactly by each.
+	Each number of candidates per query gets its own workload, with as many candidates in total as num_queries * candidates[0].
+	"""
+	from instrumentation import instrumentation
+	tree = _parent_tree(num_categories, seed)
+	rng = np.random.default_rng(seed)
+	categories = list(rng.permutation(sorted(tree)))
+	results = {}
+	for num_candidates in candidates:
+		queries = max(num_queries * candidates[0] // num_candidates, 1)
+		workload = synset_like_workload(categories, queries, num_candidates, zipf=1.1, seed=seed)
+		timings, chosen = {}, {}
+		for name, size in (('exact', None), ('shortlist', shortlist)):
+			category_map = CategoryMap(categories=tree, shortlist=size)
+			category_map.index
+			instrumentation.enable()
+			start = time.perf_counter()
+			chosen[name] = [category_map.best_candidate(reference, candidate_lists) for reference, candidate_lists in workload]
+			seconds = time.perf_counter() - start
+			scored = instrumentation.counters.get('category_map.candidates_scored', 0)
+			instrumentation.disable()
+			timings[name] = {'seconds': seconds, 'candidates_scored': scored}
+		timings['queries'] = queries
+		timings['candidates'] = sum(len(candidate_lists) for _, candidate_lists in workload)
+		timings['same_choice'] = chosen['exact'] == chosen['shortlist']
+		results[f'{num_candidates}_candidates'] = timings
+	return results
+
+def benchmark_clickthrough_rates(directory: str, num_articles=100_000, num_queries=10_000, repeat=3, seed=0) -> Dict[str, Any]:
+	"""Times building the clickstream store from a synthetic TSV, then WikiMap.get_clickthrough_rates on random articles"""
+	from wiki_clickthrough_map import WikiMap
+	titles = [f'Category_{i}' for i in range(1, num_articles)]
+	path = os.path.join(directory, 'clickstream.tsv')
+	synthetic_clickstream(path, titles, seed=seed)
+	start = time.perf_counter()
+	wiki = WikiMap(path, cache_dir=os.path.join(directory, 'clickstream'))
+	build = time.perf_counter() - start
+	queries = [titles[i].lower() for i in np.random.default_rng(seed).integers(len(titles), size=num_queries)]
+	def query() -> None:
+		for title in queries:
+			try:
+				wiki.get_clickthrough_rates(title, source_normalized=True)
+			except ValueError: # No links from the article
+				pass
+	return {'articles': len(titles), 'links': len(wiki.store.targets), 'queries': num_queries,
+	        'seconds': {'build_store': build, 'get_clickthrough_rates': best_of(query, repeat)}}
+
+def benchmark_parse_values(directory: str, num_rows=100_000, repeat=3, seed=0) -> Dict[str, Any]:
+	"""Times each SQL dump parser (parse_values, tokenize_values, ...) on a synthetic categorylinks dump"""
+	path = os.path.join(directory, 'categorylinks.sql')
+	synthetic_categorylinks_dump(path, num_rows, rows_per_insert=1000, seed=seed)
+	return {'rows': num_rows, 'parsers': benchmark_parsers(path, max_lines=num_rows // 1000 + 1, repeat=repeat)}
+
+def benchmark_find_synset_like(directory: str, num_categories=100_000, num_queries=2000, repeat=3, seed=0) -> Dict[str, Any]:
+	"""Times find_synset_like against a FakeBabelNet, first with an empty synset cache then with a warm one"""
+	from synset_retriever import SynsetRetriever
+	tree = _parent_tree(num_categories, seed)
+	fake = FakeBabelNet(num_categories=num_categories, latency=0)
+	rng = np.random.default_rng(seed)
+	workload = synset_like_workload(list(rng.permutation(sorted(tree))), num_queries, seed=seed)
+	names = [fake.vocabulary[i].lower() for i in rng.integers(len(fake.vocabulary), size=num_queries)]
+	with offline_babelnet(fake, os.path.join(directory, 'find_synset_like.sqlite')):
+		retriever = SynsetRetriever()
+		retriever.category_map = CategoryMap(categories=tree)
+		retriever.category_map.index
+		def run() -> None:
+			for name, (reference, _) in zip(names, workload):
+				retriever.find_synset_like(name, reference)
+		cold = best_of(run, repeat=1)
+		calls = fake.calls
+		warm = best_of(run, repeat)
+		retriever.fetcher.close()
+	return {'queries': num_queries, 'api_calls': calls, 'seconds': {'cold_cache': cold, 'warm_cache': warm}}
+
+def benchmark_get_concept(directory: str, num_concepts=50, num_categories=10_000, definition_limit=3, latency=0.0, seed=0) -> Dict[str, Any]:
+	"""
+	Times PrerequisiteMap.get_concept end to end (spaCy, synset search, categories & clickthrough topic sets)
+	for random seed articles, against a FakeBabelNet with latency seconds per call & a synthetic clickstream
+	"""
+	from lazy import Lazy
+	from concept_model import PrerequisiteMap
+	from wiki_clickthrough_map import WikiMap
+	tree = _parent_tree(num_categories, seed)
+	fake = FakeBabelNet(num_categories=num_categories, latency=latency)
+	path = os.path.join(directory, 'get_concept_clickstream.tsv')
+	synthetic_clickstream(path, fake.vocabulary, seed=seed)
+	titles = [fake.vocabulary[i] for i in np.random.default_rng(seed).permutation(len(fake.vocabulary))[:num_concepts * 2]]
+	with offline_babelnet(fake, os.path.join(directory, 'get_concept.sqlite')):
+		prereq_map = PrerequisiteMap()
+		prereq_map.babel.fetcher.close()
+		prereq_map.babel.fetcher = _unlimited_fetcher()
+		prereq_map.babel.category_map = CategoryMap(categories=tree)
+		prereq_map._wiki = Lazy('clickstream', lambda: WikiMap(path, cache_dir=os.path.join(directory, 'get_concept_clickstream')))
+		# Loaded outside of the timings
+		prereq_map.category_map.index, prereq_map.wiki, prereq_map.nouns.nlp
+		synsets = [synset for synset in prereq_map.babel.get_wiki_synsets(titles) if synset is not None][:num_concepts]
+		calls = fake.calls
+		start = time.perf_counter()
+		for synset in synsets:
+			prereq_map.get_concept(synset, definition_limit)
+		seconds = time.perf_counter() - start
+		prereq_map.babel.fetcher.close()
+	return {'concepts': len(synsets), 'api_calls': fake.calls - calls, 'prereq_edges': prereq_map.dag.stats()['edges'],
+	        'seconds': {'get_concept': seconds, 'per_concept': seconds / max(len(synsets), 1)}}
+
+
+def run_suite(directory: str, scale=1.0, repeat=3, only: Optional[List[str]] = None, seed=0) -> Dict[str, Any]:
+	"""Runs the benchmarks (or only those named), at scale times the default data sizes"""
+	benchmarks = {
+		'category_graph': lambda: benchmark_category_graph(int(100_000 * scale), repeat, seed),
+		'category_map_generation': lambda: benchmark_category_map_generation(directory, int(100_000 * scale), repeat, seed),
+		'categorical_commonality': lambda: benchmark_category_memo(int(100_000 * scale), int(2000 * scale), seed=seed),
+		'candidate_prefilter': lambda: benchmark_candidate_prefilter(int(100_000 * scale), int(2000 * scale), seed=seed),
+		'clickthrough_rates': lambda: benchmark_clickthrough_rates(directory, int(100_000 * scale), int(10_000 * scale), repeat, seed),
+		'parse_values': lambda: benchmark_parse_values(directory, int(100_000 * scale), repeat, seed),
+		'find_synset_like': lambda: benchmark_find_synset_like(directory, int(100_000 * scale), int(2000 * scale), repeat, seed),
+		'get_concept': lambda: benchmark_get_concept(directory, max(int(50 * scale), 1), int(10_000 * scale), seed=seed),
+	}
+	results = {}
+	for name, benchmark in benchmarks.items():
+		if only and name not in only:
+			continue
+		print(f'Running {name}...', file=sys.stderr)
+		try:
+			results[name] = benchmark()
+		except (ImportError, OSError) as e: # i.e. babelnet or the spaCy model isn't installed
+			results[name] = {'error': repr(e)}
+	return {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'numpy': np.__version__,
+	                 'platform': platform.platform(), 'scale': scale, 'repeat': repeat, 'seed': seed},
+	        'results': results}
+
+def _timings(results: Any, prefix='') -> Dict[str, float]:
+	"""Flattens the timings (entries under a 'seconds' key) of a suite's results"""
+	timings = {}
+	if isinstance(results, dict):
+		for key, value in results.items():
+			if key == 'seconds' and isinstance(value, dict):
+				timings.update({f'{prefix}{step}': seconds for step, seconds in value.items()})
+			elif key == 'seconds':
+				timings[prefix.rstrip('.')] = value
+			else:
+				timings.update(_timings(value, f'{prefix}{key}.'))
+	return timings
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any], threshold=1.1) -> List[str]:
+	"""Lines comparing each timing to the baseline's, marking those slower by more than threshold times"""
+	old, new = _timings(baseline['results']), _timings(results['results'])
+	lines = []
+	for name in sorted(old.keys() & new.keys()):
+		ratio = new[name] / max(old[name], 1e-12)
+		lines.append(f"{name}: {old[name]:.4f}s -> {new[name]:.4f}s ({ratio:.2f}x){'  REGRESSION' if ratio > threshold else ''}")
+	return lines
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks the hot paths of the prerequisite map pipeline on synthetic data')
+	parser.add_argument('--scale', type=float, default=1.0, help='Multiplies the default data sizes (100k categories, articles & dump rows)')
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--only', nargs='*', help='Names of the benchmarks to run')
+	parser.add_argument('--out', default=f"datasets/benchmarks/{time.strftime('%Y%m%d-%H%M%S')}.json")
+	parser.add_argument('--compare', help='Results JSON of an earlier run to compare against')
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.ERROR)
+	with tempfile.TemporaryDirectory() as directory:
+		results = run_suite(directory, args.scale, args.repeat, args.only)
+	os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+	with open(args.out, 'w') as f:
+		json.dump(results, f, indent=2)
+	for name, seconds in _timings(results['results']).items():
+		print(f'{name}: {seconds:.4f}s')
+	print(f'Saved to {args.out}')
+	if args.compare:
+		with open(args.compare) as f:
+			print('\n'.join(compare(json.load(f), results)))
@@ -0,0 +1,273 @@
+import os
+import numpy as np
+import pandas as pd
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+class StringTable(Sequence):
+	"""
+	Sorted table of unique strings, stored as a single utf-8 blob plus offsets so it can be memory-mapped.
+	The position of a string in the table is its integer id.
+	"""
+	def __init__(self, blob: np.ndarray, offsets: np.ndarray) -> None:
+		self.blob = blob
+		self.offsets = offsets
+		self._bytes = memoryview(blob)
+
+	@classmethod
+	def from_strings(cls, strings: Iterable[str]) -> 'StringTable':
+		"""Strings must already be sorted and unique"""
+		encoded = [string.encode('utf-8') for string in strings]
+		offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+		np.cumsum([len(string) for string in encoded], out=offsets[1:])
+		blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+		return cls(blob, offsets)
+
+	def __len__(self) -> int:
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i: int) -> str:
+		if i < 0:
+			i += len(self)
+		return bytes(self._bytes[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+	def __iter__(self) -> Iterator[str]:
+		for i in range(len(self)):
+			yield self[i]
+
+	def __contains__(self, string: object) -> bool:
+		return isinstance(string, str) and self.lookup(string) >= 0
+
+	def lookup(self, string: str) -> int:
+		"""Returns the id of a string, or -1 if it isn't in the table"""
+		i = bisect_left(self, string)
+		if i < len(self) and self[i] == string:
+			return i
+		return -1
+
+	def lookup_many(self, strings: Iterable[str]) -> np.ndarray:
+		return np.array([self.lookup(string) for string in strings], dtype=np.int64)
+
+	def save(self, path: str, prefix: str) -> None:
+		np.save(os.path.join(path, f'{prefix}_blob.npy'), self.blob)
+		np.save(os.path.join(path, f'{prefix}_offsets.npy'), self.offsets)
+
+	@classmethod
+	def load(cls, path: str, prefix: str, mmap_mode='r') -> 'StringTable':
+		blob = np.load(os.path.join(path, f'{prefix}_blob.npy'), mmap_mode=mmap_mode)
+		offsets = np.load(os.path.join(path, f'{prefix}_offsets.npy'), mmap_mode=mmap_mode)
+		return cls(blob, offsets)
+
+
+def csr_positions(offsets: np.ndarray, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""Returns the number of edges leaving each of the given nodes of a CSR adjacency, and the positions of those edges"""
+	starts, counts = offsets[nodes], offsets[nodes + 1] - offsets[nodes]
+	first = np.cumsum(counts) - counts
+	return counts, np.arange(counts.sum(), dtype=np.int64) - np.repeat(first - starts, counts)
+
+def gather_csr(offsets: np.ndarray, targets: np.ndarray, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""Returns (source, target) pairs for every edge leaving the given nodes of a CSR adjacency"""
+	counts, positions = csr_positions(offsets, nodes)
+	return np.repeat(nodes, counts), targets[positions]
+
+def transpose_csr(offsets: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	size = len(offsets) - 1
+	sources = np.repeat(np.arange(size, dtype=np.int64), np.diff(offsets))
+	order = np.argsort(targets, kind='stable')
+	transposed = np.zeros(size + 1, dtype=np.int64)
+	np.cumsum(np.bincount(targets, minlength=size), out=transposed[1:])
+	return transposed, sources[order].astype(np.int32)
+
+def level_order(offsets: np.ndarray, targets: np.ndarray, roots: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""
+	Level-synchronous BFS over a CSR adjacency, in O(V + E).
+	Returns the shortest depth of every node from the roots (-1 if unreachable)
+	and the node it was first reached from (the lowest id on the previous level, -1 for roots & unreachable nodes).
+	"""
+	depths = np.full(len(offsets) - 1, -1, dtype=np.int32)
+	previous = np.full(len(offsets) - 1, -1, dtype=np.int32)
+	frontier = np.unique(np.asarray(roots, dtype=np.int64))
+	depths[frontier] = 0
+	level = 0
+	while len(frontier):
+		level += 1
+		sources, reached = gather_csr(offsets, targets, frontier)
+		new = depths[reached] < 0
+		sources, reached = sources[new], reached[new]
+		order = np.lexsort((sources, reached))
+		reached, first = np.unique(reached[order], return_index=True)
+		depths[reached] = level
+		previous[reached] = sources[order][first]
+		frontier = reached.astype(np.int64)
+	return depths, previous
+
+
+class CategoryGraph(Mapping):
+	"""
+	Integer-coded replacement for the parent tree dictionary (category -> set of parent categories).
+	Category names are interned into a StringTable and parents are stored in CSR form:
+	the parents of category i are parents[offsets[i]:offsets[i + 1]].
+	"""
+	files = ('names_blob.npy', 'names_offsets.npy', 'offsets.npy', 'parents.npy')
+
+	def __init__(self, names: StringTable, offsets: np.ndarray, parents: np.ndarray) -> None:
+		self.names = names
+		self.offsets = offsets
+		self.parents = parents
+
+	@classmethod
+	def from_links(cls, items: pd.Series, categories: pd.Series) -> 'CategoryGraph':
+		"""Builds the graph from item -> category relations (i.e. the columns of valid_category_links.tsv)"""
+		codes, names = pd.factorize(pd.concat([items, categories], ignore_index=True), sort=True)
+		item_ids, parent_ids = codes[:len(items)], codes[len(items):]
+		valid = (item_ids >= 0) & (parent_ids >= 0) # Drops missing titles, like groupby does
+		return cls.from_codes(names, item_ids[valid], parent_ids[valid])
+
+	@classmethod
+	def from_parent_tree(cls, tree: Mapping[str, Iterable[str]]) -> 'CategoryGraph':
+		names = sorted(set(tree.keys()).union(*tree.values()))
+		ids = {name: i for i, name in enumerate(names)}
+		item_ids = np.array([ids[item] for item, parents in tree.items() for _ in parents], dtype=np.int64)
+		parent_ids = np.array([ids[parent] for parents in tree.values() for parent in parents], dtype=np.int64)
+		return cls.from_codes(names, item_ids, parent_ids)
+
+	@classmethod
+	def from_codes(cls, names: Iterable[str], item_ids: np.ndarray, parent_ids: np.ndarray) -> 'CategoryGraph':
+		"""Names must be sorted and unique, with ids indexing into them"""
+		names = StringTable.from_strings(names)
+		order = np.lexsort((parent_ids, item_ids))
+		item_ids, parent_ids = item_ids[order], parent_ids[order]
+		duplicate = np.zeros(len(item_ids), dtype=bool)
+		duplicate[1:] = (item_ids[1:] == item_ids[:-1]) & (parent_ids[1:] == parent_ids[:-1])
+		item_ids, parent_ids = item_ids[~duplicate], parent_ids[~duplicate]
+		offsets = np.zeros(len(names) + 1, dtype=np.int64)
+		np.cumsum(np.bincount(item_ids, minlength=len(names)), out=offsets[1:])
+		return cls(names, offsets, parent_ids.astype(np.int32))
+
+	@classmethod
+	def exists(cls, path: str) -> bool:
+		return all(os.path.exists(os.path.join(path, file)) for file in cls.files)
+
+	def save(self, path: str) -> None:
+		os.makedirs(path, exist_ok=True)
+		self.names.save(path, 'names')
+		np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+		np.save(os.path.join(path, 'parents.npy'), self.parents)
+
+	@classmethod
+	def load(cls, path: str, mmap_mode='r') -> 'CategoryGraph':
+		names = StringTable.load(path, 'names', mmap_mode)
+		offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode)
+		parents = np.load(os.path.join(path, 'parents.npy'), mmap_mode=mmap_mode)
+		return cls(names, offsets, parents)
+
+	def parent_ids(self, category_id: int) -> np.ndarray:
+		return self.parents[self.offsets[category_id]:self.offsets[category_id + 1]]
+
+	def __getitem__(self, category: str) -> Tuple[str, ...]:
+		category_id = self.names.lookup(category)
+		if category_id < 0:
+			raise KeyError(category)
+		return tuple(self.names[parent_id] for parent_id in self.parent_ids(category_id))
+
+	def __contains__(self, category: object) -> bool:
+		return category in self.names
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self.names)
+
+	def __len__(self) -> int:
+		return len(self.names)
+
+
+class AncestorIndex:
+	"""
+	Precomputed index for answering root path & distance queries in O(log depth).
+	Every category is assigned a single shortest path to the root (choosing the lowest id parent on ties),
+	which turns the category DAG into a tree where distances come from lowest common ancestors (via binary lifting).
+	Each category's signature is its ancestor signature_depth levels below the root (or itself, if shallower),
+	which bounds distances without walking the tree: categories with different signatures meet above that depth.
+	"""
+	def __init__(self, graph: CategoryGraph, root: str, signature_depth=2) -> None:
+		self.graph = graph
+		self.root = root
+		self.signature_depth = signature_depth
+		root_id = graph.names.lookup(root)
+		if root_id < 0:
+			raise ValueError(f"Root category not found: {root}")
+		child_offsets, children = transpose_csr(graph.offsets, graph.parents)
+		self.depths, self.parents = level_order(child_offsets, children, np.array([root_id]))
+		# Roots and unconnected categories point to themselves, so jumps never leave the table
+		parents = np.where(self.parents < 0, np.arange(len(graph), dtype=np.int32), self.parents)
+		self.jumps = [parents]
+		for _ in range(1, max(1, int(self.depths.max()).bit_length())):
+			self.jumps.append(self.jumps[-1][self.jumps[-1]])
+		self.signatures = self.climb(np.arange(len(graph)), np.maximum(self.depths - signature_depth, 0))
+
+	def ids(self, categories: Iterable[str]) -> np.ndarray:
+		"""Category ids, with -1 for unknown categories"""
+		return self.graph.names.lookup_many(categories)
+
+	def connected(self, ids: np.ndarray) -> np.ndarray:
+		"""Whether each category id has a path to the root (the root itself has none, like category_path)"""
+		ids = np.asarray(ids)
+		return (ids >= 0) & (self.depths[ids] > 0)
+
+	def in_root(self, category: str) -> bool:
+		return bool(self.connected(self.ids([category]))[0])
+
+	def path_to_root(self, category: str) -> Optional[List[str]]:
+		"""Mirrors CategoryMap.category_path(category, root), excluding the category itself"""
+		category_id = self.graph.names.lookup(category)
+		if category_id < 0 or self.depths[category_id] <= 0:
+			return None
+		path = []
+		while self.parents[category_id] >= 0:
+			category_id = self.parents[category_id]
+			path.append(self.graph.names[category_id])
+		return path
+
+	def climb(self, ids: np.ndarray, levels: np.ndarray) -> np.ndarray:
+		"""Ancestors the given number of levels above each category id"""
+		ids, levels = np.broadcast_arrays(np.asarray(ids), np.asarray(levels))
+		for level, jump in enumerate(self.jumps):
+			ids = np.where((levels >> level) & 1, jump[ids], ids)
+		return ids
+
+	def lowest_common_ancestors(self, ids1: np.ndarray, ids2: np.ndarray) -> np.ndarray:
+		"""Element-wise LCA of two broadcastable arrays of connected category ids"""
+		ids1, ids2 = np.broadcast_arrays(np.asarray(ids1), np.asarray(ids2))
+		swap = self.depths[ids1] < self.depths[ids2]
+		deep, shallow = np.where(swap, ids2, ids1), np.where(swap, ids1, ids2)
+		deep = self.climb(deep, self.depths[deep] - self.depths[shallow])
+		for jump in reversed(self.jumps):
+			differ = jump[deep] != jump[shallow]
+			deep, shallow = np.where(differ, jump[deep], deep), np.where(differ, jump[shallow], shallow)
+		return np.where(deep == shallow, deep, self.jumps[0][deep])
+
+	def distance_ids(self, ids1: np.ndarray, ids2: np.ndarray) -> np.ndarray:
+		"""Number of categories on the path between the two categories, through their lowest common ancestor"""
+		ids1, ids2 = np.broadcast_arrays(np.asarray(ids1), np.asarray(ids2))
+		common = self.lowest_common_ancestors(ids1, ids2)
+		return self.depths[ids1] + self.depths[ids2] - 2 * self.depths[common] + 1
+
+	def distance_lower_bounds(self, ids1: np.ndarray, ids2: np.ndarray) -> np.ndarray:
+		"""Lower bounds of distance_ids from depths & signatures alone: the common ancestor is no deeper than either category, or the signatures if they differ"""
+		ids1, ids2 = np.broadcast_arrays(np.asarray(ids1), np.asarray(ids2))
+		depths1, depths2 = self.depths[ids1], self.depths[ids2]
+		common = np.minimum(depths1, depths2)
+		common = np.where(self.signatures[ids1] == self.signatures[ids2], common, np.minimum(common, self.signature_depth - 1))
+		return depths1 + depths2 - 2 * common + 1
+
+	def distances(self, categories1: List[str], categories2: List[str], ids1: Optional[np.ndarray] = None,
+	              ids2: Optional[np.ndarray] = None) -> np.ndarray:
+		"""Distance matrix between two lists of categories, which must be connected to the root (and their ids, if already looked up)"""
+		ids1 = self.ids(categories1) if ids1 is None else ids1
+		ids2 = self.ids(categories2) if ids2 is None else ids2
+		for categories, ids in ((categories1, ids1), (categories2, ids2)):
+			unconnected = [category for category, connected in zip(categories, self.connected(ids)) if not connected]
+			if len(unconnected):
+				raise ValueError(f"Categories not connected to root: {unconnected} -> {self.root}")
+		return self.distance_ids(ids1[:, None], ids2[None, :])
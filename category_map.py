@@ -1,26 +1,100 @@
 import logging
+import threading
 import numpy as np
+from itertools import chain
 from joblib import Memory
 from logging import getLogger
-from typing import Optional, List
+from typing import Any, Callable, Dict, Optional, List, Tuple
 
+from category_graph import AncestorIndex, CategoryGraph
+from lazy import Lazy
+from memo import MISSING, BoundedMemo
 from category_map_generation import get_category_map, get_parent_tree
+from instrumentation import instrumentation, timed
 
-memory = Memory("datasets/cache")
-
-@memory.cache
-def _get_parent_tree():
+def _read_parent_tree():
 	logging.info("Loading category tree...")
 	categorylinks, depths = get_category_map()
 	return get_parent_tree(categorylinks)
 
+def _get_parent_tree():
+	# The joblib cache (which creates its directory) is only set up when the tree is first needed, not on import
+	return Memory("datasets/cache").cache(_read_parent_tree)()
+
+def _get_category_graph(path = 'datasets/generated/category_graph') -> CategoryGraph:
+	"""Memory-mapped alternative to _get_parent_tree, built once from the category map"""
+	if CategoryGraph.exists(path):
+		return CategoryGraph.load(path)
+	categorylinks, depths = get_category_map(graph_path=path) # Saves the graph when the map is generated
+	if not CategoryGraph.exists(path): # The map was generated before graphs were saved alongside it
+		logging.info("Building compact category graph...")
+		CategoryGraph.from_links(categorylinks['item'], categorylinks['category']).save(path)
+	return CategoryGraph.load(path)
+
 
 class CategoryMap:
-	def __init__(self) -> None:
+	# Below this many candidate & reference category pairs, computing the bounds costs more than the scoring it saves
+	prune_min_pairs = 8_000
+
+	def __init__(self, compact=False, memo_size: Optional[int] = None, memo_policy='lru', categories=None,
+	             shortlist: Optional[int] = None, signature_depth=2) -> None:
+		"""
+		Set compact to use the integer-coded, memory-mapped CategoryGraph instead of the pickled dictionary.
+		Set memo_size to remember up to that many category ids & root paths (each), evicted by memo_policy.
+		Set shortlist to have best_candidate score that many candidates first, and prune the rest by their depth signature_depth ancestors.
+		categories can be given directly (i.e. for benchmarks) instead of being loaded from the datasets.
+		"""
 		self.logger = getLogger(__name__)
 		self.root = 'Main_topic_classifications' # Not using 'Contents' because it's too broad
-		self.categories = _get_parent_tree()
+		loader = (lambda: categories) if categories is not None else _get_category_graph if compact else _get_parent_tree
+		self._categories = Lazy('category map', loader)
+		self._index = Lazy('category ancestor index', self._build_index)
+		self.shortlist = shortlist
+		self.signature_depth = signature_depth
+		self.memo: Optional[Dict[str, BoundedMemo]] = None
+		if memo_size is not None:
+			self.memo = {name: BoundedMemo(memo_size, memo_policy) for name in ('ids', 'paths')}
+
+	@property
+	def categories(self):
+		"""Category -> parent categories, loaded on first use"""
+		return self._categories.get()
+
+	@property
+	def index(self) -> AncestorIndex:
+		"""Root depth & lowest common ancestor index, built on first use"""
+		return self._index.get()
+
+	def _build_index(self) -> AncestorIndex:
+		graph = self.categories if isinstance(self.categories, CategoryGraph) else CategoryGraph.from_parent_tree(self.categories)
+		return AncestorIndex(graph, self.root, self.signature_depth)
+
+	def warm_up(self) -> threading.Thread:
+		"""Loads the categories & builds the index in the background"""
+		return self._index.warm_up()
+
+	def memo_stats(self) -> Dict[str, Dict[str, Any]]:
+		return {} if self.memo is None else {name: memo.stats() for name, memo in self.memo.items()}
+
+	def clear(self) -> None:
+		"""Forgets all memoized ids, paths & distances"""
+		for memo in (self.memo or {}).values():
+			memo.clear()
+
+	def _ids(self, categories: List[str]) -> np.ndarray:
+		if self.memo is None:
+			return self.index.ids(categories)
+		memo = self.memo['ids']
+		ids = np.empty(len(categories), dtype=np.int64)
+		for i, category in enumerate(categories):
+			category_id = memo.get(category)
+			if category_id is MISSING:
+				category_id = self.index.graph.names.lookup(category)
+				memo.put(category, category_id)
+			ids[i] = category_id
+		return ids
 
+	@timed('category_map.categorical_commonality')
 	def categorical_commonality(self, category_list1: List[str], category_list2: List[str]) -> float:
 		"""
 		Returns commonality between two lists of categories, between 0 and 1.
@@ -29,10 +103,7 @@ class CategoryMap:
 		valid_cats2 = [cat for cat in category_list2 if self.category_in_root(cat)]
 		if len(valid_cats1) == 0 or len(valid_cats2) == 0:
 			return 0
-		distances = np.zeros((len(valid_cats1), len(valid_cats2)))
-		for i, cat1 in enumerate(valid_cats1):
-			for j, cat2 in enumerate(valid_cats2):
-				distances[i, j] = self.categorical_distance(cat1, cat2)
+		distances = self.distances(valid_cats1, valid_cats2)
 		# ? Use minimum values to include all axis, not just minimum of both axes (then divide by longer list length)
 		# ? Would this be better?
 		min_distances = np.min(distances, axis=0).tolist() + np.min(distances, axis=1).tolist()
@@ -40,30 +111,115 @@ class CategoryMap:
 		self.logger.debug(f"Commonality of {commonality:.2f} between category lists: {valid_cats1} & {valid_cats2}")
 		return commonality
 
+	@timed('category_map.batch_commonality')
+	def batch_commonality(self, categories: List[str], candidate_lists: List[List[str]]) -> np.ndarray:
+		"""
+		Returns the commonality of each candidate category list with the reference categories, in one vectorized pass.
+		Equivalent to [categorical_commonality(candidates, categories) for candidates in candidate_lists].
+		"""
+		reference, candidates, owners = self._candidate_ids(categories, candidate_lists)
+		return self._commonality_ids(reference, candidates, owners, len(candidate_lists), self.index.distance_ids)
+
+	def commonality_upper_bounds(self, categories: List[str], candidate_lists: List[List[str]]) -> np.ndarray:
+		"""Upper bounds of batch_commonality, from distance lower bounds that only need category depths & signatures"""
+		reference, candidates, owners = self._candidate_ids(categories, candidate_lists)
+		return self._commonality_ids(reference, candidates, owners, len(candidate_lists), self.index.distance_lower_bounds)
+
+	@timed('category_map.best_candidate')
+	def best_candidate(self, categories: List[str], candidate_lists: List[List[str]]) -> Tuple[int, float]:
+		"""
+		Index & commonality of the first candidate list with the highest (non-zero) commonality, or (-1, 0) if there is none.
+		With a shortlist, large batches are ranked by upper bounds of their commonality: the top shortlist are scored,
+		then only the candidates whose bound can beat (or tie earlier than) the best of them, so the same candidate is chosen.
+		"""
+		reference, candidates, owners = self._candidate_ids(categories, candidate_lists)
+		num_lists = len(candidate_lists)
+		if self.shortlist is None or num_lists <= self.shortlist or len(candidates) * len(reference) < self.prune_min_pairs:
+			commonalities = self._commonality_ids(reference, candidates, owners, num_lists, self.index.distance_ids)
+			scored = num_lists
+		else:
+			bounds = self._commonality_ids(reference, candidates, owners, num_lists, self.index.distance_lower_bounds)
+			order = np.argsort(-bounds, kind='stable') # Ties stay in candidate order
+			order = order[bounds[order] > 0]
+			commonalities = np.zeros(num_lists)
+			self._score_lists(order[:self.shortlist], commonalities, reference, candidates, owners)
+			best = int(np.argmax(commonalities))
+			rest = order[self.shortlist:]
+			rest = rest[(bounds[rest] > commonalities[best]) | ((bounds[rest] == commonalities[best]) & (rest < best))]
+			self._score_lists(rest, commonalities, reference, candidates, owners)
+			scored = min(len(order), self.shortlist) + len(rest)
+			instrumentation.count('category_map.candidates_pruned', num_lists - scored)
+		instrumentation.count('category_map.candidates_scored', scored)
+		best = int(np.argmax(commonalities)) if num_lists else -1 # argmax keeps the first of tied lists
+		return (best, float(commonalities[best])) if best >= 0 and commonalities[best] > 0 else (-1, 0.0)
+
+	def _score_lists(self, lists: np.ndarray, commonalities: np.ndarray, reference: np.ndarray, candidates: np.ndarray, owners: np.ndarray) -> None:
+		"""Fills in the exact commonalities of the given candidate lists"""
+		if len(lists) == 0:
+			return
+		selected = np.zeros(len(commonalities), dtype=bool)
+		selected[lists] = True
+		rows = selected[owners]
+		commonalities[lists] = self._commonality_ids(reference, candidates[rows], owners[rows], len(commonalities), self.index.distance_ids)[lists]
+
+	def _candidate_ids(self, categories: List[str], candidate_lists: List[List[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+		"""Ids of the reference & candidate categories connected to the root, and the index of the list each candidate is from"""
+		reference = self._ids(categories)
+		reference = reference[self.index.connected(reference)]
+		candidates = self._ids(list(chain.from_iterable(candidate_lists)))
+		owners = np.repeat(np.arange(len(candidate_lists)), [len(candidate_list) for candidate_list in candidate_lists])
+		valid = self.index.connected(candidates)
+		return reference, candidates[valid], owners[valid]
+
+	def _commonality_ids(self, reference: np.ndarray, candidates: np.ndarray, owners: np.ndarray, num_lists: int,
+	                     distance_ids: Callable[[np.ndarray, np.ndarray], np.ndarray]) -> np.ndarray:
+		commonalities = np.zeros(num_lists)
+		if len(reference) == 0 or len(candidates) == 0:
+			return commonalities
+		distances = distance_ids(candidates[:, None], reference[None, :])
+		# Each candidate list is a contiguous block of rows
+		starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+		counts = np.diff(np.r_[starts, len(candidates)]) + len(reference)
+		totals = np.add.reduceat(distances.min(axis=1), starts) + np.minimum.reduceat(distances, starts, axis=0).sum(axis=1)
+		commonalities[owners[starts]] = 1 / (totals / counts)
+		return commonalities
+
+	@timed('category_map.distances')
+	def distances(self, category_list1: List[str], category_list2: List[str]) -> np.ndarray:
+		"""
+		Returns the matrix of categorical distances between two lists of categories.
+		"""
+		if self.memo is None:
+			return self.index.distances(category_list1, category_list2)
+		# Looking up every pair in a memo costs more than computing the whole matrix from the (memoized) ids
+		return self.index.distances(category_list1, category_list2, self._ids(category_list1), self._ids(category_list2))
+
 	def categorical_distance(self, cat1: str, cat2: str) -> int:
-		path1 = self.category_path(cat1, self.root)
-		path2 = self.category_path(cat2, self.root)
-		if path1 is None or path2 is None:
-			raise ValueError(f"Category not connected to root: {cat1} & {cat2} -> {self.root}")
-		path1 = [cat1, *path1]
-		path2 = [cat2, *path2]
-		for i1, c1 in enumerate(path1):
-			for i2, c2 in enumerate(path2):
-				if c1 == c2:
-					return i1 + i2 + 1
-		raise ValueError(f"Categories not connected, but this should be impossible\nPaths:{path1}\n{path2})")
+		return int(self.distances([cat1], [cat2])[0, 0])
 
 	def category_in_root(self, category: str) -> bool:
-		return self.category_path(category, self.root) is not None
+		return bool(self.index.connected(self._ids([category]))[0])
 
+	@timed('category_map.category_path')
 	def category_path(self, child: str, parent: str) -> Optional[List[str]]:
+		if self.memo is None:
+			return self._category_path(child, parent)
+		path = self.memo['paths'].get((child, parent))
+		if path is MISSING:
+			path = self._category_path(child, parent)
+			self.memo['paths'].put((child, parent), None if path is None else tuple(path))
+		return None if path is None else list(path)
+
+	def _category_path(self, child: str, parent: str) -> Optional[List[str]]:
+		if parent == self.root:
+			return self.index.path_to_root(child)
 		parents = self.categories.get(child, [])
 		if len(parents) == 0:
 			return None
 		if parent in parents:
 			return [parent]
 		for category in parents:
-			path = self.category_path(category, parent)
+			path = self._category_path(category, parent)
 			if path is not None:
 				return [category, *path]
 
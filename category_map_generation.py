@@ -1,7 +1,14 @@
 import os
+import gzip
+import argparse
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from typing import Set, Dict, Mapping, Tuple
+from typing import Set, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+from category_graph import CategoryGraph, level_order, transpose_csr
+from sqldump_to_csv import parse_sql_file, tokenize_values
+from tsv_reader import read_tsv_chunks
 
 def get_child_tree(df: pd.DataFrame) -> Dict[str, set]:
 	parents = df.groupby('category')['item'].apply(set)
@@ -17,7 +24,27 @@ def get_parent_tree(df: pd.DataFrame) -> Dict[str, set]:
 	children = pd.concat([children, leafs])
 	return children.to_dict()
 
-def get_category_depth(children: Dict[str, set], root = 'Contents') -> Dict[str, int]: # Main_topic_classifications
+def get_category_depth(children: Dict[str, set], root: Union[str, Iterable[str]] = 'Contents') -> Dict[str, Optional[int]]: # Main_topic_classifications
+	"""
+	Shortest depth of every category below the root(s), or None if unreachable. Single BFS pass (seconds).
+	Where a category has a shortcut from the root, this is shallower than the original get_category_depth_recursive
+	(about a quarter of the categories on synthetic graphs), so make_graph_acyclic keeps the shortcut edges instead.
+	"""
+	roots = [root] if isinstance(root, str) else list(root)
+	names = list(children.keys())
+	ids = {name: i for i, name in enumerate(names)}
+	offsets = np.zeros(len(names) + 1, dtype=np.int64)
+	np.cumsum([len(items) for items in children.values()], out=offsets[1:])
+	targets = np.fromiter((ids[item] for items in children.values() for item in items), dtype=np.int64, count=offsets[-1])
+	depths, _ = level_order(offsets, targets, np.array([ids[root] for root in roots], dtype=np.int64))
+	return {name: (int(depth) if depth >= 0 else None) for name, depth in zip(names, depths)}
+
+def get_category_depth_recursive(children: Dict[str, set], root = 'Contents') -> Dict[str, Optional[int]]:
+	"""
+	Original re-walking DFS (~37 minutes on the full graph), kept unchanged as the reference for get_category_depth.
+	Its grandchild guard checks depth + 2 while the recursion assigns depth + 1, so on graphs with shortcuts it can leave
+	a category deeper than its shortest depth. get_category_depth never does, see test_category_depth.py
+	"""
 	depths = {category: None for category in children.keys()}
 	depths[root] = 0
 	pbar = tqdm(total=len(children))
@@ -51,11 +78,94 @@ def remove_hidden_categories(df: pd.DataFrame) -> pd.DataFrame:
 	hidden_categories = df[df['category'] == 'Hidden_categories']['item']
 	return df[~(df['item'].isin(hidden_categories) & df['category'].isin(hidden_categories))]
 
-def get_raw_relations(path = 'datasets/raw/enwiki-categories.tsv'):
-	df = pd.read_csv(path, sep='\t')
-	df.columns = ['item', 'category', 'relation'] # relation is always file, subcat, or page
-	df.drop(columns=['relation'], inplace=True)
-	return df
+def get_raw_relation_codes(path = 'datasets/raw/enwiki-categories.tsv', chunksize=1_000_000) -> Tuple[List[str], np.ndarray, np.ndarray]:
+	"""
+	Reads the raw relations as integer-coded (item, category) pairs, factorizing each chunk into a shared vocabulary so every title is only held once.
+	Returns the titles and the title ids of each relation's item and category (missing titles are dropped, like groupby does)
+	"""
+	vocabulary: Dict[str, int] = {}
+	items, categories = [], []
+	chunks = read_tsv_chunks(path, names=['item', 'category'], usecols=[0, 1], dtype={'item': str, 'category': str}, chunksize=chunksize, header=0)
+	def encode(column: pd.Series) -> np.ndarray:
+		codes, uniques = pd.factorize(column)
+		ids = np.fromiter((vocabulary.setdefault(title, len(vocabulary)) for title in np.asarray(uniques, dtype=object)), dtype=np.int64, count=len(uniques))
+		return np.append(ids, -1)[codes] # Missing titles (code -1) stay -1
+	for chunk in chunks:
+		item_ids, category_ids = encode(chunk.pop('item')), encode(chunk.pop('category'))
+		valid = (item_ids >= 0) & (category_ids >= 0)
+		items.append(item_ids[valid])
+		categories.append(category_ids[valid])
+	empty = np.array([], dtype=np.int64)
+	return list(vocabulary), np.concatenate(items or [empty]), np.concatenate(categories or [empty])
+
+def get_raw_relations(path = 'datasets/raw/enwiki-categories.tsv', chunksize=1_000_000) -> pd.DataFrame:
+	"""
+	The raw relations as an (item, category) frame, read through get_raw_relation_codes so each chunk is reduced to integer codes
+	before the next is read, and the frame's cells all reference the one copy of each title (relations missing a title are dropped).
+	The frame still holds every relation, so only the transient per-chunk strings are bounded (get_category_map avoids the frame).
+	Hidden categories are only known once every chunk is read, so generate_category_map still removes them
+	"""
+	names, items, categories = get_raw_relation_codes(path, chunksize)
+	names = np.array(names, dtype=object)
+	item = names[items]
+	del items
+	category = names[categories]
+	del categories
+	return pd.DataFrame({'item': item, 'category': category}, copy=False)
+
+def _read_dump(path: str) -> Iterator[str]:
+	# Multi-byte utf-8 characters never contain quotes, backslashes, commas or parentheses, so lines can be decoded whole
+	opener = gzip.open if path.endswith('.gz') else open
+	with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+		yield from f
+
+def get_dump_page_titles(path = 'datasets/raw/enwiki-latest-page.sql.gz', namespaces=(14,)) -> Tuple[np.ndarray, List[str]]:
+	"""Sorted page ids and their titles, for the pages in the given namespaces (14 = categories)"""
+	namespaces = {str(namespace) for namespace in namespaces}
+	page_ids, titles = [], []
+	rows = parse_sql_file(_read_dump(path), columns=[0, 1, 2], parser=tokenize_values) # page_id, page_namespace, page_title
+	for page_id, namespace, title in tqdm(rows, desc="Reading pages", unit=' pages', unit_scale=True):
+		if namespace in namespaces:
+			page_ids.append(page_id)
+			titles.append(title)
+	page_ids = np.array(page_ids, dtype=str).astype(np.int64)
+	order = np.argsort(page_ids)
+	return page_ids[order], [titles[i] for i in order]
+
+def get_dump_relations(page_path = 'datasets/raw/enwiki-latest-page.sql.gz',
+					   categorylinks_path = 'datasets/raw/enwiki-latest-categorylinks.sql.gz',
+					   relation_types=('subcat',), namespaces=(14,), chunksize=1_000_000) -> Tuple[List[str], np.ndarray, np.ndarray]:
+	"""
+	Streams the page & categorylinks dumps into integer-coded (item, category) relations, joining page ids to titles on the way.
+	Returns the titles and the title ids of each relation's item and category.
+	"""
+	page_ids, page_titles = get_dump_page_titles(page_path, namespaces)
+	if len(page_ids) == 0:
+		raise ValueError(f"No pages found in namespaces {namespaces}: {page_path}")
+	vocabulary: Dict[str, int] = {}
+	page_title_ids = np.array([vocabulary.setdefault(title, len(vocabulary)) for title in page_titles], dtype=np.int64)
+	del page_titles
+	relation_types = set(relation_types)
+	items, categories = [], []
+	def add_chunk(froms: List[str], tos: List[str]) -> None:
+		froms = np.array(froms, dtype=str).astype(np.int64)
+		positions = np.minimum(np.searchsorted(page_ids, froms), len(page_ids) - 1)
+		found = page_ids[positions] == froms # Pages outside the namespaces are dropped
+		items.append(page_title_ids[positions[found]])
+		categories.append(np.array([vocabulary.setdefault(title, len(vocabulary)) for title in tos], dtype=np.int64)[found])
+	froms, tos = [], []
+	rows = parse_sql_file(_read_dump(categorylinks_path), columns=[0, 1, 6], parser=tokenize_values) # cl_from, cl_to, cl_type
+	for cl_from, cl_to, cl_type in tqdm(rows, desc="Reading category links", unit=' links', unit_scale=True):
+		if cl_type in relation_types:
+			froms.append(cl_from)
+			tos.append(cl_to)
+		if len(froms) == chunksize:
+			add_chunk(froms, tos)
+			froms, tos = [], []
+	if len(froms):
+		add_chunk(froms, tos)
+	empty = np.array([], dtype=np.int64)
+	return list(vocabulary), np.concatenate(items or [empty]), np.concatenate(categories or [empty])
 
 # 7978906 -> 3336171 entries
 def generate_category_map(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
@@ -63,28 +173,110 @@ def generate_category_map(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]
 	print("Generating children tree...")
 	relations = get_child_tree(df) # ~30 seconds
 	print("Calculating category depth...")
-	depths = get_category_depth(relations) # ~37 minutes
+	depths = get_category_depth(relations) # <1 minute
 	print("Making graph acyclic...")
 	df = make_graph_acyclic(df, depths)
 	depths = pd.DataFrame.from_dict(depths, orient='index', columns=['depth'])
 	return df, depths
 
+def filter_category_links(names: np.ndarray, items: np.ndarray, categories: np.ndarray, root='Contents') -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	generate_category_map on integer-coded relations (ids into names), with hidden category removal & the acyclic filter as array masks.
+	Returns the kept items & categories, the depth of every title (-1 if unreachable),
+	and which titles are in a relation once hidden categories are removed (those generate_category_map has depths for)
+	"""
+	is_hidden = np.zeros(len(names), dtype=bool)
+	hidden_id = np.flatnonzero(names == 'Hidden_categories')
+	is_hidden[items[np.isin(categories, hidden_id)]] = True
+	keep = ~(is_hidden[items] & is_hidden[categories])
+	items, categories = items[keep], categories[keep]
+	present = np.zeros(len(names), dtype=bool)
+	present[items] = True
+	present[categories] = True
+	print("Calculating category depth...")
+	child_offsets, children = transpose_csr(*_csr(items, categories, len(names)))
+	depths, _ = level_order(child_offsets, children, np.flatnonzero(names == root))
+	print("Making graph acyclic...")
+	keep = (depths[items] >= 0) & (depths[categories] >= 0) & (depths[items] - depths[categories] == 1)
+	return items[keep], categories[keep], depths, present
+
+def generate_category_graph(names: List[str], items: np.ndarray, categories: np.ndarray, root='Contents') -> Tuple[CategoryGraph, np.ndarray]:
+	"""
+	generate_category_map on integer-coded relations (ids into names).
+	Returns the acyclic graph (only containing linked categories), and the depth of each of its categories
+	"""
+	names = np.array(names, dtype=object)
+	items, categories, depths, _ = filter_category_links(names, items, categories, root)
+	return _linked_graph(names, items, categories, depths)
+
+def _linked_graph(names: np.ndarray, items: np.ndarray, categories: np.ndarray, depths: np.ndarray) -> Tuple[CategoryGraph, np.ndarray]:
+	# Renumber the linked categories in sorted order, as required by CategoryGraph
+	linked = np.unique(np.concatenate([items, categories]))
+	order = linked[np.argsort(names[linked])]
+	rank = np.full(len(names), -1, dtype=np.int64)
+	rank[order] = np.arange(len(order))
+	graph = CategoryGraph.from_codes(names[order], rank[items], rank[categories])
+	return graph, depths[order]
+
+def _csr(items: np.ndarray, categories: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+	"""Item -> category adjacency"""
+	order = np.argsort(items, kind='stable')
+	offsets = np.zeros(size + 1, dtype=np.int64)
+	np.cumsum(np.bincount(items, minlength=size), out=offsets[1:])
+	return offsets, categories[order].astype(np.int32)
+
+
+def save_category_graph(graph: CategoryGraph, depths: np.ndarray, path = 'datasets/generated/category_graph') -> None:
+	"""Saves the binary graph loaded by CategoryMap(compact=True), with its categories' depths as depths.npy"""
+	graph.save(path)
+	np.save(os.path.join(path, 'depths.npy'), depths)
 
 def get_category_map(source_path = 'datasets/raw/enwiki-categories.tsv', 
 					 save_path = 'datasets/generated/valid_category_links.tsv', 
-					 depths_path = 'datasets/generated/category_depths.tsv'):
+					 depths_path = 'datasets/generated/category_depths.tsv',
+					 graph_path: Optional[str] = 'datasets/generated/category_graph', chunksize=1_000_000):
+	"""
+	Reads the valid category links & depths, or generates them from the raw relations.
+	Generation factorizes the titles once while reading and runs on integer codes from there (see filter_category_links).
+	The binary graph & depths are saved to graph_path alongside the TSVs.
+	"""
 	if os.path.exists(save_path) and os.path.exists(depths_path):
 		df = pd.read_csv(save_path, sep='\t')
 		depths = pd.read_csv(depths_path, sep='\t')
 		return df, depths
 	print("Generating category map...")
-	df = get_raw_relations(source_path)
-	df, depths = generate_category_map(df)
+	names, items, categories = get_raw_relation_codes(source_path, chunksize)
+	names = np.array(names, dtype=object)
+	items, categories, depths, present = filter_category_links(names, items, categories)
+	if graph_path:
+		save_category_graph(*_linked_graph(names, items, categories, depths), graph_path)
+	# Object arrays of the shared title strings, so the frames only add a pointer per row
+	df = pd.DataFrame({'item': names[items], 'category': names[categories]})
+	depths = pd.DataFrame({'depth': np.where(depths[present] >= 0, depths[present], np.nan)}, index=names[present])
 	if save_path:
 		df.to_csv(save_path, sep='\t', index=False)
 	if depths_path:
 		depths.to_csv(depths_path, sep='\t')
 	return df, depths
 
+def get_category_graph_from_dumps(page_path = 'datasets/raw/enwiki-latest-page.sql.gz',
+								  categorylinks_path = 'datasets/raw/enwiki-latest-categorylinks.sql.gz',
+								  save_path = 'datasets/generated/category_graph', **kwargs) -> CategoryGraph:
+	"""
+	Builds the binary graph loaded by CategoryMap(compact=True) straight from the gzipped SQL dumps, in one streaming pass
+	over each dump (no intermediate TSV). Category depths are saved alongside as depths.npy
+	"""
+	print("Generating category graph from dumps...")
+	names, items, categories = get_dump_relations(page_path, categorylinks_path, **kwargs)
+	graph, depths = generate_category_graph(names, items, categories)
+	save_category_graph(graph, depths, save_path)
+	return graph
+
 if __name__ == '__main__':
-	get_category_map()
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--from-dumps', action='store_true', help='Build the category graph from the page & categorylinks SQL dumps')
+	args = parser.parse_args()
+	if args.from_dumps:
+		get_category_graph_from_dumps()
+	else:
+		get_category_map()
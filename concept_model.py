@@ -1,13 +1,24 @@
-import spacy
+import os
 import logging
+import threading
 from logging import getLogger
-from babelnet import BabelSynset
+from babelnet import BabelSynset, Language
 from babelnet.resources import BabelSynsetID, WikipediaID
 from dataclasses import dataclass
-from typing import Set, Dict, List
+from collections.abc import MutableMapping
+from typing import Iterable, Iterator, Optional, Set, Dict, List, Tuple
 
-from synset_retriever import SynsetRetriever, id_to_name, get_synset
-from wiki_clickthrough_map import WikiMap
+from synset_retriever import SynsetRetriever, id_to_name, get_synset, cache as synset_cache
+from wiki_clickthrough_map import TopicSets, WikiMap
+from noun_extraction import NounExtractor
+from lazy import Lazy, startup_report
+from concept_store import ConceptStore, StoredConcept
+from prereq_dag import PrerequisiteDAG
+from instrumentation import instrumentation, profile, timed
+
+
+class ConceptNotFound(LookupError):
+	"""No synset matches the concept being looked up"""
 
 
 @dataclass
@@ -53,40 +64,179 @@ class Concept:
 		return f'Concept: {self.name}'
 
 
+def _id_string(resource_id) -> str:
+	return getattr(resource_id, 'id', resource_id)
+
+
+class StoredConceptMap(MutableMapping):
+	"""
+	Concept map backed by a ConceptStore. Stored concepts are only read (and cached) when first accessed,
+	while new & replaced concepts are kept in memory until flush upserts them.
+	Only assigned concepts are written, so a concept changed in place must be assigned again (or added to dirty) to be saved.
+	"""
+	def __init__(self, store: ConceptStore, language=Language.EN) -> None:
+		self.store = store
+		self.lang = language
+		self.loaded: Dict[BabelSynsetID, Concept] = {}
+		self.dirty: Set[BabelSynsetID] = set()
+		self.stored_ids = store.ids()
+
+	def _hydrate(self, stored: StoredConcept) -> Concept:
+		definitions = [Definition(gloss, {BabelSynsetID(prereq_id) for prereq_id in prereq_ids}) for gloss, prereq_ids in stored.definitions]
+		topic_set = {BabelSynsetID(topic_id) for topic_id in stored.topic_set}
+		return Concept(stored.name, BabelSynsetID(stored.babel_id), WikipediaID(stored.wiki_id, self.lang), topic_set, definitions)
+
+	@staticmethod
+	def _dehydrate(concept: Concept) -> StoredConcept:
+		definitions = [(definition.gloss, sorted(map(_id_string, definition.prereqs))) for definition in concept.definitions]
+		wiki_id = getattr(concept.wiki_id, 'title', concept.wiki_id)
+		return StoredConcept(_id_string(concept.babel_id), concept.name, wiki_id, sorted(map(_id_string, concept.topic_set)), definitions)
+
+	def __getitem__(self, babel_id: BabelSynsetID) -> Concept:
+		if babel_id in self.loaded:
+			return self.loaded[babel_id]
+		if _id_string(babel_id) not in self.stored_ids:
+			raise KeyError(babel_id)
+		concept = self._hydrate(self.store.read(_id_string(babel_id)))
+		self.loaded[babel_id] = concept
+		return concept
+
+	def __setitem__(self, babel_id: BabelSynsetID, concept: Concept) -> None:
+		self.loaded[babel_id] = concept
+		self.dirty.add(babel_id)
+
+	def __delitem__(self, babel_id: BabelSynsetID) -> None:
+		if babel_id not in self:
+			raise KeyError(babel_id)
+		self.loaded.pop(babel_id, None)
+		self.dirty.discard(babel_id)
+		if _id_string(babel_id) in self.stored_ids:
+			self.store.delete(_id_string(babel_id))
+			self.stored_ids.discard(_id_string(babel_id))
+
+	def __contains__(self, babel_id: object) -> bool:
+		return babel_id in self.loaded or _id_string(babel_id) in self.stored_ids
+
+	def __iter__(self) -> Iterator[BabelSynsetID]:
+		yield from self.loaded
+		loaded = {_id_string(babel_id) for babel_id in self.loaded}
+		for concept_id in self.stored_ids - loaded:
+			yield BabelSynsetID(concept_id)
+
+	def __len__(self) -> int:
+		return len(self.stored_ids | {_id_string(babel_id) for babel_id in self.loaded})
+
+	def flush(self, batch_size=10_000) -> int:
+		"""Upserts the new & replaced concepts, returning how many were written"""
+		dirty = list(self.dirty)
+		new = [babel_id for babel_id in dirty if _id_string(babel_id) not in self.stored_ids]
+		changed = [babel_id for babel_id in dirty if _id_string(babel_id) in self.stored_ids]
+		written = self.store.write((self._dehydrate(self.loaded[babel_id]) for babel_id in new), batch_size, replace=False)
+		written += self.store.write((self._dehydrate(self.loaded[babel_id]) for babel_id in changed), batch_size)
+		self.stored_ids.update(_id_string(babel_id) for babel_id in dirty)
+		self.dirty.difference_update(dirty)
+		return written
+
+
 class PrerequisiteMap:
-	model = spacy.load('en_core_web_sm')
-	map: Dict[BabelSynsetID, Concept]
+	nouns = NounExtractor()
+	map: MutableMapping # Of BabelSynsetID -> Concept, stored once saved or loaded
 
-	def __init__(self) -> None:
+	def __init__(self, warm_up=False, reject_cycles=True, instrument=False, compact=False,
+	             shortlist: Optional[int] = None) -> None:
+		"""
+		Heavy resources are loaded on first use, or in background threads when warm_up is set.
+		Prerequisites that would create a cycle are dropped, or only counted (in dag) if reject_cycles is cleared.
+		instrument turns on the per-stage timers & counters (see instrumentation_report).
+		compact loads the memory-mapped category graph instead of the pickled parent tree (see CategoryMap).
+		shortlist prunes candidate synsets by bounds of their categorical commonality (see CategoryMap.best_candidate).
+		"""
 		self.logger = getLogger(__name__)
 		self.map = dict()
-		self.babel = SynsetRetriever()
-		self.wiki = WikiMap()
+		self.dag = PrerequisiteDAG()
+		self.reject_cycles = reject_cycles
+		self.babel = SynsetRetriever(compact=compact, shortlist=shortlist)
+		self._wiki = Lazy('clickstream', WikiMap)
+		self.topic_sets: Optional[TopicSets] = None
+		if instrument:
+			instrumentation.enable()
+		if warm_up:
+			self.warm_up()
+
+	@property
+	def wiki(self) -> WikiMap:
+		return self._wiki.get()
 
 	@property
 	def category_map(self):
 		return self.babel.category_map
 
+	def warm_up(self) -> List[threading.Thread]:
+		"""Starts loading spaCy, the clickstream, the category map & cached synsets in the background"""
+		synsets = threading.Thread(target=synset_cache.warm_load, name='warm-up synset cache', daemon=True)
+		synsets.start()
+		return [self.nouns.model.warm_up(), self._wiki.warm_up(), self.category_map.warm_up(), synsets]
+
+	def startup_report(self) -> str:
+		return startup_report()
+
+	def instrumentation_report(self, path: Optional[str] = None) -> str:
+		"""Human readable summary of the stage timers & counters (per run & per concept), also saved as JSON to path if given"""
+		report = instrumentation.save(path) if path is not None else instrumentation.report()
+		return instrumentation.summary(report)
+
+	def profile_concept(self, name: str, wiki_category: str, definition_limit=None, stats_path: Optional[str] = None) -> Tuple[Concept, str]:
+		"""Runs find_concept under cProfile, returning the concept & the top functions by cumulative time"""
+		return profile(self.find_concept, name, wiki_category, definition_limit, stats_path=stats_path)
+
+	def precompute_topic_sets(self, wiki_ids: Optional[Iterable[str]] = None, path: Optional[str] = None, score_threshold=0.02) -> TopicSets:
+		"""
+		Computes the topic set rates of many articles (or all of them) in one pass, or loads them from path if it has them for this clickstream.
+		_generate_topic_set then uses them instead of reading the clickstream for each concept.
+		"""
+		self.topic_sets = None
+		if path is not None and os.path.exists(path):
+			try:
+				self.topic_sets = TopicSets.load(path, self.wiki.store)
+			except ValueError as e:
+				self.logger.warning(f"{e}, recomputing them")
+		if self.topic_sets is None:
+			self.topic_sets = self.wiki.get_topic_sets(wiki_ids, score_threshold, path=path)
+		self.logger.info(f"Topic sets ready for {len(self.topic_sets)} articles")
+		return self.topic_sets
+
 	def find_concept(self, name: str, wiki_category: str, definition_limit=None) -> Concept:
 		synsets = self.babel.find_synset_in_category(name, wiki_category)
 		if len(synsets) == 0:
-			raise Exception(f'No synsets found for {name} in category {wiki_category}')
+			raise ConceptNotFound(f'No synsets found for {name} in category {wiki_category}')
 		if len(synsets) > 1:
 			self.logger.warning(f'Multiple synsets found for {name} in category {wiki_category}. Using first. Possible: {synsets}')
 		synset = synsets[0]
 		return self.get_concept(synset, definition_limit)
 
+	def get_concepts(self, synsets: Iterable[BabelSynset], definition_limit=None) -> List[Concept]:
+		"""Gets many concepts, parsing the glosses of all the new ones in a single batch"""
+		synsets = list(synsets)
+		glosses = []
+		for synset in synsets:
+			if synset.id not in self.map:
+				glosses += [gloss.gloss for gloss in synset.glosses()[:definition_limit]]
+		self.nouns.extract(glosses)
+		return [self.get_concept(synset, definition_limit) for synset in synsets]
+
 	def get_concept(self, synset: BabelSynset, definition_limit=None) -> Concept:
 		if synset.id in self.map:
 			return self.map[synset.id]
-		name = self.babel.get_name(synset)
-		definitions = self._generate_definitions(synset, limit=definition_limit)
-		topic_set = self._generate_topic_set(synset)
-		wiki_id = self.babel.get_wiki_id(synset)
+		with instrumentation.concept(synset.id):
+			name = self.babel.get_name(synset)
+			definitions = self._generate_definitions(synset, limit=definition_limit)
+			topic_set = self._generate_topic_set(synset)
+			wiki_id = self.babel.get_wiki_id(synset)
 		concept = Concept(name, synset.id, wiki_id, topic_set, definitions)
 		self.map[concept.babel_id] = concept
 		return concept
 
+	@timed('concept.definitions')
 	def _generate_definitions(self, synset: BabelSynset, limit=None) -> List[Definition]:
 		definitions = []
 		wiki_id = self.babel.get_wiki_id(synset).title
@@ -94,42 +244,47 @@ class PrerequisiteMap:
 		glosses = synset.glosses()
 		if limit is not None:
 			glosses = glosses[:limit]
-		for gloss in glosses:
-			prereqs = self._generate_prereqs(wiki_id, gloss.gloss, categories)
+		gloss_nouns = self.nouns.extract(gloss.gloss for gloss in glosses)
+		for gloss, nouns in zip(glosses, gloss_nouns):
+			prereqs = self._generate_prereqs(wiki_id, gloss.gloss, categories, nouns=nouns)
+			prereqs.discard(synset.id)
+			prereqs = self._link_prereqs(synset.id, prereqs)
 			definitions.append(Definition(gloss.gloss, prereqs))
 		return definitions
 
-	def _generate_prereqs(self, wiki_id: str, definition: str, parent_categories: List[str], commonality_threshold=0.5) -> Set[BabelSynsetID]:
-		"""Assumes all prereqs are linked in the wiki article"""
+	def _link_prereqs(self, babel_id: BabelSynsetID, prereqs: Set[BabelSynsetID]) -> Set[BabelSynsetID]:
+		"""Adds the prereq -> concept edges to the DAG, dropping (or just logging) those that would close a cycle"""
+		linked = set()
+		for prereq in prereqs:
+			if self.dag.add_edge(prereq, babel_id):
+				linked.add(prereq)
+			else:
+				self.logger.warning(f"{prereq} is a prereq of {babel_id} but would create a cycle{'. Dropped' if self.reject_cycles else ''}")
+				if not self.reject_cycles:
+					linked.add(prereq)
+		return linked
+
+	@timed('concept.prereqs')
+	def _generate_prereqs(self, wiki_id: str, definition: str, parent_categories: List[str], commonality_threshold=0.5,
+	                      nouns: Optional[List[str]] = None) -> Set[BabelSynsetID]:
+		"""Assumes all prereqs are linked in the wiki article. The definition's nouns are extracted if not given"""
 		# TODO: Extract main phrase of sentence
 		self.logger.info(f"Generating prereqs for definition of {wiki_id}: {definition}")
-		parsed = self.model(definition)
 		prereqs = set()
-		for noun in parsed.noun_chunks:
-			cleaned_noun = self._clean_noun(noun.text)
-			if cleaned_noun == '':
-				self.logger.debug(f"Skipping empty noun: {noun.text}")
-				continue
+		if nouns is None:
+			nouns = self.nouns.extract([definition])[0]
+		for cleaned_noun in nouns:
 			synset = self.babel.find_synset_like(cleaned_noun, parent_categories, commonality_threshold)
 			if synset is None:
 				self.logger.warning(f"Synset not found for {cleaned_noun}")
 			elif synset.id in self.map:
-				# TODO: New prereq relation must ensure DAG
-				self.logger.debug(f"Linked existing concepts! {self.babel.get_name(synset)} is a prereq of {wiki_id}. DAG violation?")
+				self.logger.debug(f"Linked existing concepts! {self.babel.get_name(synset)} is a prereq of {wiki_id}")
 				prereqs.add(synset.id)
 			else:
 				self.logger.info(f"Prerequisite found: '{self.babel.get_name(synset)}' ({synset.id})")
 				prereqs.add(synset.id)
-		prereqs.discard(synset.id)
 		return prereqs
 
-	# TODO: Find spacy way of dropping stop words
-	# TODO: Lemmatize?
-	def _clean_noun(self, text: str) -> str:
-		words = text.split(' ')
-		words = [word for word in words if word not in self.model.Defaults.stop_words]
-		return ' '.join(words).lower()
-
 	def compare_commonalities(self, wiki_link, compared_links):
 		commonalities = {}
 		wiki_categories = self.babel.get_categories(self.babel.get_wiki_synset(wiki_link))
@@ -143,14 +298,20 @@ class PrerequisiteMap:
 
 	# TODO: Is the score threshold necessary?
 	# TODO: Ensure there is traffic between the two articles flows both ways?
+	@timed('concept.topic_set')
 	def _generate_topic_set(self, synset: BabelSynset, score_threshold = 0.02) -> Set[BabelSynsetID]:
 		"""Uses Wikipedia's clickthrough articles, normalized w/ a score threshold"""
 		wiki_id = self.babel.get_wiki_id(synset).title
-		ct_rates = self.wiki.get_clickthrough_rates(wiki_id, source_normalized=True)
-		ct_rates = ct_rates[ct_rates > score_threshold]
-		ct_rates = ct_rates.sort_values(ascending=False)
+		if self.topic_sets is not None and self.topic_sets.covers(score_threshold) and wiki_id in self.topic_sets:
+			ct_rates = self.topic_sets[wiki_id] # Already thresholded & sorted
+			if self.topic_sets.score_threshold < score_threshold:
+				ct_rates = ct_rates[ct_rates > score_threshold]
+		else:
+			ct_rates = self.wiki.get_clickthrough_rates(wiki_id, source_normalized=True)
+			ct_rates = ct_rates[ct_rates > score_threshold]
+			ct_rates = ct_rates.sort_values(ascending=False)
 		self.logger.debug(f'Clickthrough rates: {ct_rates.head(10)} ({len(ct_rates)} total)')
-		synsets = [self.babel.get_wiki_synset(link_id) for link_id in ct_rates.index]
+		synsets = self.babel.get_wiki_synsets(ct_rates.index)
 		# Not all wikipedia articles are concepts, so they might not exist in babelnet
 		ids = set(synset.id for synset in synsets if synset is not None)
 		ids.discard(synset.id)
@@ -171,24 +332,35 @@ class PrerequisiteMap:
 					if do_learn == 'y':
 						self.print_all_prereqs(self.get_concept(get_synset(babel_id)))
 
-	# TODO: Save map to a standard format. Duck DB?
-	def save(self, path: str) -> None:
-		with open(path, 'w') as f:
-			for concept in self.map.values():
-				...
-				# Table Relations:
-					# Definitions: concept_id, gloss_id
-					# Prereqs: gloss_id, prereq_id
-					# Topic Set: concept_id, child_id
-					# Naming (Optional): concept_id, concept_name
-					# Definitions: gloss_id, gloss
+	def save(self, path: Optional[str] = None, batch_size=10_000) -> int:
+		"""
+		Saves the map to a SQLite file (see ConceptStore), returning how many concepts were written.
+		Once saved or loaded, only new & changed concepts are written, so long crawls can save periodically.
+		"""
+		if path is not None and not (isinstance(self.map, StoredConceptMap) and self.map.store.path == path):
+			concepts = self.map
+			self.map = StoredConceptMap(ConceptStore(path), self.babel.lang)
+			for babel_id, concept in concepts.items():
+				self.map[babel_id] = concept
+		if not isinstance(self.map, StoredConceptMap):
+			raise ValueError("A path is needed to save a map that wasn't loaded")
+		written = self.map.flush(batch_size)
+		self.logger.info(f"Saved {written} concepts to {self.map.store.path}")
+		return written
 
+	def load(self, path: str) -> None:
+		"""Opens a saved map. Concepts are read from it as they're used"""
+		self.map = StoredConceptMap(ConceptStore(path), self.babel.lang)
+		self.dag = PrerequisiteDAG.from_edges((BabelSynsetID(prereq_id), BabelSynsetID(concept_id)) for prereq_id, concept_id in self.map.store.edges())
+		self.logger.info(f"Loaded {len(self.map.stored_ids)} concepts from {path} ({self.dag.stats()})")
 
 if __name__ == '__main__':
 	for handler in logging.root.handlers:
 		logging.root.removeHandler(handler)
 	logging.basicConfig(filename='datasets/generated/latest.log', filemode='w', level=logging.DEBUG)
-	map = PrerequisiteMap()
+	map = PrerequisiteMap(warm_up=True, instrument=True)
 	concept = map.find_concept('Control Theory', 'Mathematics', definition_limit=2)
 	print(concept)
+	print(map.startup_report())
+	print(map.instrumentation_report('datasets/generated/instrumentation.json'))
 	map.print_all_prereqs(concept)
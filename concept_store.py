@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+
+class StoredConcept(NamedTuple):
+	babel_id: str
+	name: str
+	wiki_id: str
+	topic_set: List[str]
+	definitions: List[Tuple[str, List[str]]] # (gloss, prereq ids)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS concepts (concept_id TEXT PRIMARY KEY, name TEXT NOT NULL, wiki_id TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS definitions (concept_id TEXT, position INTEGER, gloss TEXT NOT NULL, PRIMARY KEY (concept_id, position)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS prereqs (concept_id TEXT, position INTEGER, prereq_id TEXT, PRIMARY KEY (concept_id, position, prereq_id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS topic_sets (concept_id TEXT, topic_id TEXT, PRIMARY KEY (concept_id, topic_id)) WITHOUT ROWID;
+"""
+
+
+class ConceptStore:
+	"""
+	SQLite file holding a prerequisite map, in the tables:
+	concepts (concept_id, name, wiki_id), definitions (concept_id, position, gloss),
+	prereqs (concept_id, position, prereq_id) & topic_sets (concept_id, topic_id).
+	Rows are keyed by concept, so a concept is read with a few range scans and rewritten (upserted) without touching the others.
+	"""
+	def __init__(self, path: str) -> None:
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		self.path = path
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('PRAGMA synchronous=NORMAL')
+		self.connection.execute('PRAGMA cache_size=-262144') # 256MB, so bulk inserts into the primary keys stay in memory
+		self.connection.executescript(SCHEMA)
+
+	def ids(self) -> Set[str]:
+		with self.lock:
+			return {concept_id for concept_id, in self.connection.execute('SELECT concept_id FROM concepts')}
+
+	def __len__(self) -> int:
+		with self.lock:
+			return self.connection.execute('SELECT COUNT(*) FROM concepts').fetchone()[0]
+
+	def edges(self) -> List[Tuple[str, str]]:
+		"""All (prereq id, concept id) pairs"""
+		with self.lock:
+			return self.connection.execute('SELECT DISTINCT prereq_id, concept_id FROM prereqs').fetchall()
+
+	def read(self, concept_id: str) -> Optional[StoredConcept]:
+		with self.lock:
+			row = self.connection.execute('SELECT name, wiki_id FROM concepts WHERE concept_id = ?', (concept_id,)).fetchone()
+			if row is None:
+				return None
+			glosses = self.connection.execute('SELECT gloss FROM definitions WHERE concept_id = ? ORDER BY position', (concept_id,)).fetchall()
+			prereqs = self.connection.execute('SELECT position, prereq_id FROM prereqs WHERE concept_id = ?', (concept_id,)).fetchall()
+			topic_set = [topic_id for topic_id, in self.connection.execute('SELECT topic_id FROM topic_sets WHERE concept_id = ?', (concept_id,))]
+		definitions = [(gloss, []) for gloss, in glosses]
+		for position, prereq_id in prereqs:
+			definitions[position][1].append(prereq_id)
+		return StoredConcept(concept_id, row[0], row[1], topic_set, definitions)
+
+	def write(self, concepts: Iterable[StoredConcept], batch_size=10_000, replace=True) -> int:
+		"""
+		Inserts or replaces concepts, committing every batch_size concepts. Returns how many were written.
+		Clear replace when none of the concepts are stored yet, to skip deleting their old rows.
+		"""
+		written = 0
+		batch: List[StoredConcept] = []
+		for concept in concepts:
+			batch.append(concept)
+			if len(batch) >= batch_size:
+				written += self._write_batch(batch, replace)
+				batch = []
+		if len(batch):
+			written += self._write_batch(batch, replace)
+		return written
+
+	def _write_batch(self, concepts: List[StoredConcept], replace: bool) -> int:
+		ids = [(concept.babel_id,) for concept in concepts]
+		with self.lock, self.connection:
+			for table in ('definitions', 'prereqs', 'topic_sets') if replace else ():
+				self.connection.executemany(f'DELETE FROM {table} WHERE concept_id = ?', ids)
+			self.connection.executemany('INSERT OR REPLACE INTO concepts VALUES (?, ?, ?)',
+			                            [(concept.babel_id, concept.name, concept.wiki_id) for concept in concepts])
+			self.connection.executemany('INSERT INTO definitions VALUES (?, ?, ?)',
+			                            [(concept.babel_id, i, gloss) for concept in concepts for i, (gloss, _) in enumerate(concept.definitions)])
+			self.connection.executemany('INSERT OR IGNORE INTO prereqs VALUES (?, ?, ?)',
+			                            [(concept.babel_id, i, prereq_id) for concept in concepts
+			                             for i, (_, prereq_ids) in enumerate(concept.definitions) for prereq_id in prereq_ids])
+			self.connection.executemany('INSERT OR IGNORE INTO topic_sets VALUES (?, ?)',
+			                            [(concept.babel_id, topic_id) for concept in concepts for topic_id in concept.topic_set])
+		return len(concepts)
+
+	def delete(self, concept_id: str) -> None:
+		with self.lock, self.connection:
+			for table in ('concepts', 'definitions', 'prereqs', 'topic_sets'):
+				self.connection.execute(f'DELETE FROM {table} WHERE concept_id = ?', (concept_id,))
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self.ids())
+
+	def close(self) -> None:
+		with self.lock:
+			self.connection.close()
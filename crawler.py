@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import heapq
+import logging
+import argparse
+import itertools
+from babelnet.resources import BabelSynsetID
+from typing import Dict, List, Optional, Set, Tuple
+
+import synset_retriever
+from concept_model import PrerequisiteMap, Concept
+from async_babelnet import QuotaExceededError
+from synset_cache import SynsetCache
+
+
+def _id_string(babel_id) -> str:
+	return str(getattr(babel_id, 'id', babel_id))
+
+
+class Crawler:
+	"""
+	Headless, breadth-biased expansion of a prerequisite map from a seed concept.
+	The frontier is a heap ranked by depth minus ctr_weight times the clickthrough rate from the concept that found a prerequisite,
+	so well trafficked links are expanded before others at the same depth.
+	Crawls stop at max_depth, or once a run has used max_api_calls BabelNet calls (synset cache misses), max_seconds or max_concepts
+	(checked between concepts, so a run can overshoot by one concept's calls).
+	The frontier & visited set are checkpointed to JSON (and the map saved) every checkpoint_every concepts, so a killed crawl can resume.
+	API calls are counted from the misses of synset_cache, which defaults to synset_retriever's cache (when the crawler is created).
+	"""
+	def __init__(self, prereq_map: PrerequisiteMap, checkpoint_path: str, map_path: Optional[str] = None, max_depth=3,
+	             max_api_calls: Optional[int] = None, max_seconds: Optional[float] = None, max_concepts: Optional[int] = None,
+	             ctr_weight=1.0, definition_limit: Optional[int] = None, checkpoint_every=25, synset_cache: Optional[SynsetCache] = None) -> None:
+		self.logger = logging.getLogger(__name__)
+		self.map = prereq_map
+		self.checkpoint_path = checkpoint_path
+		self.map_path = map_path
+		self.max_depth = max_depth
+		self.max_api_calls = max_api_calls
+		self.max_seconds = max_seconds
+		self.max_concepts = max_concepts
+		self.ctr_weight = ctr_weight
+		self.definition_limit = definition_limit
+		self.checkpoint_every = checkpoint_every
+		self.synset_cache = synset_cache if synset_cache is not None else synset_retriever.cache
+		self.frontier: List[Tuple[float, int, str, int]] = [] # (priority, insertion order, babel id, depth)
+		self.visited: Set[str] = set()
+		self.counter = itertools.count()
+		self.stats = {'concepts': 0, 'api_calls': 0, 'seconds': 0.0, 'failures': 0}
+
+	def push(self, babel_id: str, depth: int, ctr=0.0) -> None:
+		if babel_id in self.visited or depth > self.max_depth:
+			return
+		self.visited.add(babel_id)
+		heapq.heappush(self.frontier, (depth - self.ctr_weight * ctr, next(self.counter), babel_id, depth))
+
+	def seed(self, babel_id: str) -> None:
+		self.push(_id_string(babel_id), 0)
+
+	def save_checkpoint(self) -> None:
+		if self.map_path is not None:
+			self.map.save(self.map_path)
+		state = {'frontier': [[priority, babel_id, depth] for priority, _, babel_id, depth in sorted(self.frontier)],
+		         'visited': sorted(self.visited), 'stats': self.stats, 'map_path': self.map_path}
+		os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+		temp_path = self.checkpoint_path + '.tmp'
+		with open(temp_path, 'w') as f:
+			json.dump(state, f)
+		os.replace(temp_path, self.checkpoint_path) # Atomic, so a kill mid-write keeps the last checkpoint
+
+	def load_checkpoint(self) -> bool:
+		"""Restores the frontier, visited set & saved map of a previous crawl, if there is one"""
+		if not os.path.exists(self.checkpoint_path):
+			return False
+		with open(self.checkpoint_path) as f:
+			state = json.load(f)
+		self.frontier = [(priority, next(self.counter), babel_id, depth) for priority, babel_id, depth in state['frontier']]
+		heapq.heapify(self.frontier)
+		self.visited = set(state['visited'])
+		self.stats = state['stats']
+		if self.map_path is not None and os.path.exists(self.map_path):
+			self.map.load(self.map_path)
+		self.logger.info(f"Resuming crawl with {len(self.frontier)} queued & {len(self.visited)} visited concepts")
+		return True
+
+	def _out_of_budget(self, calls: int, seconds: float, concepts: int) -> Optional[str]:
+		if self.max_api_calls is not None and calls >= self.max_api_calls:
+			return 'API call budget'
+		if self.max_seconds is not None and seconds >= self.max_seconds:
+			return 'time budget'
+		if self.max_concepts is not None and concepts >= self.max_concepts:
+			return 'concept budget'
+		return None
+
+	def _clickthrough_rates(self, concept: Concept) -> Dict[str, float]:
+		try:
+			ctr = self.map.wiki.get_clickthrough_rates(concept.wiki_id.title, source_normalized=True)
+		except ValueError: # Article has no clickthrough links
+			return {}
+		return ctr.to_dict()
+
+	def _expand(self, concept: Concept, depth: int) -> None:
+		if depth >= self.max_depth:
+			return
+		babel_ids = set().union(*(definition.prereqs for definition in concept.definitions))
+		babel_ids = [babel_id for babel_id in babel_ids if _id_string(babel_id) not in self.visited]
+		if len(babel_ids) == 0:
+			return
+		fetcher = self.map.babel.fetcher
+		synsets = fetcher.run(fetcher.get_synsets(babel_ids))
+		ctr = self._clickthrough_rates(concept)
+		for babel_id, synset in zip(babel_ids, synsets):
+			if synset is None:
+				continue
+			self.push(_id_string(babel_id), depth + 1, ctr.get(self.map.babel.get_wiki_id(synset).title, 0.0))
+
+	def run(self) -> Dict[str, float]:
+		"""Expands concepts until the frontier is empty or one of the run's budgets runs out, returning the crawl's stats"""
+		start = time.perf_counter()
+		synset_cache = self.synset_cache
+		misses_at_start = synset_cache.misses
+		calls_before, seconds_before, concepts_before = self.stats['api_calls'], self.stats['seconds'], self.stats['concepts']
+		def update_stats() -> None:
+			self.stats['api_calls'] = calls_before + synset_cache.misses - misses_at_start
+			self.stats['seconds'] = seconds_before + time.perf_counter() - start
+		reason = 'frontier exhausted'
+		try:
+			while self.frontier:
+				budget = self._out_of_budget(synset_cache.misses - misses_at_start, time.perf_counter() - start, self.stats['concepts'] - concepts_before)
+				if budget is not None:
+					reason = budget
+					break
+				entry = heapq.heappop(self.frontier)
+				_, _, babel_id, depth = entry
+				try:
+					synset = synset_retriever.get_synset(BabelSynsetID(babel_id))
+					if synset is None:
+						continue
+					concept = self.map.get_concept(synset, self.definition_limit)
+					self._expand(concept, depth)
+				except QuotaExceededError:
+					heapq.heappush(self.frontier, entry) # Unchanged, so it keeps its place when resumed
+					raise
+				except Exception:
+					self.logger.exception(f"Failed to expand {babel_id}")
+					self.stats['failures'] += 1
+					continue
+				finally:
+					update_stats()
+				self.stats['concepts'] += 1
+				if self.stats['concepts'] % self.checkpoint_every == 0:
+					self.save_checkpoint()
+		except QuotaExceededError:
+			reason = 'daily quota'
+		update_stats()
+		self.save_checkpoint()
+		self.logger.info(f"Crawl stopped ({reason}): {self.stats}")
+		return {**self.stats, 'queued': len(self.frontier), 'stopped_by': reason, 'rejected_prereqs': self.map.dag.num_rejected}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Builds a prerequisite map by crawling from a seed concept')
+	parser.add_argument('name', help='Name of the seed concept, i.e. "Control Theory"')
+	parser.add_argument('category', help='Wikipedia category the seed concept belongs in, i.e. Mathematics')
+	parser.add_argument('--checkpoint', default='datasets/generated/crawl.json')
+	parser.add_argument('--map', default='datasets/generated/prereq_map.sqlite')
+	parser.add_argument('--max-depth', type=int, default=3)
+	parser.add_argument('--max-calls', type=int, default=None, help='BabelNet call budget (e.g. what is left of the daily quota)')
+	parser.add_argument('--max-hours', type=float, default=None)
+	parser.add_argument('--definition-limit', type=int, default=None)
+	parser.add_argument('--topic-sets', default=None, help='.npz of precomputed topic sets (computed for every article if missing)')
+	parser.add_argument('--compact', action='store_true', help='Use the memory-mapped category graph instead of the pickled parent tree')
+	parser.add_argument('--rate', type=float, default=10.0, help='BabelNet requests per second')
+	parser.add_argument('--daily-quota', type=int, default=1000, help="BabelNet requests allowed per (UTC) day, i.e. the key's babelcoins")
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO)
+	synset_retriever.configure_limiter(rate=args.rate, daily_quota=args.daily_quota)
+	crawler = Crawler(PrerequisiteMap(warm_up=True, compact=args.compact), args.checkpoint, args.map, args.max_depth, args.max_calls,
+	                  None if args.max_hours is None else args.max_hours * 3600, definition_limit=args.definition_limit)
+	if args.topic_sets is not None:
+		crawler.map.precompute_topic_sets(path=args.topic_sets)
+	if not crawler.load_checkpoint():
+		synsets = crawler.map.babel.find_synset_in_category(args.name, args.category)
+		if len(synsets) == 0:
+			raise SystemExit(f'No synsets found for {args.name} in category {args.category}')
+		crawler.seed(synsets[0].id)
+	print(crawler.run())
@@ -0,0 +1,88 @@
+import time
+import zlib
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+
+from synset_cache import CachedSense, CachedSynset
+
+
+class FakeBabelNet:
+	"""
+	Offline, deterministic BabelNet client with the same interface as BabelNetClient, for tests & benchmarks.
+	Every title maps to the same synset on every run, missing_rate of titles aren't concepts,
+	glosses mention other titles from the vocabulary, and categories are named like those from synthetic_category_links.
+	Each call sleeps for latency seconds to simulate the network round trip.
+	"""
+	def __init__(self, vocabulary: Optional[List[str]] = None, num_categories=10_000, latency=0.05, missing_rate=0.2, max_glosses=3) -> None:
+		self.vocabulary = vocabulary or [f'Category_{i}' for i in range(1, num_categories)]
+		self.num_categories = num_categories
+		self.latency = latency
+		self.missing_rate = missing_rate
+		self.max_glosses = max_glosses
+		self.calls = 0
+		self._lock = threading.Lock()
+		self._titles_by_id: Optional[Dict[str, str]] = None
+
+	def _wait(self) -> None:
+		with self._lock:
+			self.calls += 1
+		if self.latency:
+			time.sleep(self.latency)
+
+	def _make_synset(self, title: str) -> Optional[CachedSynset]:
+		seed = zlib.crc32(title.lower().encode('utf-8'))
+		rng = np.random.default_rng(seed)
+		if rng.random() < self.missing_rate:
+			return None
+		glosses = []
+		for _ in range(rng.integers(1, self.max_glosses + 1)):
+			words = [self.vocabulary[i] for i in rng.integers(len(self.vocabulary), size=3)]
+			glosses.append(f'{title.replace("_", " ")} is the study of {words[0]} and {words[1]} in {words[2]}.')
+		categories = [f'Category_{i}' for i in rng.integers(1, self.num_categories, size=rng.integers(1, 4))]
+		sense = CachedSense(title, title.replace('_', ' ').lower())
+		return CachedSynset(f'bn:{seed % 10**8:08d}n', 'CONCEPT', [sense], sense, categories, glosses)
+
+	def get_synset(self, babel_id: str) -> Optional[CachedSynset]:
+		self._wait()
+		with self._lock:
+			if self._titles_by_id is None:
+				synsets = filter(None, map(self._make_synset, self.vocabulary))
+				self._titles_by_id = {synset.id: synset.main_sense().full_lemma for synset in synsets}
+		title = self._titles_by_id.get(babel_id)
+		return None if title is None else self._make_synset(title)
+
+	def get_wiki_synset(self, wiki_id: str) -> Optional[CachedSynset]:
+		self._wait()
+		return self._make_synset(wiki_id)
+
+	def search_synsets(self, name: str) -> List[CachedSynset]:
+		self._wait()
+		titles = [name.replace(' ', '_')] + [f'{name}_({i})' for i in range(2)]
+		return [synset for synset in map(self._make_synset, titles) if synset is not None]
+
+
+class FakeBabelNetAPI:
+	"""
+	Stands in for the babelnet module (get_synset & get_synsets) used by synset_retriever, so the whole pipeline can run offline.
+	A FakeBabelNet's synsets are served as valid concepts, with BabelSynsetIDs.
+	"""
+	def __init__(self, client: FakeBabelNet) -> None:
+		self.client = client
+
+	@staticmethod
+	def _as_concept(synset: Optional[CachedSynset]) -> Optional[CachedSynset]:
+		from babelnet.synset import SynsetType
+		from babelnet.resources import BabelSynsetID
+		if synset is not None:
+			synset.id = BabelSynsetID(synset.id)
+			synset.type = SynsetType.CONCEPT
+		return synset
+
+	def get_synset(self, resource_id) -> Optional[CachedSynset]:
+		if resource_id.id.startswith('bn:'):
+			return self._as_concept(self.client.get_synset(resource_id.id))
+		return self._as_concept(self.client.get_wiki_synset(resource_id.id)) # Wikipedia title
+
+	def get_synsets(self, name: str, **filters) -> List[CachedSynset]:
+		return [self._as_concept(synset) for synset in self.client.search_synsets(name)]
@@ -0,0 +1,163 @@
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+def _stage_report(timers: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+	return {name: {'calls': int(calls), 'seconds': seconds, 'mean': seconds / calls, 'max': longest}
+	        for name, (calls, seconds, longest) in sorted(timers.items(), key=lambda item: -item[1][1])}
+
+
+class Instrumentation:
+	"""
+	Process wide stage timers & counters, off until enabled so instrumented code only pays for an attribute check.
+	Stage times are inclusive (a stage includes the stages it calls) and summed across threads.
+	While a concept is being recorded, the stages & counters on its thread are also added to the concept's record,
+	work handed to other threads (i.e. the async BabelNet layer) is only in the run's totals.
+	"""
+	def __init__(self, enabled=False) -> None:
+		self.enabled = enabled
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.reset()
+
+	def reset(self) -> None:
+		with self.lock:
+			self.timers: Dict[str, List[float]] = {} # name -> [calls, seconds, max seconds]
+			self.counters: Dict[str, int] = {}
+			self.concepts: List[Dict[str, Any]] = []
+			self.started = time.perf_counter()
+
+	def enable(self) -> None:
+		self.reset()
+		self.enabled = True
+
+	def disable(self) -> None:
+		self.enabled = False
+
+	def _current_concept(self) -> Optional[Dict[str, Any]]:
+		stack = getattr(self.local, 'concepts', None)
+		return stack[-1] if stack else None
+
+	def add_time(self, name: str, seconds: float) -> None:
+		concept = self._current_concept()
+		with self.lock:
+			for timers in (self.timers,) if concept is None else (self.timers, concept['stages']):
+				timer = timers.setdefault(name, [0, 0.0, 0.0])
+				timer[0] += 1
+				timer[1] += seconds
+				timer[2] = max(timer[2], seconds)
+
+	def count(self, name: str, n=1) -> None:
+		if not self.enabled:
+			return
+		concept = self._current_concept()
+		with self.lock:
+			for counters in (self.counters,) if concept is None else (self.counters, concept['counters']):
+				counters[name] = counters.get(name, 0) + n
+
+	@contextmanager
+	def stage(self, name: str) -> Iterator[None]:
+		if not self.enabled:
+			yield
+			return
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add_time(name, time.perf_counter() - start)
+
+	@contextmanager
+	def concept(self, name: Any) -> Iterator[None]:
+		"""Records the stages & counters of building a concept (on this thread) separately"""
+		if not self.enabled:
+			yield
+			return
+		record = {'concept': str(getattr(name, 'id', name)), 'seconds': 0.0, 'stages': {}, 'counters': {}}
+		if not hasattr(self.local, 'concepts'):
+			self.local.concepts = []
+		self.local.concepts.append(record)
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			record['seconds'] = time.perf_counter() - start
+			self.local.concepts.pop()
+			with self.lock:
+				self.concepts.append(record)
+
+	def report(self) -> Dict[str, Any]:
+		with self.lock:
+			return {
+				'seconds': time.perf_counter() - self.started,
+				'stages': _stage_report(self.timers),
+				'counters': dict(sorted(self.counters.items())),
+				'concepts': [{**record, 'stages': _stage_report(record['stages']), 'counters': dict(sorted(record['counters'].items()))}
+				             for record in self.concepts],
+			}
+
+	def save(self, path: str) -> Dict[str, Any]:
+		report = self.report()
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		with open(path, 'w') as f:
+			json.dump(report, f, indent=2)
+		return report
+
+	def summary(self, report: Optional[Dict[str, Any]] = None, top=5) -> str:
+		report = report or self.report()
+		lines = [f"Run: {report['seconds']:.2f}s, {len(report['concepts'])} concepts recorded", 'Stages (inclusive):']
+		for name, stage in report['stages'].items():
+			lines.append(f"\t{name}: {stage['seconds']:.3f}s over {stage['calls']} calls (mean {stage['mean'] * 1000:.2f}ms, max {stage['max'] * 1000:.1f}ms)")
+		lines.append('Counters:')
+		lines += [f'\t{name}: {value}' for name, value in report['counters'].items()]
+		hits, misses = report['counters'].get('synset_cache.hits', 0), report['counters'].get('synset_cache.misses', 0)
+		if hits + misses:
+			lines.append(f'\tsynset cache hit rate: {hits / (hits + misses):.1%}')
+		for concept in report['concepts']:
+			stages = ', '.join(f"{name} {stage['seconds']:.2f}s" for name, stage in list(concept['stages'].items())[:top])
+			lines.append(f"{concept['concept']}: {concept['seconds']:.2f}s ({stages})")
+		return '\n'.join(lines)
+
+
+instrumentation = Instrumentation()
+
+
+def timed(name: str) -> Callable[[F], F]:
+	"""Decorator timing every call of a function as the stage name, when instrumentation is enabled"""
+	def decorator(function: F) -> F:
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if not instrumentation.enabled:
+				return function(*args, **kwargs)
+			start = time.perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				instrumentation.add_time(name, time.perf_counter() - start)
+		return wrapper
+	return decorator
+
+
+def profile(function: Callable[..., T], *args, stats_path: Optional[str] = None, sort='cumulative', limit=30, **kwargs) -> Tuple[T, str]:
+	"""
+	Runs function under cProfile, returning its result & the top limit functions by sort.
+	The raw stats are also dumped to stats_path if given (for pstats, snakeviz, etc).
+	"""
+	profiler = cProfile.Profile()
+	result = profiler.runcall(function, *args, **kwargs)
+	if stats_path is not None:
+		os.makedirs(os.path.dirname(stats_path) or '.', exist_ok=True)
+		profiler.dump_stats(stats_path)
+	stream = io.StringIO()
+	pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
+	return result, stream.getvalue()
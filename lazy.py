@@ -0,0 +1,53 @@
+import time
+import logging
+import threading
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar('T')
+
+load_times: Dict[str, float] = {}
+_start = time.perf_counter()
+
+
+class Lazy(Generic[T]):
+	"""
+	Heavy resource that is only built on first use (or in the background by warm_up).
+	Safe to use from multiple threads, which all wait for the same build, and the build time is kept in load_times.
+	"""
+	def __init__(self, name: str, factory: Callable[[], T]) -> None:
+		self.name = name
+		self.factory = factory
+		self._value: Optional[T] = None
+		self._loaded = False
+		self._lock = threading.Lock()
+
+	@property
+	def loaded(self) -> bool:
+		return self._loaded
+
+	def get(self) -> T:
+		if self._loaded:
+			return self._value
+		with self._lock:
+			if not self._loaded:
+				logging.info(f"Loading {self.name}...")
+				start = time.perf_counter()
+				self._value = self.factory()
+				load_times[self.name] = time.perf_counter() - start
+				self._loaded = True
+		return self._value
+
+	def warm_up(self) -> threading.Thread:
+		"""Starts loading the resource in a background thread"""
+		thread = threading.Thread(target=self.get, name=f'warm-up {self.name}', daemon=True)
+		thread.start()
+		return thread
+
+
+def startup_report() -> str:
+	lines = [f'Startup timings ({time.perf_counter() - _start:.2f}s since import):']
+	for name, seconds in sorted(load_times.items(), key=lambda item: -item[1]):
+		lines.append(f'\t{name}: {seconds:.2f}s')
+	if len(load_times) == 0:
+		lines.append('\tNothing loaded yet')
+	return '\n'.join(lines)
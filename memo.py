@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+MISSING = object()
+
+
+class BoundedMemo:
+	"""
+	Dictionary of at most max_size entries, evicting the least recently used ('lru') or oldest ('fifo') entry when full.
+	Counts hits & misses for stats, and is safe to share between threads.
+	"""
+	policies = ('lru', 'fifo')
+
+	def __init__(self, max_size=100_000, policy='lru') -> None:
+		if policy not in self.policies:
+			raise ValueError(f"Unknown eviction policy: {policy} (expected one of {self.policies})")
+		self.max_size = max_size
+		self.policy = policy
+		self.entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.lock = threading.Lock()
+
+	def get(self, key: Hashable, default: Any = MISSING) -> Any:
+		"""Returns the value for the key, or default (MISSING unless given) on a miss"""
+		with self.lock:
+			value = self.entries.get(key, MISSING)
+			if value is MISSING:
+				self.misses += 1
+				return default
+			self.hits += 1
+			if self.policy == 'lru':
+				self.entries.move_to_end(key)
+			return value
+
+	def put(self, key: Hashable, value: Any) -> None:
+		with self.lock:
+			self.entries[key] = value
+			if self.policy == 'lru':
+				self.entries.move_to_end(key)
+			while len(self.entries) > self.max_size:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+
+	def clear(self) -> None:
+		with self.lock:
+			self.entries.clear()
+			self.hits = self.misses = self.evictions = 0
+
+	def __len__(self) -> int:
+		return len(self.entries)
+
+	def stats(self) -> Dict[str, Any]:
+		lookups = self.hits + self.misses
+		return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+		        'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,82 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from lazy import Lazy
+from instrumentation import instrumentation, timed
+
+
+class NounExtractor:
+	"""
+	Extracts cleaned noun chunks from glosses in batches with nlp.pipe.
+	Only the components noun_chunks depends on are loaded (NER & the lemmatizer are excluded),
+	batches of at least process_threshold glosses are parsed with n_process processes (up to 4, one per CPU, by default),
+	and results are cached by the hash of each gloss, so a gloss is only ever parsed once.
+	spaCy itself is only imported & loaded on the first parse.
+	"""
+	excluded = ['ner', 'lemmatizer']
+
+	def __init__(self, model='en_core_web_sm', batch_size=256, n_process: Optional[int] = None, process_threshold=2000) -> None:
+		self.logger = logging.getLogger(__name__)
+		self.model_name = model
+		self.model = Lazy(f'spaCy {model}', self._load)
+		self.batch_size = batch_size
+		self.n_process = n_process if n_process is not None else min(4, os.cpu_count() or 1)
+		self.process_threshold = process_threshold
+		self.cache: Dict[str, List[str]] = {}
+		self.lock = threading.Lock() # spaCy pipelines aren't thread safe
+
+	def _load(self):
+		import spacy
+		return spacy.load(self.model_name, exclude=self.excluded)
+
+	@property
+	def nlp(self):
+		return self.model.get()
+
+	@property
+	def stop_words(self):
+		return self.nlp.Defaults.stop_words
+
+	@staticmethod
+	def _key(gloss: str) -> str:
+		return hashlib.sha1(gloss.encode('utf-8')).hexdigest()
+
+	@timed('spacy.extract')
+	def extract(self, glosses: Iterable[str]) -> List[List[str]]:
+		"""Cleaned noun chunks of each gloss, in order"""
+		glosses = list(glosses)
+		keys = [self._key(gloss) for gloss in glosses]
+		with self.lock:
+			pending = {key: gloss for key, gloss in zip(keys, glosses) if key not in self.cache}
+			instrumentation.count('spacy.gloss_cache_hits', len(keys) - len(pending))
+			instrumentation.count('spacy.glosses_parsed', len(pending))
+			if len(pending):
+				self._parse(pending)
+			return [list(self.cache[key]) for key in keys]
+
+	def _parse(self, pending: Dict[str, str]) -> None:
+		n_process = self.n_process if len(pending) >= self.process_threshold else 1
+		start = time.perf_counter()
+		docs = self.nlp.pipe(pending.values(), batch_size=self.batch_size, n_process=n_process)
+		for key, doc in zip(pending, docs):
+			nouns = []
+			for noun in doc.noun_chunks:
+				cleaned_noun = self.clean_noun(noun.text)
+				if cleaned_noun == '':
+					self.logger.debug(f"Skipping empty noun: {noun.text}")
+					continue
+				nouns.append(cleaned_noun)
+			self.cache[key] = nouns
+		elapsed = time.perf_counter() - start
+		self.logger.info(f"Parsed {len(pending)} glosses in {elapsed:.2f}s ({len(pending) / max(elapsed, 1e-9):.0f} glosses/sec)")
+
+	# TODO: Find spacy way of dropping stop words
+	# TODO: Lemmatize?
+	def clean_noun(self, text: str) -> str:
+		words = text.split(' ')
+		words = [word for word in words if word not in self.stop_words]
+		return ' '.join(words).lower()
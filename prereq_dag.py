@@ -0,0 +1,98 @@
+import threading
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+
+class PrerequisiteDAG:
+	"""
+	Prerequisite graph (prereq -> concept edges) kept acyclic as edges are added, using the Pearce-Kelly
+	dynamic topological sort: every node has a position in a topological order, an edge that agrees with the order is
+	added in O(1), and one that doesn't only searches & reorders the nodes between its endpoints' positions.
+	Edges that would close a cycle are rejected and counted.
+	New prerequisites are placed first in the order and new concepts last, so growing the map outwards never reorders.
+	"""
+	def __init__(self, max_rejected_kept=1000) -> None:
+		self.order: Dict[Hashable, int] = {}
+		self.children: Dict[Hashable, Set[Hashable]] = {}
+		self.parents: Dict[Hashable, Set[Hashable]] = {}
+		self.rejected: List[Tuple[Hashable, Hashable]] = []
+		self.max_rejected_kept = max_rejected_kept
+		self.num_rejected = 0
+		self.num_reordered = 0
+		self.first = 0
+		self.last = -1
+		self.lock = threading.RLock()
+
+	@classmethod
+	def from_edges(cls, edges: Iterable[Tuple[Hashable, Hashable]]) -> 'PrerequisiteDAG':
+		dag = cls()
+		for prereq, concept in edges:
+			dag.add_edge(prereq, concept)
+		return dag
+
+	def add_node(self, node: Hashable, first=False) -> None:
+		"""Adds a node at the end (or start) of the topological order"""
+		with self.lock:
+			if node not in self.order:
+				if first:
+					self.first -= 1
+				else:
+					self.last += 1
+				self.order[node] = self.first if first else self.last
+				self.children[node] = set()
+				self.parents[node] = set()
+
+	def __contains__(self, node: object) -> bool:
+		return node in self.order
+
+	def has_edge(self, prereq: Hashable, concept: Hashable) -> bool:
+		return concept in self.children.get(prereq, ())
+
+	def add_edge(self, prereq: Hashable, concept: Hashable) -> bool:
+		"""Adds the edge unless it would create a cycle. Returns whether the edge is in the graph"""
+		with self.lock:
+			self.add_node(prereq, first=True)
+			self.add_node(concept)
+			if self.has_edge(prereq, concept):
+				return True
+			lower, upper = self.order[concept], self.order[prereq]
+			if prereq == concept or (lower < upper and not self._reorder(prereq, concept, lower, upper)):
+				self.num_rejected += 1
+				if len(self.rejected) < self.max_rejected_kept:
+					self.rejected.append((prereq, concept))
+				return False
+			self.children[prereq].add(concept)
+			self.parents[concept].add(prereq)
+			return True
+
+	def _reorder(self, prereq: Hashable, concept: Hashable, lower: int, upper: int) -> bool:
+		"""Moves the nodes affected by an edge against the order, or returns False if the edge would close a cycle"""
+		# Nodes reachable from the concept that are currently ordered before the prereq
+		forward, stack = {concept}, [concept]
+		while stack:
+			for child in self.children[stack.pop()]:
+				if child == prereq:
+					return False
+				if child not in forward and self.order[child] < upper:
+					forward.add(child)
+					stack.append(child)
+		# Nodes that reach the prereq that are currently ordered after the concept
+		backward, stack = {prereq}, [prereq]
+		while stack:
+			for parent in self.parents[stack.pop()]:
+				if parent not in backward and self.order[parent] > lower:
+					backward.add(parent)
+					stack.append(parent)
+		# Reuse the affected positions, placing everything that leads to the prereq before everything reachable from the concept
+		nodes = sorted(backward, key=self.order.__getitem__) + sorted(forward, key=self.order.__getitem__)
+		positions = sorted(self.order[node] for node in nodes)
+		for node, position in zip(nodes, positions):
+			self.order[node] = position
+		self.num_reordered += len(nodes)
+		return True
+
+	def topological_order(self) -> List[Hashable]:
+		return sorted(self.order, key=self.order.__getitem__)
+
+	def stats(self) -> Dict[str, int]:
+		return {'nodes': len(self.order), 'edges': sum(len(children) for children in self.children.values()),
+		        'rejected': self.num_rejected, 'reordered': self.num_reordered}
@@ -0,0 +1,59 @@
+import json
+import pandas as pd
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from typing import Any, Dict, List, Optional
+
+from concept_store import StoredConcept
+
+
+class QueryError(RuntimeError):
+	"""A query the server couldn't answer, with the HTTP status of its reply"""
+	def __init__(self, status: int, message: str) -> None:
+		super().__init__(f'{status}: {message}')
+		self.status = status
+
+
+class QueryClient:
+	"""
+	Client of a running query_service, so scripts & notebooks can query its loaded maps without loading them.
+	Only needs the standard library & pandas. Concepts are returned as StoredConcepts, rates as Series like WikiMap's.
+	"""
+	def __init__(self, url='http://127.0.0.1:8765', timeout: Optional[float] = None) -> None:
+		self.url = url.rstrip('/')
+		self.timeout = timeout
+
+	def _request(self, path: str, arguments: Optional[Dict[str, Any]] = None) -> Any:
+		data = None if arguments is None else json.dumps(arguments).encode('utf-8')
+		request = Request(f'{self.url}/{path}', data=data, headers={'Content-Type': 'application/json'})
+		try:
+			with urlopen(request, timeout=self.timeout) as response:
+				return json.load(response)['result']
+		except HTTPError as e:
+			with e:
+				body = e.read()
+			try:
+				message = json.loads(body)['error']
+			except (ValueError, KeyError):
+				message = body.decode('utf-8', 'replace')
+			raise QueryError(e.code, message) from None
+
+	def call(self, method: str, **arguments) -> Any:
+		return self._request(method, arguments)
+
+	def status(self) -> Dict[str, Any]:
+		return self._request('status')
+
+	def find_concept(self, name: str, wiki_category: str, definition_limit: Optional[int] = None) -> StoredConcept:
+		return StoredConcept(**self.call('find_concept', name=name, wiki_category=wiki_category, definition_limit=definition_limit))
+
+	def get_concept(self, babel_id: str, definition_limit: Optional[int] = None) -> StoredConcept:
+		return StoredConcept(**self.call('get_concept', babel_id=getattr(babel_id, 'id', babel_id), definition_limit=definition_limit))
+
+	def categorical_commonality(self, category_list1: List[str], category_list2: List[str]) -> float:
+		return self.call('categorical_commonality', category_list1=list(category_list1), category_list2=list(category_list2))
+
+	def get_clickthrough_rates(self, wiki_id: str, target_normalized=False, source_normalized=False, limit: Optional[int] = None) -> pd.Series:
+		result = self.call('get_clickthrough_rates', wiki_id=wiki_id, target_normalized=target_normalized,
+		                   source_normalized=source_normalized, limit=limit)
+		return pd.Series(result['rates'], index=pd.Index(result['targets'], dtype=object, name='target'), name='n')
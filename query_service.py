@@ -0,0 +1,177 @@
+import os
+import json
+import inspect
+import logging
+import argparse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from babelnet.resources import BabelSynsetID
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from concept_model import PrerequisiteMap, Concept, ConceptNotFound, StoredConceptMap
+from speedy_concept_model import SpeedyPrerequisiteMap
+from synset_retriever import configure_limiter, get_synset
+from wiki_clickthrough_map import ArticleNotFound
+from instrumentation import instrumentation
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+def concept_to_json(concept: Concept) -> Dict[str, Any]:
+	"""The concept's fields as a StoredConcept dict (ids as strings, definitions as [gloss, prereq ids] pairs)"""
+	return StoredConceptMap._dehydrate(concept)._asdict()
+
+
+class InvalidArguments(ValueError):
+	"""Arguments a query's method accepts but can't answer with"""
+
+
+class QueryService:
+	"""
+	Answers queries on a prerequisite map whose clickstream, category map & spaCy model stay loaded between them.
+	Arguments & results are JSON-able, so they can be served by QueryServer. Concurrent queries are safe with a SpeedyPrerequisiteMap,
+	which only builds each concept once.
+	"""
+	def __init__(self, prereq_map: PrerequisiteMap) -> None:
+		self.logger = logging.getLogger(__name__)
+		self.map = prereq_map
+		self.methods: Dict[str, Callable[..., Any]] = {
+			'find_concept': self.find_concept,
+			'get_concept': self.get_concept,
+			'categorical_commonality': self.categorical_commonality,
+			'get_clickthrough_rates': self.get_clickthrough_rates,
+		}
+
+	def find_concept(self, name: str, wiki_category: str, definition_limit: Optional[int] = None) -> Dict[str, Any]:
+		return concept_to_json(self.map.find_concept(name, wiki_category, definition_limit))
+
+	def get_concept(self, babel_id: str, definition_limit: Optional[int] = None) -> Dict[str, Any]:
+		synset = get_synset(BabelSynsetID(babel_id))
+		if synset is None:
+			raise ConceptNotFound(f'No concept synset found for {babel_id}')
+		return concept_to_json(self.map.get_concept(synset, definition_limit))
+
+	def categorical_commonality(self, category_list1: List[str], category_list2: List[str]) -> float:
+		return float(self.map.category_map.categorical_commonality(category_list1, category_list2))
+
+	def get_clickthrough_rates(self, wiki_id: str, target_normalized=False, source_normalized=False, limit: Optional[int] = None) -> Dict[str, list]:
+		"""The rates as parallel target & rate lists (only the limit highest, if given)"""
+		if source_normalized and target_normalized:
+			raise InvalidArguments('Cannot normalize based on both source and target')
+		rates = self.map.wiki.get_clickthrough_rates(wiki_id, target_normalized, source_normalized)
+		if limit is not None:
+			rates = rates.nlargest(limit)
+		return {'targets': rates.index.tolist(), 'rates': rates.tolist()}
+
+	def status(self) -> Dict[str, Any]:
+		return {
+			'methods': list(self.methods),
+			'concepts': len(self.map.map),
+			'startup': self.map.startup_report(),
+			'instrumentation': instrumentation.report() if instrumentation.enabled else None,
+		}
+
+	def call(self, method: str, arguments: Dict[str, Any]) -> Tuple[HTTPStatus, Dict[str, Any]]:
+		"""
+		Runs a query, returning the status & body of its reply ({'result': ...} or {'error': ...}).
+		Arguments that don't fit the method are a 400, concepts & articles that aren't found a 404, and any other failure a (logged) 500
+		"""
+		if method not in self.methods:
+			return HTTPStatus.NOT_FOUND, {'error': f'Unknown method: {method}'}
+		try:
+			inspect.signature(self.methods[method]).bind(**arguments)
+		except TypeError as e:
+			return HTTPStatus.BAD_REQUEST, {'error': f'{method}: {e}'}
+		try:
+			with instrumentation.stage(f'service.{method}'):
+				return HTTPStatus.OK, {'result': self.methods[method](**arguments)}
+		except InvalidArguments as e:
+			return HTTPStatus.BAD_REQUEST, {'error': str(e)}
+		except (ConceptNotFound, ArticleNotFound) as e:
+			return HTTPStatus.NOT_FOUND, {'error': str(e)}
+		except Exception as e:
+			self.logger.exception(f"Failed to answer {method}({arguments})")
+			return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(e)}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+	"""POST /<method> with a JSON object of its arguments, or GET /status"""
+	protocol_version = 'HTTP/1.1' # Keeps connections alive between a client's queries
+	server: 'QueryServer'
+
+	def do_GET(self) -> None:
+		if self.path.strip('/') == 'status':
+			self._reply(HTTPStatus.OK, {'result': self.server.service.status()})
+		else:
+			self._reply(HTTPStatus.NOT_FOUND, {'error': f'Unknown path: {self.path}'})
+
+	def do_POST(self) -> None:
+		try:
+			body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+			arguments = json.loads(body) if body else {}
+			if not isinstance(arguments, dict):
+				raise ValueError('Arguments must be a JSON object')
+		except ValueError as e:
+			self._reply(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+			return
+		self._reply(*self.server.service.call(self.path.strip('/'), arguments))
+
+	def _reply(self, status: HTTPStatus, body: Dict[str, Any]) -> None:
+		data = json.dumps(body).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format: str, *args) -> None:
+		logging.getLogger(__name__).debug(f"{self.address_string()} {format % args}")
+
+
+class QueryServer(ThreadingHTTPServer):
+	"""HTTP server answering each connection's queries on its own thread, see QueryClient for the client"""
+	daemon_threads = True
+	request_queue_size = 128 # Listen backlog, socketserver's default of 5 resets bursts of concurrent clients
+
+	def __init__(self, service: QueryService, host=DEFAULT_HOST, port=DEFAULT_PORT) -> None:
+		super().__init__((host, port), QueryHandler)
+		self.service = service
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serves prerequisite map queries from resident, already loaded resources')
+	parser.add_argument('--host', default=DEFAULT_HOST)
+	parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+	parser.add_argument('--map', default=None, help='Saved prerequisite map to answer from, new concepts are saved to it on exit')
+	parser.add_argument('--topic-sets', default=None, help='.npz of precomputed topic sets (computed for every article if missing)')
+	parser.add_argument('--no-wait', action='store_true', help='Serve before the resources finish loading (early queries wait for them)')
+	parser.add_argument('--instrument', action='store_true', help='Time the stages of each query, reported by /status')
+	parser.add_argument('--rate', type=float, default=10.0, help='BabelNet requests per second')
+	parser.add_argument('--daily-quota', type=int, default=1000, help="BabelNet requests allowed per (UTC) day, i.e. the key's babelcoins")
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO)
+	configure_limiter(rate=args.rate, daily_quota=args.daily_quota)
+	prereq_map = SpeedyPrerequisiteMap()
+	if args.instrument:
+		instrumentation.enable()
+	if args.map is not None and os.path.exists(args.map):
+		prereq_map.load(args.map)
+	warm_up = prereq_map.warm_up()
+	if args.topic_sets is not None:
+		prereq_map.precompute_topic_sets(path=args.topic_sets)
+	if not args.no_wait:
+		for thread in warm_up:
+			thread.join()
+		print(prereq_map.startup_report())
+	server = QueryServer(QueryService(prereq_map), args.host, args.port)
+	print(f'Serving on http://{args.host}:{server.server_port}')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		prereq_map.shutdown()
+		if args.map is not None:
+			prereq_map.save(args.map)
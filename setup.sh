@@ -8,8 +8,12 @@ mkdir -p ./datasets/generated
 sources=(
     https://dumps.wikimedia.org/other/clickstream/2023-05/clickstream-enwiki-2023-05.tsv.gz
     https://quarry.wmcloud.org/run/730104/output/0/tsv
-    # https://dumps.wikimedia.org/enwiki/latest/enwiki-latest-categorylinks.sql.gz
-    # https://dumps.wikimedia.org/enwiki/latest/enwiki-latest-page.sql.gz
+)
+
+# Kept gzipped, since the category graph is streamed straight from them (python category_map_generation.py --from-dumps)
+dumps=(
+    https://dumps.wikimedia.org/enwiki/latest/enwiki-latest-categorylinks.sql.gz
+    https://dumps.wikimedia.org/enwiki/latest/enwiki-latest-page.sql.gz
 )
 
 for source in "${sources[@]}"; do
@@ -28,6 +32,12 @@ done
 
 mv $data_dir/tsv $data_dir/enwiki-categories.tsv
 
+if [[ $1 == "--dumps" ]]; then
+    for source in "${dumps[@]}"; do
+        wget $source -P $data_dir --no-clobber
+    done
+fi
+
 set -e
 pipenv install
 pipenv shell
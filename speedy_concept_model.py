@@ -1,27 +1,136 @@
+import threading
 from babelnet import BabelSynset
 from babelnet.resources import BabelSynsetID
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Set
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List
 
-from concept_model import PrerequisiteMap, Definition
+from async_babelnet import QuotaExceededError
+from concept_model import PrerequisiteMap, Concept, Definition
+from instrumentation import instrumentation, timed
 
 
 
 class SpeedyPrerequisiteMap(PrerequisiteMap):
 	"""Drop-in replacement for PrerequisiteMap that parallelizes operations for speed."""
 
-	def _generate_definitions(self, synset: BabelSynset) -> List[Definition]:
+	def __init__(self, max_workers=8, gloss_workers=16, **kwargs) -> None:
+		"""
+		max_workers bounds how many concepts are built at once by expand, and gloss_workers how many
+		glosses (and topic sets) are processed at once across those concepts.
+		Other keyword arguments (i.e. warm_up, reject_cycles, instrument) are passed on to PrerequisiteMap.
+		"""
+		super().__init__(**kwargs)
+		self.lock = threading.RLock()
+		self.pending: Dict[BabelSynsetID, Future] = {}
+		self.concept_pool = ThreadPoolExecutor(max_workers, thread_name_prefix='concept')
+		self.gloss_pool = ThreadPoolExecutor(gloss_workers, thread_name_prefix='gloss')
+
+	def get_concept(self, synset: BabelSynset, definition_limit=None) -> Concept:
+		# Only one thread builds each concept, the rest wait for its result
+		with self.lock:
+			if synset.id in self.map:
+				return self.map[synset.id]
+			future = self.pending.get(synset.id)
+			is_owner = future is None
+			if is_owner:
+				future = self.pending[synset.id] = Future()
+		if not is_owner:
+			return future.result()
+		try:
+			concept = self._build_concept(synset, definition_limit)
+			with self.lock:
+				self.map[concept.babel_id] = concept
+			future.set_result(concept)
+			return concept
+		except BaseException as e:
+			future.set_exception(e)
+			raise
+		finally:
+			with self.lock:
+				del self.pending[synset.id]
+
+	def _build_concept(self, synset: BabelSynset, definition_limit=None) -> Concept:
+		with instrumentation.concept(synset.id):
+			topic_set = self.gloss_pool.submit(self._generate_topic_set, synset)
+			name = self.babel.get_name(synset)
+			definitions = self._generate_definitions(synset, limit=definition_limit)
+			wiki_id = self.babel.get_wiki_id(synset)
+			return Concept(name, synset.id, wiki_id, topic_set.result(), definitions)
+
+	@timed('concept.definitions')
+	def _generate_definitions(self, synset: BabelSynset, limit=None) -> List[Definition]:
+		wiki_id = self.babel.get_wiki_id(synset).title
+		categories = self.babel.get_categories(synset)
 		glosses = synset.glosses()
-		self.logger.info(f"Generating {len(glosses)} definitions for {self.search.get_name(synset)}")
-		pool = ThreadPoolExecutor(len(glosses))
-		categories = self.search.get_categories(synset)
-		jobs = [pool.submit(self._generate_prereqs, gloss.gloss, categories) for gloss in glosses]
+		if limit is not None:
+			glosses = glosses[:limit]
+		self.logger.info(f"Generating {len(glosses)} definitions for {self.babel.get_name(synset)}")
+		gloss_nouns = self.nouns.extract(gloss.gloss for gloss in glosses)
+		jobs = [self.gloss_pool.submit(self._generate_prereqs, wiki_id, gloss.gloss, categories, nouns=nouns) for gloss, nouns in zip(glosses, gloss_nouns)]
 		definitions = []
 		for job, gloss in zip(jobs, glosses):
 			prereqs = job.result()
-			prereqs -= set([synset.id])
+			prereqs.discard(synset.id)
+			prereqs = self._link_prereqs(synset.id, prereqs)
 			definitions.append(Definition(gloss.gloss, prereqs))
 		return definitions
-	
-	def _generate_prereqs(self, definition: str, parent_categories: List[str]) -> Set[BabelSynsetID]:
-		NotImplementedError()
+
+	def expand(self, synset: BabelSynset, depth=1, definition_limit=None) -> Concept:
+		"""
+		Gets a concept, then breadth-first the concepts of its prerequisites, down to depth levels below it.
+		Each concept's prerequisites are queued as soon as it's built, so up to max_workers concepts are in flight,
+		and the glosses of all the prerequisites queued together are parsed in one batch.
+		Prerequisites that fail to be fetched or built are logged & skipped. Once the BabelNet quota is used up,
+		no more are queued and the partially expanded tree is returned once the concepts in flight finish.
+		"""
+		root = self.get_concept(synset, definition_limit)
+		seen = {root.babel_id}
+		jobs = {}
+		quota_exceeded = False
+		def stop(error: QuotaExceededError) -> None:
+			nonlocal quota_exceeded
+			if not quota_exceeded:
+				self.logger.warning(f"Stopping expansion of {root.name}: {error}")
+			quota_exceeded = True
+		def queue(concept: Concept, level: int) -> None:
+			if level >= depth or quota_exceeded:
+				return
+			babel_ids = list(set().union(*(definition.prereqs for definition in concept.definitions)) - seen)
+			seen.update(babel_ids)
+			fetcher = self.babel.fetcher
+			synsets = []
+			for babel_id, result in zip(babel_ids, fetcher.run(fetcher.get_synsets(babel_ids, return_exceptions=True))):
+				if isinstance(result, QuotaExceededError):
+					stop(result)
+				elif isinstance(result, Exception):
+					self.logger.warning(f"Failed to fetch prerequisite {babel_id}: {result!r}")
+				elif result is not None:
+					synsets.append(result)
+			if quota_exceeded:
+				return
+			try:
+				self.nouns.extract(gloss.gloss for synset in synsets if synset.id not in self.map for gloss in synset.glosses()[:definition_limit])
+			except Exception:
+				self.logger.exception("Failed to batch the prerequisites' glosses, they're parsed as each concept is built")
+			for synset in synsets:
+				jobs[self.concept_pool.submit(self.get_concept, synset, definition_limit)] = level + 1
+		queue(root, 0)
+		while jobs:
+			done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+			for job in done:
+				level = jobs.pop(job)
+				try:
+					concept = job.result()
+				except QuotaExceededError as e:
+					stop(e)
+					continue
+				except Exception:
+					self.logger.exception("Failed to expand a prerequisite")
+					continue
+				if concept is not None:
+					queue(concept, level)
+		return root
+
+	def shutdown(self) -> None:
+		self.concept_pool.shutdown()
+		self.gloss_pool.shutdown()
@@ -4,13 +4,20 @@
 # * RUN AS `python sqldump_to_csv.py dump.sql > dump.csv`
 
 import fileinput
+import argparse
 import csv
+import io
+import os
+import re
 import sys
+import time
+from operator import itemgetter
+from multiprocessing import Pool
 from tqdm import tqdm
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
 
 
-__all__ = ['sqldump_to_csv']
+__all__ = ['sqldump_to_csv', 'sqldump_to_csv_parallel']
 
 
 def is_insert(line: str):
@@ -94,7 +101,115 @@ def parse_values(values: str):
             yield latest_row
 
 
-def parse_sql_file(file, row_filter=None, columns: Optional[List[int]]=None):
+# One alternative per token: a quoted string (with backslash escapes), a bare value (number or NULL), or the end of a row.
+# Commas, opening parens & the final semicolon don't match, so they are skipped
+_VALUE_TOKENS = re.compile(r"'([^'\\]*(?:\\.[^'\\]*)*)'|([^,'()\s;]+)|(\))", re.DOTALL)
+_ESCAPES = re.compile(r"\\(.)", re.DOTALL)
+_ESCAPED_CHARS = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a', '%': '\\%', '_': '\\_'}
+# Escapes csv can't decode itself (it drops the backslash of any escape, so \n would become n)
+_CSV_UNDECODABLE = re.compile(r"\\[^'\\]")
+_drop_first = itemgetter(slice(1, None))
+_drop_last = itemgetter(slice(None, -1))
+
+
+def _unescape(match: re.Match) -> str:
+    return _ESCAPED_CHARS.get(match.group(1), match.group(1))
+
+
+def _csv_escape(match: re.Match) -> str:
+    # Escapes every character of the decoded escape, so csv's escapechar handling decodes it
+    return ''.join('\\' + char for char in _ESCAPED_CHARS.get(match.group(1), match.group(1)))
+
+
+def _tokenize_rows(values: str):
+    latest_row = []
+    for quoted, bare, row_end in _VALUE_TOKENS.findall(values):
+        if row_end:
+            yield latest_row
+            latest_row = []
+        elif bare:
+            latest_row.append(chr(0) if bare == 'NULL' else bare)
+        elif quoted:
+            latest_row.append(_ESCAPES.sub(_unescape, quoted) if '\\' in quoted else quoted)
+        else:
+            latest_row.append(chr(0))
+
+
+def _first_row_shape(values: str) -> Tuple[int, bool]:
+    """
+    Returns the number of columns in the first row, and whether its first column is a bare value
+    """
+    arity, bare_first = 0, False
+    for match in _VALUE_TOKENS.finditer(values):
+        if match.group(3):
+            break
+        if arity == 0:
+            bare_first = match.group(2) is not None
+        arity += 1
+    return arity, bare_first
+
+
+def _split_columns(fields: List[str], arity: int, has_null: bool, columns: Optional[List[int]]=None) -> List[List[str]]:
+    """
+    Given every field of an INSERT statement from csv.reader, return the given columns (or all of them) of the rows.
+    Rows are found by position, so parentheses inside strings are harmless
+    """
+    selected = []
+    for i in (range(arity) if columns is None else columns):
+        column = fields[i::arity]
+        if i == 0:
+            column = list(map(_drop_first, column)) # Opening parens
+        if i == arity - 1:
+            column = list(map(_drop_last, column)) # Closing parens
+            column[-1] = column[-1][:-1] # Final semicolon
+        # NULLs & empty strings are only recognizable once the parens are stripped from the first & last columns
+        if '' in column or (has_null and 'NULL' in column):
+            column = [field if field and field != 'NULL' else chr(0) for field in column]
+        selected.append(column)
+    return selected
+
+
+def tokenize_values(values: str, columns: Optional[List[int]]=None):
+    """
+    Alternative to parse_values, which finds the rows of the (...),(...); tuples by their column count
+    rather than guessing from parentheses, so strings containing parentheses are kept intact.
+    MySQL escapes (e.g. \\n, \\', \\\\) are decoded, and NULLs & empty strings are chr(0), like parse_values.
+
+    Statements are split by csv's C tokenizer, with rows assembled column-wise. csv decodes \\' & \\\\ itself,
+    and the few other escapes (\\n, \\t, \\0, ...) are rewritten into escapes it decodes beforehand.
+    Statements csv can't split unambiguously (e.g. with a 'NULL' string) are tokenized with a regex instead.
+
+    Parameters
+    ----------
+    columns : list, optional
+        Which columns to return. If not specified, all columns are returned
+    """
+    arity, bare_first = _first_row_shape(values)
+    if bare_first and "'NULL'" not in values and values.rstrip().endswith(');'):
+        escaped = _ESCAPES.sub(_csv_escape, values) if _CSV_UNDECODABLE.search(values) else values
+        try:
+            fields = next(csv.reader([escaped], delimiter=',', doublequote=False, escapechar='\\', quotechar="'", strict=True))
+        except csv.Error: # i.e. NUL characters before Python 3.11
+            fields = []
+        if len(fields) and len(fields) % arity == 0:
+            return map(list, zip(*_split_columns(fields, arity, 'NULL' in values, columns)))
+    return tokenize_values_regex(values, columns)
+
+
+def tokenize_values_regex(values: str, columns: Optional[List[int]]=None):
+    """
+    tokenize_values' fallback, which tokenizes the statement with a regex in a single pass and decodes escapes field by field
+    """
+    rows = _tokenize_rows(values)
+    if columns is not None:
+        rows = ([row[i] for i in columns] for row in rows)
+    return rows
+
+
+PARSERS = {'csv': parse_values, 'tokenizer': tokenize_values, 'regex': tokenize_values_regex}
+
+
+def parse_sql_file(file, row_filter=None, columns: Optional[List[int]]=None, parser=parse_values):
     """
     Given a file handle of a MySQL dump file, generate rows
 
@@ -106,19 +221,25 @@ def parse_sql_file(file, row_filter=None, columns: Optional[List[int]]=None):
         Function which takes a row and returns True if it should be kept
     columns : list, optional
         Which columns to keep in the CSV. If not specified, all columns are kept
+    parser : function, optional
+        Function which generates rows from the values of an INSERT statement (parse_values or tokenize_values)
     """
     for line in file:
         if is_insert(line):
             values = get_values(line)
             if values_sanity_check(values):
-                for row in parse_values(values):
+                if parser in (tokenize_values, tokenize_values_regex) and row_filter is None:
+                    # Only the kept columns are assembled into rows
+                    yield from parser(values, columns)
+                    continue
+                for row in parser(values):
                     if row_filter is None or row_filter(row):
                         if columns is not None:
                             row = [row[i] for i in columns]
                         yield row
 
 
-def sqldump_to_csv(source_file, outfile, row_filter=None, columns: Optional[List[int]]=None):
+def sqldump_to_csv(source_file, outfile, row_filter=None, columns: Optional[List[int]]=None, parser=parse_values):
     """
     Parameters
     ----------
@@ -127,16 +248,111 @@ def sqldump_to_csv(source_file, outfile, row_filter=None, columns: Optional[List
     """
     try:
         writer = csv.writer(outfile, quoting=csv.QUOTE_MINIMAL)
-        for row in parse_sql_file(source_file, row_filter, columns):
+        for row in parse_sql_file(source_file, row_filter, columns, parser):
             writer.writerow(row)
     except KeyboardInterrupt:
         quit(0)
 
 
-def sqldump_to_csv_path(source_path: str, outpath: str, row_filter=None, columns=None, source_encoding='iso-8859-1', out_encoding='utf-8'):
-    with open(source_path, 'r', encoding=source_encoding) as infile:
-        with open(outpath, 'w', encoding=out_encoding) as outfile:
-            sqldump_to_csv(infile, outfile, row_filter, columns)
+def split_byte_ranges(path: str, chunk_bytes=64 * 2**20) -> List[Tuple[int, int]]:
+    """
+    Splits a file into byte ranges of roughly chunk_bytes, each starting at the beginning of an INSERT INTO line
+    (apart from the first, which starts at the beginning of the file)
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        position = chunk_bytes
+        while position < size:
+            f.seek(position)
+            f.readline() # Skip to the end of the current line
+            line_start, line = f.tell(), f.readline()
+            while line and not line.startswith(b'INSERT INTO'):
+                line_start, line = f.tell(), f.readline()
+            if not line:
+                break
+            bounds.append(line_start)
+            position = line_start + chunk_bytes
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_byte_range(path: str, start: int, stop: int, encoding='iso-8859-1') -> Iterator[str]:
+    """
+    Yields the decoded lines between two line-aligned byte offsets
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < stop:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode(encoding)
+
+
+def _byte_range_to_csv(args) -> str:
+    path, start, stop, row_filter, columns, encoding, parser = args
+    outfile = io.StringIO()
+    writer = csv.writer(outfile, quoting=csv.QUOTE_MINIMAL)
+    writer.writerows(parse_sql_file(read_byte_range(path, start, stop, encoding), row_filter, columns, parser))
+    return outfile.getvalue()
+
+
+def sqldump_to_csv_parallel(source_path: str, outfile, row_filter=None, columns: Optional[List[int]]=None, workers: Optional[int]=None,
+                            ordered=True, source_encoding='iso-8859-1', chunk_bytes=64 * 2**20, parser=parse_values):
+    """
+    Converts a dump with a pool of processes, each parsing a byte range of INSERT lines
+
+    Parameters
+    ----------
+    row_filter : function, optional
+        Must be picklable (i.e. a module level function) to be sent to the workers
+    workers : int, optional
+        Number of processes, defaults to the number of CPUs
+    ordered : bool
+        Write rows in their original order. Otherwise they are written as soon as each range is parsed
+    """
+    ranges = split_byte_ranges(source_path, chunk_bytes)
+    tasks = [(source_path, start, stop, row_filter, columns, source_encoding, parser) for start, stop in ranges]
+    with Pool(workers) as pool:
+        results = pool.imap(_byte_range_to_csv, tasks) if ordered else pool.imap_unordered(_byte_range_to_csv, tasks)
+        for text in tqdm(results, total=len(tasks), desc=f"Converting {os.path.basename(source_path)}"):
+            outfile.write(text)
+
+
+def sqldump_to_csv_path(source_path: str, outpath: str, row_filter=None, columns=None, source_encoding='iso-8859-1', out_encoding='utf-8',
+                        workers=1, ordered=True, parser=parse_values):
+    with open(outpath, 'w', encoding=out_encoding) as outfile:
+        if workers == 1:
+            with open(source_path, 'r', encoding=source_encoding) as infile:
+                sqldump_to_csv(infile, outfile, row_filter, columns, parser)
+        else:
+            sqldump_to_csv_parallel(source_path, outfile, row_filter, columns, workers, ordered, source_encoding, parser=parser)
+
+
+def benchmark_parsers(path: str, columns: Optional[List[int]]=None, source_encoding='iso-8859-1', max_lines=100, repeat=3) -> dict:
+    """
+    Times parse_sql_file with each of the PARSERS on the first INSERT lines of a dump, returning rows/sec & MB/sec for the best run
+    (or the error, for parsers that can't handle the dump)
+    """
+    with open(path, 'r', encoding=source_encoding) as f:
+        lines = [line for line in f if is_insert(line)][:max_lines]
+    megabytes = sum(len(line) for line in lines) / 2**20
+    results = {}
+    for name, parser in PARSERS.items():
+        best = float('inf')
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = sum(1 for _ in parse_sql_file(lines, columns=columns, parser=parser))
+                best = min(best, time.perf_counter() - start)
+        except Exception as e:
+            results[name] = {'error': repr(e)}
+            continue
+        results[name] = {'rows': rows, 'seconds': best, 'rows_per_sec': rows / best, 'mb_per_sec': megabytes / best}
+    return results
 
 
 def peak_file(path: str, rows=5, start=0):
@@ -163,7 +379,28 @@ def main():
     """
     Parse arguments and start the program
     """
-    sqldump_to_csv(fileinput.input(openhook=fileinput.hook_encoded("iso-8859-1")), sys.stdout, columns=[0, 1, 6])
+    parser = argparse.ArgumentParser(description='Converts MySQL dump files to CSV on stdout')
+    parser.add_argument('files', nargs='*', help='Dump files (defaults to stdin)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes parsing each file (requires file paths)')
+    parser.add_argument('--unordered', action='store_true', help='Write rows as soon as they are parsed, instead of in file order')
+    parser.add_argument('--parser', choices=PARSERS.keys(), default='csv', help='How INSERT values are parsed')
+    parser.add_argument('--benchmark', action='store_true', help='Compare the throughput of the parsers on the files instead of converting them')
+    args = parser.parse_args()
+    columns = [0, 1, 6]
+    values_parser = PARSERS[args.parser]
+    if args.benchmark:
+        for path in args.files:
+            for name, result in benchmark_parsers(path, columns).items():
+                if 'error' in result:
+                    print(f"{path} [{name}]: failed with {result['error']}")
+                else:
+                    print(f"{path} [{name}]: {result['rows_per_sec']:,.0f} rows/sec, {result['mb_per_sec']:.1f} MB/sec")
+        return
+    if args.workers == 1 or not args.files:
+        sqldump_to_csv(fileinput.input(args.files, openhook=fileinput.hook_encoded("iso-8859-1")), sys.stdout, columns=columns, parser=values_parser)
+        return
+    for path in args.files:
+        sqldump_to_csv_parallel(path, sys.stdout, columns=columns, workers=args.workers, ordered=not args.unordered, parser=values_parser)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from lazy import Lazy
+
+
+@dataclass(frozen=True)
+class CachedSense:
+	full_lemma: str
+	normalized_lemma: str
+
+
+@dataclass(frozen=True)
+class CachedGloss:
+	gloss: str
+
+
+@dataclass(frozen=True)
+class CachedCategory:
+	value: str
+
+
+class CachedSynset:
+	"""
+	Stands in for the parts of BabelSynset the project reads: its id & type, Wikipedia senses, main sense, categories and glosses.
+	Only one language is kept, so the language & source arguments are ignored.
+	"""
+	def __init__(self, babel_id: Any, synset_type: Any, senses: List[CachedSense], main_sense: CachedSense,
+	             categories: List[str], glosses: List[str]) -> None:
+		self.id = babel_id
+		self.type = synset_type
+		self._senses = senses
+		self._main_sense = main_sense
+		self._categories = [CachedCategory(category) for category in categories]
+		self._glosses = [CachedGloss(gloss) for gloss in glosses]
+
+	@classmethod
+	def from_synset(cls, synset, language=None, source=None) -> 'CachedSynset':
+		"""Copies the fields of a BabelSynset, with senses from the given source (i.e. Wikipedia)"""
+		senses = [CachedSense(sense.full_lemma, sense.normalized_lemma) for sense in synset.senses(language=language, source=source)]
+		main_sense = synset.main_sense(language)
+		main_sense = senses[0] if main_sense is None else CachedSense(main_sense.full_lemma, main_sense.normalized_lemma)
+		categories = [category.value for category in synset.categories(language)]
+		glosses = [gloss.gloss for gloss in synset.glosses()]
+		return cls(synset.id, synset.type, senses, main_sense, categories, glosses)
+
+	def to_record(self) -> Dict[str, Any]:
+		return {
+			'type': getattr(self.type, 'name', self.type), # SynsetTypes are stored by name
+			'senses': [[sense.full_lemma, sense.normalized_lemma] for sense in self._senses],
+			'main_sense': [self._main_sense.full_lemma, self._main_sense.normalized_lemma],
+			'categories': [category.value for category in self._categories],
+			'glosses': [gloss.gloss for gloss in self._glosses],
+		}
+
+	@classmethod
+	def from_record(cls, babel_id: Any, record: Dict[str, Any], type_factory: Callable[[str], Any] = str) -> 'CachedSynset':
+		senses = [CachedSense(*sense) for sense in record['senses']]
+		return cls(babel_id, type_factory(record['type']), senses, CachedSense(*record['main_sense']), record['categories'], record['glosses'])
+
+	def senses(self, language=None, source=None) -> List[CachedSense]:
+		return list(self._senses)
+
+	def main_sense(self, language=None) -> CachedSense:
+		return self._main_sense
+
+	def categories(self, language=None) -> List[CachedCategory]:
+		return list(self._categories)
+
+	def glosses(self, language=None, source=None) -> List[CachedGloss]:
+		return list(self._glosses)
+
+	def __repr__(self) -> str:
+		return f'CachedSynset({self.id}, {self._main_sense.full_lemma})'
+
+
+def _id_string(babel_id: Any) -> str:
+	return getattr(babel_id, 'id', babel_id) # BabelSynsetID keeps the 'bn:...' string in id
+
+
+class SynsetCache:
+	"""
+	Single file SQLite cache of synset lookups, with an in-process LRU in front of it.
+	Synsets are stored once each (as compact JSON of the fields CachedSynset keeps),
+	and every lookup key (e.g. a synset id, Wikipedia title or search) maps to a list of synset ids, possibly empty.
+	id_factory & type_factory turn stored id strings & type names back into ids & types (i.e. BabelSynsetID & SynsetType).
+	The file is only opened (and its directory created) on first use, so creating a cache is free.
+	"""
+	def __init__(self, path='datasets/cache/synsets.sqlite', lru_size=100_000, id_factory: Callable[[str], Any] = str,
+	             type_factory: Callable[[str], Any] = str) -> None:
+		self.path = path
+		self.lru_size = lru_size
+		self.id_factory = id_factory
+		self.type_factory = type_factory
+		self.lru: 'OrderedDict[str, List[CachedSynset]]' = OrderedDict()
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.lock = threading.RLock()
+		self._connection = Lazy('synset cache', self._connect)
+
+	def _connect(self) -> sqlite3.Connection:
+		os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+		connection = sqlite3.connect(self.path, check_same_thread=False)
+		connection.execute('PRAGMA journal_mode=WAL')
+		connection.execute('PRAGMA synchronous=NORMAL')
+		connection.execute('CREATE TABLE IF NOT EXISTS synsets (id TEXT PRIMARY KEY, record TEXT NOT NULL) WITHOUT ROWID')
+		connection.execute('CREATE TABLE IF NOT EXISTS lookups (key TEXT PRIMARY KEY, ids TEXT NOT NULL) WITHOUT ROWID')
+		connection.commit()
+		return connection
+
+	@property
+	def connection(self) -> sqlite3.Connection:
+		return self._connection.get()
+
+	def _remember(self, key: str, synsets: List[CachedSynset]) -> None:
+		self.lru[key] = synsets
+		self.lru.move_to_end(key)
+		while len(self.lru) > self.lru_size:
+			self.lru.popitem(last=False)
+
+	def _read_synsets(self, ids: List[str]) -> Optional[List[CachedSynset]]:
+		if len(ids) == 0:
+			return []
+		rows = self.connection.execute(f'SELECT id, record FROM synsets WHERE id IN ({",".join("?" * len(ids))})', ids).fetchall()
+		records = dict(rows)
+		if len(records) != len(set(ids)):
+			return None
+		return [CachedSynset.from_record(self.id_factory(babel_id), json.loads(records[babel_id]), self.type_factory) for babel_id in ids]
+
+	def get(self, key: str) -> Optional[List[CachedSynset]]:
+		"""Synsets cached for the key (empty if the lookup found nothing), or None on a miss"""
+		with self.lock:
+			if key in self.lru:
+				self.hits += 1
+				self.lru.move_to_end(key)
+				return self.lru[key]
+			row = self.connection.execute('SELECT ids FROM lookups WHERE key = ?', (key,)).fetchone()
+			synsets = None if row is None else self._read_synsets(json.loads(row[0]))
+			if synsets is None:
+				self.misses += 1
+				return None
+			self.disk_hits += 1
+			self._remember(key, synsets)
+			return synsets
+
+	def __contains__(self, key: str) -> bool:
+		with self.lock:
+			return key in self.lru or self.connection.execute('SELECT 1 FROM lookups WHERE key = ?', (key,)).fetchone() is not None
+
+	def put(self, key: str, synsets: List[CachedSynset]) -> None:
+		self.put_many([(key, synsets)])
+
+	def put_many(self, entries: Iterable[Tuple[str, List[CachedSynset]]]) -> None:
+		"""Writes many lookups in a single transaction"""
+		entries = list(entries)
+		synset_rows = {_id_string(synset.id): json.dumps(synset.to_record(), separators=(',', ':')) for _, synsets in entries for synset in synsets}
+		lookup_rows = [(key, json.dumps([_id_string(synset.id) for synset in synsets])) for key, synsets in entries]
+		with self.lock:
+			with self.connection:
+				self.connection.executemany('INSERT OR REPLACE INTO synsets VALUES (?, ?)', synset_rows.items())
+				self.connection.executemany('INSERT OR REPLACE INTO lookups VALUES (?, ?)', lookup_rows)
+			for key, synsets in entries:
+				self._remember(key, synsets)
+
+	def warm_load(self, limit: Optional[int] = None) -> int:
+		"""Bulk loads (up to limit, and the LRU size) cached lookups into memory, returning how many were loaded"""
+		limit = min(limit or self.lru_size, self.lru_size)
+		with self.lock:
+			lookups = [(key, json.loads(ids)) for key, ids in self.connection.execute('SELECT key, ids FROM lookups LIMIT ?', (limit,))]
+			needed = list(set().union(*(ids for _, ids in lookups)))
+			records = {}
+			for start in range(0, len(needed), 900): # Stays under SQLite's bound parameter limit
+				chunk = needed[start:start + 900]
+				records.update(self.connection.execute(f'SELECT id, record FROM synsets WHERE id IN ({",".join("?" * len(chunk))})', chunk))
+			synsets = {babel_id: CachedSynset.from_record(self.id_factory(babel_id), json.loads(record), self.type_factory) for babel_id, record in records.items()}
+			loaded = 0
+			for key, ids in lookups:
+				if all(babel_id in synsets for babel_id in ids):
+					self._remember(key, [synsets[babel_id] for babel_id in ids])
+					loaded += 1
+			return loaded
+
+	def stats(self) -> Dict[str, int]:
+		with self.lock:
+			synsets, = self.connection.execute('SELECT COUNT(*) FROM synsets').fetchone()
+			lookups, = self.connection.execute('SELECT COUNT(*) FROM lookups').fetchone()
+		return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'in_memory': len(self.lru), 'synsets': synsets, 'lookups': lookups}
+
+	def close(self) -> None:
+		with self.lock:
+			if self._connection.loaded:
+				self.connection.close()
@@ -1,71 +1,133 @@
 import logging
 import babelnet as bn
-from joblib import Memory
 from logging import getLogger
 from babelnet.sense import BabelSense
 from babelnet.synset import SynsetType
 from babelnet import BabelSynset, Language
-from babelnet.resources import ResourceID, WikipediaID
+from babelnet.resources import BabelSynsetID, ResourceID, WikipediaID
 from babelnet.data.source import BabelSenseSource
-from typing import List, Optional
+from typing import Iterable, List, Optional
 
 from category_map import CategoryMap
+from async_babelnet import AsyncBabelNet, DailyUsage, TokenBucket
+from synset_cache import CachedSynset, SynsetCache
+from instrumentation import instrumentation, timed
 
-memory = Memory("datasets/cache")
+cache = SynsetCache('datasets/cache/synsets.sqlite', id_factory=BabelSynsetID, type_factory=SynsetType.__getitem__) # Opened on first use
+
+def configure_limiter(rate=10.0, capacity=20, daily_quota: Optional[int] = 1000,
+                      usage_path: Optional[str] = 'datasets/cache/babelnet_usage.sqlite') -> TokenBucket:
+	"""
+	Replaces the limiter every BabelNet request (sync or through AsyncBabelNet) waits for, i.e. for a key with another quota.
+	The day's usage is kept in usage_path (beside the cache), or only in memory if it's None.
+	"""
+	global limiter
+	limiter = TokenBucket(rate, capacity, daily_quota, DailyUsage(usage_path))
+	return limiter
+
+limiter = configure_limiter()
 
 
 def is_valid_concept(synset: BabelSynset) -> bool:
 	return synset.type == SynsetType.CONCEPT and len(synset.senses(source=BabelSenseSource.WIKI))
 
-@memory.cache(verbose=0)
-def get_synset(babel_id: ResourceID) -> Optional[BabelSynset]:
-	logging.info(f"Getting synset for '{babel_id}'...")
-	synset = bn.get_synset(babel_id)
-	if synset is not None and is_valid_concept(synset):
-		return synset
+def _resource_key(resource_id: ResourceID) -> str:
+	return f"{type(resource_id).__name__}:{getattr(resource_id, 'language', '')}:{resource_id.id}"
+
+def _search_key(name: str, lang: Language) -> str:
+	return f"search:{lang}:{name}"
+
+def _to_cached(synset: BabelSynset, lang=Language.EN) -> CachedSynset:
+	return CachedSynset.from_synset(synset, lang, BabelSenseSource.WIKI)
+
+def get_synset(babel_id: ResourceID) -> Optional[CachedSynset]:
+	"""Valid concept synsets are cached (as CachedSynsets, with English fields) in the synset cache, along with misses"""
+	key = _resource_key(babel_id)
+	synsets = cache.get(key)
+	instrumentation.count('synset_cache.hits' if synsets is not None else 'synset_cache.misses')
+	if synsets is None:
+		logging.info(f"Getting synset for '{babel_id}'...")
+		limiter.acquire_blocking()
+		instrumentation.count('babelnet.calls')
+		with instrumentation.stage('babelnet.get_synset'):
+			synset = bn.get_synset(babel_id)
+		synsets = [_to_cached(synset)] if synset is not None and is_valid_concept(synset) else []
+		cache.put(key, synsets)
+	return synsets[0] if len(synsets) else None
 
 def id_to_name(babel_id: ResourceID, lang=Language.EN) -> str:
 	synset = get_synset(babel_id)
 	return synset.main_sense(lang).normalized_lemma
 
-@memory.cache(verbose=0)
-def search_synsets(name: str, lang=Language.EN) -> List[BabelSynset]:
+def search_synsets(name: str, lang=Language.EN) -> List[CachedSynset]:
 	if name == '':
 		raise ValueError("Cannot search for empty string")
-	logging.info(f"Searching synsets for '{name}'...")
-	return bn.get_synsets(name, from_langs={lang}, sources=[BabelSenseSource.WIKI], synset_filters={is_valid_concept})
+	key = _search_key(name, lang)
+	synsets = cache.get(key)
+	instrumentation.count('synset_cache.hits' if synsets is not None else 'synset_cache.misses')
+	if synsets is None:
+		logging.info(f"Searching synsets for '{name}'...")
+		limiter.acquire_blocking()
+		instrumentation.count('babelnet.calls')
+		with instrumentation.stage('babelnet.get_synsets'):
+			found = bn.get_synsets(name, from_langs={lang}, sources=[BabelSenseSource.WIKI], synset_filters={is_valid_concept})
+		synsets = [_to_cached(synset, lang) for synset in found]
+		cache.put(key, synsets)
+	return synsets
+
+
+class BabelNetClient:
+	"""Blocking (but cached) BabelNet calls, wrapped by AsyncBabelNet"""
+	rate_limited = True # Cache misses wait for the module's limiter
+	def __init__(self, language=Language.EN) -> None:
+		self.lang = language
+
+	def is_cached(self, method: str, *args) -> bool:
+		if method == 'get_synset':
+			return _resource_key(*args) in cache
+		if method == 'get_wiki_synset':
+			return _resource_key(WikipediaID(args[0], self.lang)) in cache
+		return _search_key(*args, self.lang) in cache
+
+	def get_synset(self, babel_id: ResourceID) -> Optional[BabelSynset]:
+		return get_synset(babel_id)
+
+	def get_wiki_synset(self, wiki_id: str) -> Optional[BabelSynset]:
+		return get_synset(WikipediaID(wiki_id, self.lang))
+
+	def search_synsets(self, name: str) -> List[BabelSynset]:
+		return search_synsets(name, self.lang)
 
 
 
 class SynsetRetriever():
-	def __init__(self, language=Language.EN) -> None:
+	def __init__(self, language=Language.EN, client=None, concurrency=8, compact=False, shortlist: Optional[int] = None) -> None:
+		"""
+		compact & shortlist are passed to the CategoryMap: the memory-mapped category graph,
+		and pruning candidate synsets by commonality bounds (see best_candidate).
+		"""
 		self.logger = getLogger(__name__)
 		self.lang = language
-		self.category_map = CategoryMap()
+		self.category_map = CategoryMap(compact=compact, shortlist=shortlist)
+		self.fetcher = AsyncBabelNet(client or BabelNetClient(language), concurrency, bucket=limiter)
 
+	@timed('synset_retriever.find_synset_like')
 	def find_synset_like(self, name: str, categories: List[str], commonality_threshold=0.25) -> Optional[BabelSynset]:
 		self.logger.info(f"Finding synset like '{name}' with categories {categories}")
 		synsets = search_synsets(name, self.lang)
 		if len(synsets) == 0:
 			return None
-		best_synset = None
-		best_commonality = 0
 		self.logger.debug(f"Found {len(synsets)} synsets for '{name}'")
-		for candidate in synsets:
-			candidate_categories = self.get_categories(candidate)
-			if len(candidate_categories) == 0:
+		candidate_categories = [self.get_categories(candidate) for candidate in synsets]
+		for candidate, candidate_category_list in zip(synsets, candidate_categories):
+			if len(candidate_category_list) == 0:
 				self.logger.warning(f"Synset '{self.get_name(candidate)}' has no categories")
-				continue
-			self.logger.debug(f"Getting categorical commonality for '{self.get_name(candidate)}' ({candidate.id})")
-			commonality = self.category_map.categorical_commonality(candidate_categories, categories)
-			if commonality > best_commonality:
-				best_synset = candidate
-				best_commonality = commonality
-			if best_commonality == 1: # Perfect match, no need to continue
-				break
-		if best_synset is None:
+		# First candidate with the highest commonality (those without categories have none)
+		best, best_commonality = self.category_map.best_candidate(categories, candidate_categories)
+		if best < 0:
 			self.logger.warning(f"No synsets found for '{name}' with categories {categories}.\nCandidates: {synsets}")
 			return None
+		best_synset = synsets[best]
 		if best_commonality < commonality_threshold:
 			self.logger.warning(f"Synset '{self.get_name(best_synset)}' ({best_synset.id}) has low commonality "
 			                    f"({best_commonality:.2f} < {commonality_threshold:.2f})")
@@ -77,6 +139,11 @@ class SynsetRetriever():
 	def get_wiki_synset(self, wiki_id: str) -> Optional[BabelSynset]:
 		return get_synset(WikipediaID(wiki_id.lower(), self.lang))
 
+	@timed('synset_retriever.get_wiki_synsets')
+	def get_wiki_synsets(self, wiki_ids: Iterable[str]) -> List[Optional[BabelSynset]]:
+		"""Fetches the synsets of many articles concurrently (None for those that aren't concepts)"""
+		return self.fetcher.run(self.fetcher.get_wiki_synsets(wiki_ids))
+
 	def get_categories(self, synset: BabelSynset) -> List[str]:
 		return [category.value for category in synset.categories(self.lang) if category.value in self.category_map.categories]
 
@@ -0,0 +1,85 @@
+import gzip
+import numpy as np
+import pandas as pd
+from typing import List
+
+
+def synthetic_category_links(num_categories=10_000, max_parents=3, cycle_rate=0.01, seed=0) -> pd.DataFrame:
+	"""
+	Random item -> category relations shaped like the Wikipedia category graph:
+	'Contents' > 'Main_topic_classifications' > Category_i, where each category has 1 to max_parents parents,
+	mostly earlier categories (so the graph is deep) with a small portion of back edges creating cycles.
+	"""
+	rng = np.random.default_rng(seed)
+	children = np.arange(1, num_categories)
+	counts = rng.integers(1, max_parents + 1, size=len(children))
+	items = np.repeat(children, counts)
+	parents = (rng.random(len(items)) ** 2 * items).astype(np.int64) # Skewed towards the top of the tree
+	back_edges = rng.random(len(items)) < cycle_rate
+	parents[back_edges] = rng.integers(1, num_categories, size=back_edges.sum())
+	keep = parents != items
+	names = np.array(['Main_topic_classifications'] + [f'Category_{i}' for i in range(1, num_categories)], dtype=object)
+	df = pd.DataFrame({'item': names[items[keep]], 'category': names[parents[keep]]})
+	df = pd.concat([pd.DataFrame({'item': ['Main_topic_classifications'], 'category': ['Contents']}), df], ignore_index=True)
+	return df.drop_duplicates(ignore_index=True)
+
+
+def synthetic_clickstream(path: str, titles: List[str], links_per_article=20, zipf=1.5, other_rate=0.2, seed=0) -> None:
+	"""
+	Writes a clickstream TSV (source, target, type, n) shaped like clickstream-enwiki, where each title links to
+	links_per_article others on average with Zipf distributed clicks (at least 10, like the published dumps).
+	other_rate of the rows are 'external' & 'other' types, which the readers filter out.
+	"""
+	rng = np.random.default_rng(seed)
+	titles = np.array(titles, dtype=object)
+	sources = np.repeat(np.arange(len(titles)), rng.poisson(links_per_article, size=len(titles)))
+	targets = rng.integers(len(titles), size=len(sources))
+	types = np.where(rng.random(len(sources)) < other_rate, rng.choice(['external', 'other'], size=len(sources)), 'link')
+	clicks = np.minimum(rng.zipf(zipf, size=len(sources)), 10**6) + 9
+	df = pd.DataFrame({'source': titles[sources], 'target': titles[targets], 'type': types, 'n': clicks})
+	df.to_csv(path, sep='\t', header=False, index=False)
+
+
+def _sql_string(value: str) -> str:
+	return "'" + value.replace('\\', '\\\\').replace("'", "\\'").replace('\n', '\\n') + "'"
+
+def synthetic_categorylinks_dump(path: str, num_rows=100_000, rows_per_insert=1000, awkward_rate=0.05, seed=0) -> None:
+	"""
+	Writes a MySQL dump shaped like enwiki-latest-categorylinks.sql, whose titles include
+	the characters that trip up dump parsers (parentheses, commas, quotes & backslashes).
+	Like the real cl_sortkey, some sort keys have a prefix ending in a newline (escaped as \\n)
+	"""
+	rng = np.random.default_rng(seed)
+	awkward = ['Foo_(bar)', "O'Brien", 'A,_B_and_C', 'Back\\slash', '(Leading)', 'Trailing)', "It's_(complicated),_really"]
+	types = ['page', 'subcat', 'file']
+	with open(path, 'w', encoding='iso-8859-1') as f:
+		f.write("-- MySQL dump\n\nDROP TABLE IF EXISTS `categorylinks`;\nCREATE TABLE `categorylinks` (\n  `cl_from` int(8) unsigned NOT NULL DEFAULT 0\n);\n\n")
+		for start in range(0, num_rows, rows_per_insert):
+			rows = []
+			for i in range(start, min(start + rows_per_insert, num_rows)):
+				title = awkward[i % len(awkward)] if rng.random() < awkward_rate else f'Category_{rng.integers(num_rows)}'
+				prefix = 'NULL' if rng.random() < 0.1 else _sql_string('')
+				sortkey = f'PREFIX\n{title.upper()}' if rng.random() < 0.1 else title.upper()
+				rows.append(f"({i},{_sql_string(title)},{_sql_string(sortkey)},'2023-05-01 00:00:00',{prefix},'uppercase','{types[i % 3]}')")
+			f.write(f"INSERT INTO `categorylinks` VALUES {','.join(rows)};\n")
+		f.write("UNLOCK TABLES;\n")
+
+def synthetic_category_dumps(df: pd.DataFrame, page_path: str, categorylinks_path: str, rows_per_insert=1000, seed=0) -> None:
+	"""
+	Writes page & categorylinks dumps (gzipped if the paths end in .gz) for item -> category relations,
+	like those from synthetic_category_links. Each item is a category page (namespace 14) linked as a subcat,
+	and an article (namespace 0) is added to each category to be filtered out
+	"""
+	rng = np.random.default_rng(seed)
+	titles = pd.unique(pd.concat([df['item'], df['category']]))
+	page_ids = dict(zip(titles, rng.permutation(len(titles)) * 2 + 1))
+	pages = [(page_ids[title], 14, title) for title in titles] + [(page_id + 1, 0, title) for title, page_id in page_ids.items()]
+	links = [(page_ids[item], category, 'subcat') for item, category in zip(df['item'], df['category'])]
+	links += [(page_ids[title] + 1, title, 'page') for title in titles]
+	def write(path: str, table: str, rows: list) -> None:
+		opener = gzip.open if path.endswith('.gz') else open
+		with opener(path, 'wt', encoding='utf-8') as f:
+			for start in range(0, len(rows), rows_per_insert):
+				f.write(f"INSERT INTO `{table}` VALUES {','.join(rows[start:start + rows_per_insert])};\n")
+	write(page_path, 'page', [f"({page_id},{namespace},{_sql_string(title)},0,0,0.5,'20230501000000','20230501000000',1,100,'wikitext',NULL)" for page_id, namespace, title in pages])
+	write(categorylinks_path, 'categorylinks', [f"({page_id},{_sql_string(category)},'','2023-05-01 00:00:00','','uppercase','{relation}')" for page_id, category, relation in links])
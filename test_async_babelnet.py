@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from async_babelnet import AsyncBabelNet, DailyUsage, QuotaExceededError, TokenBucket
+from fake_babelnet import FakeBabelNet
+
+
+def _unlimited(client, concurrency=8, daily_quota=None, usage=None) -> AsyncBabelNet:
+	return AsyncBabelNet(client, concurrency, bucket=TokenBucket(rate=1e9, capacity=10**9, daily_quota=daily_quota, usage=usage))
+
+
+class _CountingClient(FakeBabelNet):
+	"""FakeBabelNet that tracks how many calls run at once, and reports the titles in cached as cached"""
+	def __init__(self, cached=(), **kwargs) -> None:
+		super().__init__(**kwargs)
+		self.cached = set(cached)
+		self.running = self.max_running = 0
+
+	def is_cached(self, method: str, *args) -> bool:
+		return args[0] in self.cached
+
+	def get_wiki_synset(self, wiki_id: str):
+		with self._lock:
+			self.running += 1
+			self.max_running = max(self.max_running, self.running)
+		try:
+			return super().get_wiki_synset(wiki_id)
+		finally:
+			with self._lock:
+				self.running -= 1
+
+
+def test_concurrent_calls_are_coalesced():
+	fake = FakeBabelNet(latency=0.05, missing_rate=0)
+	babelnet = _unlimited(fake)
+	titles = ['Category_1', 'category_1', 'Category_2', 'Category_1', 'Category_2']
+	synsets = babelnet.run(babelnet.get_wiki_synsets(titles))
+	assert fake.calls == 2
+	assert babelnet.stats()['requests'] == 2 and babelnet.stats()['coalesced'] == 3
+	expected = FakeBabelNet(latency=0, missing_rate=0)
+	assert [synset.id for synset in synsets] == [expected.get_wiki_synset(title.lower()).id for title in titles]
+	babelnet.run(babelnet.get_wiki_synsets(['Category_1'])) # Finished calls aren't reused
+	assert fake.calls == 3
+	babelnet.close()
+
+
+def test_concurrency_is_bounded():
+	fake = _CountingClient(latency=0.02)
+	babelnet = _unlimited(fake, concurrency=3)
+	babelnet.run(babelnet.get_wiki_synsets([f'Category_{i}' for i in range(1, 13)]))
+	assert fake.max_running == 3
+	babelnet.close()
+
+
+def test_each_event_loop_gets_its_own_semaphore():
+	fake = _CountingClient(latency=0.01)
+	babelnet = _unlimited(fake, concurrency=2)
+	titles = [f'Category_{i}' for i in range(1, 7)]
+	for _ in range(2): # Fresh loops, besides the background one run uses
+		assert len(asyncio.run(babelnet.get_wiki_synsets(titles))) == len(titles)
+	assert len(babelnet.run(babelnet.get_wiki_synsets(titles))) == len(titles)
+	assert fake.max_running == 2
+	babelnet.close()
+
+
+def test_cached_calls_take_no_tokens():
+	fake = _CountingClient(cached=['category_1'], latency=0)
+	babelnet = _unlimited(fake, daily_quota=1)
+	babelnet.run(babelnet.get_wiki_synsets(['Category_1', 'Category_2', 'Category_1']))
+	assert babelnet.stats()['requests'] == 1 and babelnet.stats()['used_today'] == 1
+	babelnet.close()
+
+
+def test_token_bucket_bursts_then_waits_in_order():
+	bucket = TokenBucket(rate=100.0, capacity=5)
+	delays = [bucket.reserve() for _ in range(10)]
+	assert delays[:5] == [0.0] * 5
+	assert delays[5:] == pytest.approx([0.01, 0.02, 0.03, 0.04, 0.05], abs=4e-3)
+	time.sleep(0.2) # Refills past the reserved tokens, up to capacity
+	assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+	assert bucket.reserve() == pytest.approx(0.01, abs=4e-3)
+
+
+def test_token_bucket_is_shared_by_threads():
+	bucket = TokenBucket(rate=1_000.0, capacity=1)
+	delays = []
+	def reserve() -> None:
+		for _ in range(50):
+			delays.append(bucket.reserve())
+	threads = [threading.Thread(target=reserve) for _ in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	# Every token is reserved once: the waits are 1ms apart, up to the 200th request's
+	assert sorted(delays)[-1] == pytest.approx(0.199, abs=0.02)
+	assert bucket.used_today == 200
+
+
+def test_daily_quota_is_kept_across_restarts(tmp_path, monkeypatch):
+	path = str(tmp_path / 'usage.sqlite')
+	fake = FakeBabelNet(latency=0)
+	babelnet = _unlimited(fake, daily_quota=3, usage=DailyUsage(path))
+	babelnet.run(babelnet.get_wiki_synsets(['Category_1', 'Category_2']))
+	babelnet.close()
+	restarted = _unlimited(fake, daily_quota=3, usage=DailyUsage(path))
+	assert restarted.stats()['used_today'] == 2
+	restarted.run(restarted.get_wiki_synset('Category_3'))
+	with pytest.raises(QuotaExceededError):
+		restarted.run(restarted.get_wiki_synset('Category_4'))
+	assert fake.calls == 3
+	monkeypatch.setattr(DailyUsage, '_today', staticmethod(lambda: '2100-01-01')) # Resets at midnight UTC
+	assert restarted.stats()['used_today'] == 0
+	restarted.run(restarted.get_wiki_synset('Category_4'))
+	restarted.close()
+
+
+def test_in_memory_daily_quota():
+	usage = DailyUsage()
+	assert [usage.take(2) for _ in range(2)] == [1, 2]
+	with pytest.raises(QuotaExceededError):
+		usage.take(2)
+	assert usage.today() == 2
@@ -0,0 +1,59 @@
+import pytest
+
+from category_map_generation import get_category_depth, get_category_depth_recursive, get_child_tree
+from synthetic_data import synthetic_category_links
+
+
+def _children(num_categories: int, seed: int, max_parents=3, cycle_rate=0.01):
+	return get_child_tree(synthetic_category_links(num_categories, max_parents, cycle_rate, seed))
+
+
+def _edges(children):
+	return [(parent, child) for parent, items in children.items() for child in items]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_reference_on_trees(seed):
+	children = _children(2_000, seed, max_parents=1, cycle_rate=0)
+	assert get_category_depth(children) == get_category_depth_recursive(children)
+
+
+@pytest.mark.parametrize('root', ['Contents', 'Main_topic_classifications'])
+@pytest.mark.parametrize('seed', range(5))
+def test_never_deeper_than_reference(seed, root):
+	children = _children(2_000, seed)
+	depths = get_category_depth(children, root)
+	expected = get_category_depth_recursive(children, root)
+	assert [c for c in children if (depths[c] is None) != (expected[c] is None)] == []
+	assert [c for c in children if depths[c] is not None and depths[c] > expected[c]] == []
+
+
+@pytest.mark.parametrize('root', ['Contents', 'Main_topic_classifications'])
+@pytest.mark.parametrize('seed', range(5))
+def test_shortest_depths(seed, root):
+	children = _children(2_000, seed)
+	depths = get_category_depth(children, root)
+	assert depths[root] == 0
+	# No edge is a shortcut, and every other reachable category has a parent one level up
+	for parent, child in _edges(children):
+		if depths[parent] is not None:
+			assert depths[child] is not None and depths[child] <= depths[parent] + 1
+	has_parent_above = {child for parent, child in _edges(children) if depths[parent] is not None and depths[child] == depths[parent] + 1}
+	assert {c for c, depth in depths.items() if depth not in (None, 0)} == has_parent_above
+
+
+def test_multiple_roots():
+	children = _children(2_000, 0)
+	depths = get_category_depth(children, ['Category_1', 'Category_2'])
+	one, two = get_category_depth(children, 'Category_1'), get_category_depth(children, 'Category_2')
+	for category in children:
+		reachable = [depth for depth in (one[category], two[category]) if depth is not None]
+		assert depths[category] == (min(reachable) if reachable else None)
+
+
+def test_shortcut_is_shallower_than_reference():
+	# Lists fix the order the reference visits children in: it reaches D through B & C first,
+	# then doesn't descend into A because D is within its depth + 2 guard
+	children = {'Contents': ['B', 'A'], 'A': ['D'], 'B': ['C'], 'C': ['D'], 'D': []}
+	assert get_category_depth_recursive(children) == {'Contents': 0, 'A': 1, 'B': 1, 'C': 2, 'D': 3}
+	assert get_category_depth(children) == {'Contents': 0, 'A': 1, 'B': 1, 'C': 2, 'D': 2}
@@ -0,0 +1,140 @@
+import random
+from typing import List, Optional
+
+import numpy as np
+import pytest
+
+from category_graph import CategoryGraph
+from category_map import CategoryMap
+from category_map_generation import generate_category_map, get_parent_tree
+from synthetic_data import synthetic_category_links
+
+ROOT = 'Main_topic_classifications'
+
+
+def _parent_tree(num_categories: int, seed: int, max_parents=3):
+	links, _ = generate_category_map(synthetic_category_links(num_categories, max_parents, seed=seed))
+	return {category: sorted(parents) for category, parents in get_parent_tree(links).items()}
+
+
+def _old_category_path(categories, child: str, parent: str) -> Optional[List[str]]:
+	"""CategoryMap.category_path before the ancestor index"""
+	parents = categories.get(child, [])
+	if len(parents) == 0:
+		return None
+	if parent in parents:
+		return [parent]
+	for category in parents:
+		path = _old_category_path(categories, category, parent)
+		if path is not None:
+			return [category, *path]
+
+
+def _old_distance(cat1: str, path1: List[str], cat2: str, path2: List[str]) -> int:
+	"""CategoryMap.categorical_distance before the ancestor index, on the given root paths"""
+	path1 = [cat1, *path1]
+	path2 = [cat2, *path2]
+	for i1, c1 in enumerate(path1):
+		for i2, c2 in enumerate(path2):
+			if c1 == c2:
+				return i1 + i2 + 1
+	raise AssertionError(f"Paths don't meet: {path1} & {path2}")
+
+
+def _pairs(categories: List[str], num_pairs: int, seed: int):
+	rng = random.Random(seed)
+	return [(rng.choice(categories), rng.choice(categories)) for _ in range(num_pairs)]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_old_distances_on_trees(seed):
+	tree = _parent_tree(2_000, seed, max_parents=1)
+	category_map = CategoryMap(categories=tree)
+	connected = [category for category in tree if _old_category_path(tree, category, ROOT) is not None]
+	for cat1, cat2 in _pairs(connected, 500, seed):
+		expected = _old_distance(cat1, _old_category_path(tree, cat1, ROOT), cat2, _old_category_path(tree, cat2, ROOT))
+		assert category_map.categorical_distance(cat1, cat2) == expected
+		assert category_map.category_path(cat1, ROOT) == _old_category_path(tree, cat1, ROOT)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_old_distances_on_root_paths(seed):
+	tree = _parent_tree(2_000, seed)
+	category_map = CategoryMap(categories=tree)
+	assert [c for c in tree if category_map.category_in_root(c) != (_old_category_path(tree, c, ROOT) is not None)] == []
+	connected = [category for category in tree if category_map.category_in_root(category)]
+	pairs = _pairs(connected, 500, seed)
+	distances = category_map.index.distances([cat1 for cat1, _ in pairs], [cat2 for _, cat2 in pairs])
+	for i, (cat1, cat2) in enumerate(pairs):
+		path1, path2 = category_map.category_path(cat1, ROOT), category_map.category_path(cat2, ROOT)
+		assert distances[i, i] == _old_distance(cat1, path1, cat2, path2)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_root_paths_are_shortest(seed):
+	tree = _parent_tree(2_000, seed)
+	index = CategoryMap(categories=tree).index
+	for category in tree:
+		path = index.path_to_root(category)
+		if path is None:
+			continue
+		assert path[-1] == ROOT
+		assert all(parent in tree[child] for child, parent in zip([category, *path], path))
+		assert len(path) == index.depths[index.graph.names.lookup(category)]
+
+
+def test_lower_bounds():
+	tree = _parent_tree(2_000, 0)
+	index = CategoryMap(categories=tree).index
+	ids = np.flatnonzero(index.connected(np.arange(len(index.graph))))
+	ids1, ids2 = np.random.default_rng(0).choice(ids, size=(2, 5_000))
+	assert np.all(index.distance_lower_bounds(ids1, ids2) <= index.distance_ids(ids1, ids2))
+
+
+@pytest.mark.parametrize('shortlist', [1, 4])
+@pytest.mark.parametrize('seed', range(3))
+def test_shortlist_matches_exact_scoring(seed, shortlist):
+	tree = _parent_tree(2_000, seed)
+	exact, pruned = CategoryMap(categories=tree), CategoryMap(categories=tree, shortlist=shortlist)
+	pruned.prune_min_pairs = 0 # Prune even small batches
+	rng = random.Random(seed)
+	categories = list(tree)
+	for _ in range(200):
+		reference = rng.sample(categories, rng.randint(1, 6))
+		candidate_lists = [rng.sample(categories, rng.randint(0, 5)) for _ in range(rng.randint(0, 30))]
+		if candidate_lists and rng.random() < 0.2: # Tied candidates
+			candidate_lists.append(list(candidate_lists[0]))
+		assert pruned.best_candidate(reference, candidate_lists) == exact.best_candidate(reference, candidate_lists)
+
+
+def test_compact_backend_matches_dict(tmp_path):
+	links, _ = generate_category_map(synthetic_category_links(2_000, seed=0))
+	CategoryGraph.from_links(links['item'], links['category']).save(str(tmp_path))
+	tree = {category: sorted(parents) for category, parents in get_parent_tree(links).items()}
+	plain, compact = CategoryMap(categories=tree), CategoryMap(categories=CategoryGraph.load(str(tmp_path)))
+	assert [c for c in tree if compact.category_in_root(c) != plain.category_in_root(c)] == []
+	connected = [category for category in tree if plain.category_in_root(category)]
+	for cat1, cat2 in _pairs(connected, 500, 0):
+		assert compact.categorical_distance(cat1, cat2) == plain.categorical_distance(cat1, cat2)
+		path = plain.category_path(cat1, ROOT)
+		assert compact.category_path(cat1, ROOT) == path
+		for parent in (path[len(path) // 2], tree[cat2][0]): # Off the root, paths are found by walking the parents
+			assert compact.category_path(cat1, parent) == plain.category_path(cat1, parent)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_batch_commonality_matches_pairwise(seed):
+	tree = _parent_tree(2_000, seed)
+	category_map = CategoryMap(categories=tree)
+	rng = random.Random(seed)
+	connected = [category for category in tree if category_map.category_in_root(category)]
+	unconnected = [category for category in tree if not category_map.category_in_root(category)] + [ROOT, 'Not_a_category']
+	assert len(unconnected) > 2
+	for _ in range(100):
+		reference = rng.sample(connected, rng.randint(0, 5)) + rng.sample(unconnected, rng.randint(0, 1))
+		candidate_lists = [rng.sample(connected, rng.randint(0, 4)) + rng.sample(unconnected, rng.randint(0, 2)) for _ in range(rng.randint(0, 10))]
+		candidate_lists += [[], rng.sample(unconnected, 2)]
+		rng.shuffle(candidate_lists)
+		expected = [category_map.categorical_commonality(candidates, reference) for candidates in candidate_lists]
+		assert category_map.batch_commonality(reference, candidate_lists).tolist() == expected
+	assert category_map.batch_commonality(connected[:3], []).tolist() == []
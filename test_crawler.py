@@ -0,0 +1,157 @@
+import json
+import random
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('babelnet')
+from babelnet.resources import BabelSynsetID
+from babelnet.synset import SynsetType
+
+import synset_retriever
+from async_babelnet import QuotaExceededError, TokenBucket
+from concept_model import Concept, Definition
+from crawler import Crawler, _id_string
+from fake_babelnet import FakeBabelNet, FakeBabelNetAPI
+from prereq_dag import PrerequisiteDAG
+from synset_cache import SynsetCache
+from wiki_clickthrough_map import ArticleNotFound
+
+
+class _Wiki:
+	def __init__(self, rates: Dict[str, Dict[str, float]]) -> None:
+		self.rates = rates
+
+	def get_clickthrough_rates(self, wiki_id: str, source_normalized=False) -> pd.Series:
+		if wiki_id not in self.rates:
+			raise ArticleNotFound(f'Article not found: {wiki_id}')
+		return pd.Series(self.rates[wiki_id], dtype=float)
+
+
+class _Map:
+	"""Stands in for PrerequisiteMap, with each concept's prerequisites given up front"""
+	def __init__(self, prereqs: Dict[str, List[str]], rates: Dict[str, Dict[str, float]], quota: Optional[int] = None) -> None:
+		self.babel = synset_retriever.SynsetRetriever()
+		self.dag = PrerequisiteDAG()
+		self.wiki = _Wiki(rates)
+		self.prereqs = prereqs
+		self.quota = quota
+		self.expanded: List[str] = []
+		self.loaded: Optional[List[str]] = None
+
+	def get_concept(self, synset, definition_limit=None) -> Concept:
+		if self.quota is not None and len(self.expanded) >= self.quota:
+			raise QuotaExceededError('Daily quota reached')
+		babel_id = _id_string(synset.id)
+		self.expanded.append(babel_id)
+		wiki_id = self.babel.get_wiki_id(synset)
+		return Concept(wiki_id.title, synset.id, wiki_id, set(), [Definition('', {BabelSynsetID(i) for i in self.prereqs[babel_id]})])
+
+	def save(self, path: str) -> None:
+		with open(path, 'w') as f:
+			json.dump(self.expanded, f)
+
+	def load(self, path: str) -> None:
+		with open(path) as f:
+			self.loaded = json.load(f)
+
+
+@pytest.fixture
+def graph(tmp_path, monkeypatch):
+	"""Prerequisites & clickthrough rates between FakeBabelNet concepts, served offline"""
+	fake = FakeBabelNet(num_categories=300, latency=0)
+	monkeypatch.setattr(synset_retriever, 'bn', FakeBabelNetAPI(fake))
+	monkeypatch.setattr(synset_retriever, 'limiter', TokenBucket(rate=1e9, capacity=10**9))
+	monkeypatch.setattr(synset_retriever, 'cache', SynsetCache(str(tmp_path / 'synsets.sqlite'), id_factory=BabelSynsetID,
+	                                                          type_factory=SynsetType.__getitem__))
+	synsets = [synset for synset in map(fake.get_wiki_synset, fake.vocabulary) if synset is not None]
+	ids = [synset.id for synset in synsets]
+	titles = {synset.id: synset.main_sense().full_lemma.lower() for synset in synsets}
+	rng = random.Random(0)
+	prereqs = {babel_id: rng.sample([i for i in ids if i != babel_id], 3) for babel_id in ids}
+	rates = {titles[babel_id]: {titles[prereq]: rng.random() for prereq in prereqs[babel_id]} for babel_id in ids[::2]}
+	return ids[0], prereqs, rates
+
+
+def _crawler(tmp_path, graph, quota=None, **kwargs) -> Crawler:
+	_, prereqs, rates = graph
+	tmp_path.mkdir(exist_ok=True)
+	return Crawler(_Map(prereqs, rates, quota), str(tmp_path / 'crawl.json'), str(tmp_path / 'map.json'), **kwargs)
+
+
+def _synset(babel_id: str):
+	return synset_retriever.get_synset(BabelSynsetID(babel_id))
+
+
+def _within(prereqs: Dict[str, List[str]], seed: str, max_depth: int) -> Dict[str, int]:
+	depths, frontier = {seed: 0}, [seed]
+	for depth in range(1, max_depth + 1):
+		frontier = [prereq for babel_id in frontier for prereq in prereqs[babel_id] if prereq not in depths]
+		depths.update((prereq, depth) for prereq in frontier)
+	return depths
+
+
+def test_expands_breadth_first_to_max_depth(tmp_path, graph):
+	seed, prereqs, _ = graph
+	crawler = _crawler(tmp_path, graph, max_depth=2, ctr_weight=0)
+	crawler.seed(seed)
+	stats = crawler.run()
+	expanded = crawler.map.expanded
+	depths = _within(prereqs, seed, 2)
+	assert sorted(expanded) == sorted(depths)
+	assert [depths[babel_id] for babel_id in expanded] == sorted(depths.values())
+	assert stats['stopped_by'] == 'frontier exhausted' and stats['concepts'] == len(expanded) and stats['queued'] == 0
+
+
+def test_well_trafficked_prerequisites_come_first(tmp_path, graph):
+	seed, prereqs, rates = graph
+	crawler = _crawler(tmp_path, graph, max_depth=2)
+	crawler.seed(seed)
+	crawler.run()
+	seed_rates = next(iter(rates.values())) # The seed is the first concept, with rates
+	expected = sorted(prereqs[seed], key=lambda babel_id: -seed_rates[crawler.map.babel.get_wiki_id(_synset(babel_id)).title])
+	assert crawler.map.expanded[1:4] == expected
+
+
+def test_resumes_from_checkpoint(tmp_path, graph):
+	seed = graph[0]
+	full = _crawler(tmp_path / 'full', graph)
+	full.seed(seed)
+	full.run()
+	first = _crawler(tmp_path, graph, max_concepts=5, checkpoint_every=2)
+	first.seed(seed)
+	assert first.run()['stopped_by'] == 'concept budget'
+	resumed = _crawler(tmp_path, graph)
+	assert resumed.load_checkpoint()
+	assert resumed.map.loaded == first.map.expanded
+	stats = resumed.run()
+	assert first.map.expanded + resumed.map.expanded == full.map.expanded
+	assert stats['concepts'] == len(full.map.expanded)
+
+
+def test_quota_requeues_concept_with_its_priority(tmp_path, graph):
+	seed, prereqs, rates = graph
+	full = _crawler(tmp_path / 'full', graph)
+	full.seed(seed)
+	full.run()
+	first = _crawler(tmp_path, graph, quota=2)
+	first.seed(seed)
+	assert first.run()['stopped_by'] == 'daily quota'
+	with open(tmp_path / 'crawl.json') as f:
+		priority, babel_id, depth = json.load(f)['frontier'][0]
+	seed_rates = next(iter(rates.values()))
+	assert (babel_id, depth) == (full.map.expanded[2], 1)
+	assert priority == 1 - seed_rates[first.map.babel.get_wiki_id(_synset(babel_id)).title] # Kept its clickthrough term
+	resumed = _crawler(tmp_path, graph)
+	resumed.load_checkpoint()
+	resumed.run()
+	assert first.map.expanded + resumed.map.expanded == full.map.expanded
+
+
+def test_counts_api_calls_from_the_current_synset_cache(tmp_path, graph):
+	crawler = _crawler(tmp_path, graph, max_api_calls=5) # The fixture's cache, swapped in after crawler was imported
+	crawler.seed(graph[0])
+	stats = crawler.run()
+	assert stats['stopped_by'] == 'API call budget'
+	assert stats['api_calls'] == synset_retriever.cache.misses >= 5
@@ -0,0 +1,87 @@
+import random
+import threading
+
+import numpy as np
+import pytest
+
+from category_map import CategoryMap
+from category_map_generation import generate_category_map, get_parent_tree
+from memo import MISSING, BoundedMemo
+from synthetic_data import synthetic_category_links
+
+
+def test_lru_evicts_least_recently_used():
+	memo = BoundedMemo(2, 'lru')
+	memo.put('a', 1)
+	memo.put('b', 2)
+	assert memo.get('a') == 1
+	memo.put('c', 3)
+	assert memo.get('b') is MISSING
+	assert (memo.get('a'), memo.get('c')) == (1, 3)
+
+
+def test_fifo_evicts_oldest():
+	memo = BoundedMemo(2, 'fifo')
+	memo.put('a', 1)
+	memo.put('b', 2)
+	assert memo.get('a') == 1
+	memo.put('c', 3)
+	assert memo.get('a') is MISSING
+	assert (memo.get('b'), memo.get('c')) == (2, 3)
+
+
+def test_stored_none_is_a_hit():
+	memo = BoundedMemo(2)
+	memo.put('path', None)
+	assert memo.get('path') is None
+	assert memo.get('other', 'default') == 'default'
+	assert memo.stats() == {'size': 1, 'max_size': 2, 'hits': 1, 'misses': 1, 'evictions': 0, 'hit_rate': 0.5}
+
+
+def test_stats_and_clear():
+	memo = BoundedMemo(3)
+	for i in range(5):
+		memo.put(i, i)
+	assert len(memo) == 3
+	assert memo.stats()['evictions'] == 2
+	memo.clear()
+	assert len(memo) == 0
+	assert memo.stats()['evictions'] == 0
+
+
+def test_unknown_policy():
+	with pytest.raises(ValueError):
+		BoundedMemo(10, 'random')
+
+
+def test_concurrent_puts_stay_bounded():
+	memo = BoundedMemo(100)
+	def put(offset: int) -> None:
+		for i in range(1_000):
+			memo.put(offset + i, i)
+			memo.get(offset + i // 2)
+	threads = [threading.Thread(target=put, args=(offset * 1_000,)) for offset in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert len(memo) == 100
+	assert memo.stats()['evictions'] == 8 * 1_000 - 100
+
+
+@pytest.mark.parametrize('policy', BoundedMemo.policies)
+def test_memoized_category_map_matches_unmemoized(policy):
+	links, _ = generate_category_map(synthetic_category_links(2_000, seed=0))
+	tree = get_parent_tree(links)
+	plain, memoized = CategoryMap(categories=tree), CategoryMap(categories=tree, memo_size=50, memo_policy=policy)
+	rng = random.Random(0)
+	categories = [category for category in tree if plain.category_in_root(category)]
+	for _ in range(200): # Small memo, so results are read back, evicted & recomputed
+		list1, list2 = rng.sample(categories, 3), rng.sample(categories[:100], 4)
+		assert np.array_equal(memoized.distances(list1, list2), plain.distances(list1, list2))
+		assert memoized.categorical_commonality(list1, list2) == plain.categorical_commonality(list1, list2)
+		assert memoized.category_path(list1[0], plain.root) == plain.category_path(list1[0], plain.root)
+	stats = memoized.memo_stats()
+	assert stats['ids']['hits'] > 0 and stats['ids']['evictions'] > 0 and stats['paths']['hits'] > 0
+	assert set(stats) == {'ids', 'paths'} # Distances are computed from the memoized ids, not remembered per pair
+	assert all(memo['size'] <= 50 for memo in stats.values())
@@ -0,0 +1,96 @@
+import random
+import threading
+from typing import Dict, Hashable, Set
+
+import pytest
+
+from prereq_dag import PrerequisiteDAG
+
+
+def _reaches(children: Dict[Hashable, Set[Hashable]], start: Hashable, target: Hashable) -> bool:
+	seen, stack = {start}, [start]
+	while stack:
+		node = stack.pop()
+		if node == target:
+			return True
+		for child in children.get(node, ()):
+			if child not in seen:
+				seen.add(child)
+				stack.append(child)
+	return False
+
+
+def _assert_topological(dag: PrerequisiteDAG) -> None:
+	assert len(set(dag.order.values())) == len(dag.order)
+	for prereq, children in dag.children.items():
+		for concept in children:
+			assert dag.order[prereq] < dag.order[concept]
+			assert prereq in dag.parents[concept]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_matches_naive_cycle_check(seed):
+	rng = random.Random(seed)
+	dag, children = PrerequisiteDAG(), {}
+	for _ in range(2_000):
+		prereq, concept = rng.randrange(200), rng.randrange(200)
+		accepted = prereq != concept and not _reaches(children, concept, prereq)
+		if accepted:
+			children.setdefault(prereq, set()).add(concept)
+		assert dag.add_edge(prereq, concept) == accepted
+		_assert_topological(dag)
+	assert {node: nodes for node, nodes in dag.children.items() if nodes} == children
+	assert dag.stats()['edges'] == sum(map(len, children.values()))
+
+
+def test_rejected_edges_are_counted():
+	dag = PrerequisiteDAG(max_rejected_kept=2)
+	assert dag.add_edge('a', 'b') and dag.add_edge('b', 'c')
+	assert not dag.add_edge('c', 'a')
+	assert not dag.add_edge('b', 'a')
+	assert not dag.add_edge('c', 'c')
+	assert dag.add_edge('a', 'b') # Already in the graph
+	assert dag.rejected == [('c', 'a'), ('b', 'a')]
+	assert dag.stats() == {'nodes': 3, 'edges': 2, 'rejected': 3, 'reordered': 0}
+
+
+def test_reorders_edges_against_the_order():
+	dag = PrerequisiteDAG()
+	for node in 'abcd':
+		dag.add_node(node)
+	assert dag.add_edge('c', 'b')
+	assert dag.add_edge('d', 'a')
+	assert dag.add_edge('b', 'd')
+	_assert_topological(dag)
+	assert dag.topological_order() == ['c', 'b', 'd', 'a']
+	assert dag.num_reordered > 0
+	assert not dag.add_edge('a', 'c')
+
+
+def test_growing_outwards_never_reorders():
+	# Like expanding the map: each concept's prerequisites are new nodes, or concepts already in the map
+	rng = random.Random(0)
+	dag, concepts = PrerequisiteDAG(), ['root']
+	for i in range(1, 2_000):
+		concept = rng.choice(concepts)
+		assert dag.add_edge(i, concept)
+		concepts.append(i)
+	assert dag.num_reordered == 0
+	_assert_topological(dag)
+
+
+def test_concurrent_edges_stay_acyclic():
+	dag = PrerequisiteDAG()
+	def add(seed: int) -> None:
+		rng = random.Random(seed)
+		for _ in range(2_000):
+			dag.add_edge(rng.randrange(100), rng.randrange(100))
+	threads = [threading.Thread(target=add, args=(seed,)) for seed in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	_assert_topological(dag)
+	for prereq, children in dag.children.items():
+		for concept in children:
+			assert not _reaches(dag.children, concept, prereq)
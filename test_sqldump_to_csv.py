@@ -0,0 +1,74 @@
+import random
+import pytest
+
+from sqldump_to_csv import _tokenize_rows, parse_sql_file, tokenize_values, tokenize_values_regex
+
+
+def _sql_value(value) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, int):
+        return str(value)
+    escaped = value.replace('\\', '\\\\').replace("'", "\\'").replace('\n', '\\n').replace('\t', '\\t').replace('\0', '\\0').replace('\x1a', '\\Z')
+    return f"'{escaped}'"
+
+
+def _values(rows) -> str:
+    return ','.join('(' + ','.join(map(_sql_value, row)) + ')' for row in rows) + ';'
+
+
+def _expected(rows):
+    return [[chr(0) if value is None or value == '' else str(value) for value in row] for row in rows]
+
+
+def _random_rows(rng: random.Random, num_rows: int, escapes: bool):
+    strings = ['a', 'Physics', 'Hidden_categories', '', 'with (parens)', 'a,b', '),(', 'NULL_ish']
+    if escapes:
+        strings += ["it's", 'back\\slash', 'new\nline', 'tab\there', 'nul\0byte', 'sub\x1a', 'back\\nslash', '\\']
+    def value(column: int):
+        if column == 0:
+            return rng.choice([rng.randrange(10**6), None])
+        return rng.choice([rng.randrange(100), None, rng.choice(strings), rng.choice(strings)])
+    return [[value(column) for column in range(4)] for _ in range(num_rows)]
+
+
+@pytest.mark.parametrize('escapes', [False, True])
+@pytest.mark.parametrize('seed', range(20))
+def test_fast_and_regex_paths_agree(seed, escapes):
+    rows = _random_rows(random.Random(seed), 50, escapes)
+    values = _values(rows)
+    assert list(tokenize_values(values)) == list(_tokenize_rows(values)) == _expected(rows)
+
+
+@pytest.mark.parametrize('values', [
+    "(1,'a',NULL),(2,'',NULL);",
+    "(1,'a',''),(NULL,'',5);",
+    "(NULL,'x'),(3,'');",
+])
+def test_nulls_and_empty_strings_in_outer_columns(values):
+    assert list(tokenize_values(values)) == list(_tokenize_rows(values))
+    assert all(field != 'NULL' and field != '' for row in tokenize_values(values) for field in row)
+
+
+def test_line_with_escape_matches_line_without():
+    plain = "(1,'a',NULL),(2,'',NULL);"
+    escaped = "(1,'a',NULL),(2,'',NULL),(3,'it\\'s',NULL);"
+    assert list(tokenize_values(plain)) == list(tokenize_values(escaped))[:2]
+
+
+def test_escapes_csv_cannot_decode():
+    values = "(1,'a\\nb','c\\\\nd','e\\%f'),(2,'\\0','\\\\','\\'\\t');"
+    expected = [['1', 'a\nb', 'c\\nd', 'e\\%f'], ['2', '\0', '\\', "'\t"]]
+    assert list(tokenize_values(values)) == list(_tokenize_rows(values)) == expected
+
+
+def test_selected_columns():
+    rows = [[1, 'a', None], [2, 'with (parens)', 'x']]
+    assert list(tokenize_values(_values(rows), [0, 2])) == [['1', chr(0)], ['2', 'x']]
+
+
+@pytest.mark.parametrize('parser', [tokenize_values, tokenize_values_regex])
+def test_parse_sql_file_with_tokenizer(parser):
+    line = "INSERT INTO `page` VALUES " + _values([[1, 'a,b', None], [2, "it's", '']]) + '\n'
+    assert list(parse_sql_file([line], parser=parser)) == [['1', 'a,b', chr(0)], ['2', "it's", chr(0)]]
+    assert list(parse_sql_file([line], columns=[2, 0], parser=parser)) == [[chr(0), '1'], [chr(0), '2']]
@@ -0,0 +1,88 @@
+import enum
+
+from synset_cache import CachedSense, CachedSynset, SynsetCache
+
+
+class _SynsetType(enum.Enum):
+	CONCEPT = 0
+	NAMED_ENTITY = 1
+
+
+class _SynsetID:
+	"""Like BabelSynsetID, which keeps the 'bn:...' string in id"""
+	def __init__(self, babel_id: str) -> None:
+		self.id = babel_id
+
+	def __eq__(self, other: object) -> bool:
+		return isinstance(other, _SynsetID) and other.id == self.id
+
+	def __hash__(self) -> int:
+		return hash(self.id)
+
+
+def _synset(babel_id: str, title: str, synset_type=_SynsetType.CONCEPT) -> CachedSynset:
+	sense = CachedSense(title, title.replace('_', ' ').lower())
+	return CachedSynset(_SynsetID(babel_id), synset_type, [sense, CachedSense(f'{title}_(alt)', 'alt')], sense,
+	                    [f'{title}_category', 'Shared_category'], [f'{title} is a gloss.', 'Another gloss, with "quotes".'])
+
+
+def _fields(synset: CachedSynset):
+	return (synset.id, synset.type, synset.senses(), synset.main_sense(), synset.categories(), synset.glosses())
+
+
+def _cache(path, lru_size=100) -> SynsetCache:
+	return SynsetCache(str(path), lru_size, id_factory=_SynsetID, type_factory=_SynsetType.__getitem__)
+
+
+def test_round_trip_through_sqlite(tmp_path):
+	synsets = [_synset('bn:00000001n', 'Control_theory'), _synset('bn:00000002n', 'Alan_Turing', _SynsetType.NAMED_ENTITY)]
+	cache = _cache(tmp_path / 'synsets.sqlite')
+	cache.put('search:EN:control', synsets)
+	cache.put('WikipediaID:EN:alan_turing', synsets[1:])
+	cache.close()
+	reopened = _cache(tmp_path / 'synsets.sqlite')
+	loaded = reopened.get('search:EN:control')
+	assert [_fields(synset) for synset in loaded] == [_fields(synset) for synset in synsets]
+	assert isinstance(loaded[0].id, _SynsetID) and loaded[1].type is _SynsetType.NAMED_ENTITY
+	assert reopened.get('search:EN:control') is loaded # Then served from memory
+	assert [_fields(synset) for synset in reopened.get('WikipediaID:EN:alan_turing')] == [_fields(synsets[1])]
+	stats = reopened.stats()
+	assert (stats['hits'], stats['disk_hits'], stats['misses']) == (1, 2, 0)
+	assert (stats['synsets'], stats['lookups']) == (2, 2) # Synsets are stored once, however many lookups find them
+
+
+def test_cached_misses(tmp_path):
+	cache = _cache(tmp_path / 'synsets.sqlite')
+	assert cache.get('BabelSynsetID::bn:99999999n') is None
+	assert 'BabelSynsetID::bn:99999999n' not in cache
+	cache.put('BabelSynsetID::bn:99999999n', []) # Not a concept, so it isn't looked up again
+	cache.close()
+	reopened = _cache(tmp_path / 'synsets.sqlite')
+	assert 'BabelSynsetID::bn:99999999n' in reopened
+	assert reopened.get('BabelSynsetID::bn:99999999n') == []
+	assert (cache.misses, reopened.misses, reopened.disk_hits) == (1, 0, 1)
+
+
+def test_lru_eviction(tmp_path):
+	cache = _cache(tmp_path / 'synsets.sqlite', lru_size=2)
+	for i in range(3):
+		cache.put(f'key_{i}', [_synset(f'bn:0000000{i}n', f'Title_{i}')])
+	assert list(cache.lru) == ['key_1', 'key_2']
+	cache.get('key_1')
+	assert list(cache.lru) == ['key_2', 'key_1']
+	evicted = cache.get('key_0') # Read back from SQLite, evicting the least recently used
+	assert _fields(evicted[0]) == _fields(_synset('bn:00000000n', 'Title_0'))
+	assert list(cache.lru) == ['key_1', 'key_0']
+	assert (cache.hits, cache.disk_hits, cache.misses) == (1, 1, 0)
+
+
+def test_warm_load(tmp_path):
+	cache = _cache(tmp_path / 'synsets.sqlite')
+	cache.put_many((f'key_{i}', [_synset(f'bn:0000000{i}n', f'Title_{i}')] if i % 2 else []) for i in range(6))
+	cache.close()
+	reopened = _cache(tmp_path / 'synsets.sqlite', lru_size=4)
+	assert reopened.warm_load() == 4
+	assert reopened.warm_load(limit=10) == 4 # Bounded by the LRU size
+	key = next(iter(reopened.lru))
+	reopened.get(key)
+	assert (reopened.hits, reopened.disk_hits) == (1, 0)
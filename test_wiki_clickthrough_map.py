@@ -0,0 +1,114 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('babelnet') # For the title normalization wiki_clickthrough_map imports
+from wiki_clickthrough_map import ArticleNotFound, ClickstreamStore, TopicSets, WikiMap
+
+
+def _clickstream(path: str, num_titles=300, seed=0) -> pd.DataFrame:
+    """Writes a clickstream TSV with mixed case titles, non-link rows and at most one link per (source, target)"""
+    rng = np.random.default_rng(seed)
+    titles = [f'Title_{i}' if i % 3 else f'TITLE_({i})' for i in range(num_titles)]
+    rows = []
+    for source in range(num_titles):
+        for target in rng.choice(num_titles, size=rng.integers(0, 15), replace=False):
+            rows.append((titles[source], titles[target], rng.choice(['link', 'link', 'external', 'other']), rng.integers(10, 1_000)))
+    df = pd.DataFrame(rows, columns=['source', 'target', 'type', 'n'])
+    df.to_csv(path, sep='\t', header=False, index=False)
+    return df
+
+
+def _old_links(path: str) -> pd.DataFrame:
+    """WikiMap.ct_links before the clickstream store"""
+    df = pd.read_csv(path, sep='\t', names=('source', 'target', 'type', 'n'))
+    df = df[df['type'] == 'link']
+    df = df.drop(columns=['type'])
+    df['source'] = df['source'].str.lower()
+    df['target'] = df['target'].str.lower()
+    return df
+
+
+def _old_rates(ct_links: pd.DataFrame, wiki_id: str, target_normalized=False, source_normalized=False) -> pd.Series:
+    """WikiMap.get_clickthrough_rates before the clickstream store"""
+    ctr = ct_links[ct_links['source'] == wiki_id].set_index('target')['n']
+    if len(ctr) == 0:
+        raise ValueError(f'Article not found: {wiki_id}')
+    if source_normalized:
+        ctr /= ctr.sum()
+    if target_normalized:
+        ctr /= ct_links[ct_links['target'].isin(ctr.index)].groupby('target')['n'].sum()
+    return ctr
+
+
+@pytest.fixture
+def clickstream(tmp_path):
+    path = str(tmp_path / 'clickstream.tsv')
+    _clickstream(path)
+    return path, WikiMap(path, cache_dir=str(tmp_path / 'cache'), chunksize=500), _old_links(path)
+
+
+@pytest.mark.parametrize('normalization', [{}, {'source_normalized': True}, {'target_normalized': True}])
+def test_rates_match_original(clickstream, normalization):
+    _, wiki, ct_links = clickstream
+    for source in ct_links['source'].unique():
+        # Including the order: the in-place division by target totals realigned on the rates' (file order) index
+        expected = _old_rates(ct_links, source, **normalization)
+        pd.testing.assert_series_equal(wiki.get_clickthrough_rates(source, **normalization), expected, check_index_type=False)
+        assert wiki.get_clickthrough_links(source) == ct_links[ct_links['source'] == source]['target'].to_list()
+    with pytest.raises(ArticleNotFound):
+        wiki.get_clickthrough_rates('not_an_article')
+
+
+@pytest.mark.parametrize('normalization', [{'source_normalized': True}, {'source_normalized': False, 'target_normalized': True}])
+def test_topic_sets_match_original(clickstream, normalization):
+    _, wiki, ct_links = clickstream
+    topic_sets = wiki.get_topic_sets(score_threshold=0.02, **normalization)
+    top_sets = wiki.get_topic_sets(score_threshold=0.02, top_k=3, **normalization)
+    assert sorted(topic_sets) == sorted(ct_links['source'].unique())
+    for source in ct_links['source'].unique():
+        # Like PrerequisiteMap._generate_topic_set did, for each article
+        rates = _old_rates(ct_links, source, **normalization)
+        rates = rates[rates > 0.02]
+        topic_set = topic_sets[source]
+        # sort_values doesn't keep ties in any particular order, topic sets keep them in file order
+        assert topic_set.to_dict() == rates.to_dict()
+        pd.testing.assert_series_equal(topic_set, rates.sort_values(ascending=False, kind='stable'), check_index_type=False)
+        pd.testing.assert_series_equal(top_sets[source], topic_set.head(3))
+
+
+def test_saved_topic_sets_need_the_same_clickstream(clickstream, tmp_path):
+    path, wiki, _ = clickstream
+    topic_sets = wiki.get_topic_sets(path=str(tmp_path / 'topic_sets.npz'))
+    loaded = TopicSets.load(str(tmp_path / 'topic_sets.npz'), wiki.store)
+    for source in topic_sets:
+        pd.testing.assert_series_equal(loaded[source], topic_sets[source])
+    _clickstream(path, seed=1)
+    with pytest.raises(ValueError):
+        TopicSets.load(str(tmp_path / 'topic_sets.npz'), WikiMap(path, cache_dir=str(tmp_path / 'cache')).store)
+
+
+def test_cache_rebuilt_when_clickstream_changes(tmp_path, monkeypatch):
+    builds = []
+    from_links = ClickstreamStore.from_links
+    monkeypatch.setattr(ClickstreamStore, 'from_links', classmethod(lambda cls, chunks: builds.append(1) or from_links(chunks)))
+    path, cache_dir = str(tmp_path / 'clickstream.tsv'), str(tmp_path / 'cache')
+    pd.DataFrame([('A', 'B', 'link', 10), ('A', 'C', 'link', 30)]).to_csv(path, sep='\t', header=False, index=False)
+    def rates(verify=False):
+        return WikiMap(path, cache_dir=cache_dir, verify=verify).get_clickthrough_rates('a').to_dict()
+
+    assert rates() == {'b': 10, 'c': 30} and len(builds) == 1
+    assert rates() == {'b': 10, 'c': 30} and len(builds) == 1
+    # Touched, but with the same contents: the sha256 matches, so the cache is kept
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    assert rates() == {'b': 10, 'c': 30} and len(builds) == 1
+    # Rewritten with the same size & mtime: only noticed when verifying the sha256
+    stat = os.stat(path)
+    pd.DataFrame([('A', 'B', 'link', 20), ('A', 'C', 'link', 30)]).to_csv(path, sep='\t', header=False, index=False)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert rates() == {'b': 10, 'c': 30} and len(builds) == 1
+    assert rates(verify=True) == {'b': 20, 'c': 30} and len(builds) == 2
+    # A different size always rebuilds
+    pd.DataFrame([('A', 'B', 'link', 200), ('A', 'C', 'link', 30)]).to_csv(path, sep='\t', header=False, index=False)
+    assert rates() == {'b': 200, 'c': 30} and len(builds) == 3
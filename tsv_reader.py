@@ -0,0 +1,23 @@
+import time
+import logging
+import pandas as pd
+from tqdm import tqdm
+from typing import Dict, Iterator, List, Optional, Sequence
+
+
+def read_tsv_chunks(path: str, names: Sequence[str], usecols: Optional[List[int]] = None, dtype: Optional[Dict[str, type]] = None,
+					chunksize=1_000_000, header: Optional[int] = None, **kwargs) -> Iterator[pd.DataFrame]:
+	"""
+	Reads a TSV in chunks of at most chunksize rows, so peak memory is bounded by the chunk size rather than the file size.
+	Only the usecols columns are parsed, and progress is reported in rows/sec.
+	"""
+	reader = pd.read_csv(path, sep='\t', names=names, usecols=usecols, dtype=dtype, header=header, chunksize=chunksize, **kwargs)
+	start = time.perf_counter()
+	rows = 0
+	with tqdm(desc=f"Reading {path}", unit=' rows', unit_scale=True) as pbar:
+		for chunk in reader:
+			rows += len(chunk)
+			pbar.update(len(chunk))
+			yield chunk
+	elapsed = time.perf_counter() - start
+	logging.info(f"Read {rows} rows from {path} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/sec)")
@@ -1,27 +1,236 @@
+import os
+import json
+import hashlib
+import logging
 import unicodedata
+import numpy as np
 import pandas as pd
-from typing import List
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from babelnet._utils import normalized_lemma_to_string
 
+from category_graph import StringTable, csr_positions
+from tsv_reader import read_tsv_chunks
+from instrumentation import timed
 
-def _get_ct_links(path = 'datasets/raw/clickstream-enwiki-2023-05.tsv') -> pd.DataFrame:
-    df = pd.read_csv(path, sep='\t', names=('source', 'target', 'type', 'n'))
-    df = df[df['type'] == 'link']
-    df.drop(columns=['type'], inplace=True)
-    df['source'] = df['source'].str.lower()
-    df['target'] = df['target'].str.lower()
-    return df
+
+def _get_ct_links(path = 'datasets/raw/clickstream-enwiki-2023-05.tsv', chunksize=1_000_000) -> Iterator[pd.DataFrame]:
+    """Yields the clickstream's links in chunks, with the link type dropped and titles lowercased"""
+    dtype = {'source': str, 'target': str, 'type': str, 'n': np.uint32}
+    # na_filter is off so articles like "NA" or "Null" aren't read as missing
+    for chunk in read_tsv_chunks(path, names=('source', 'target', 'type', 'n'), dtype=dtype, chunksize=chunksize, na_filter=False):
+        chunk = chunk[chunk['type'] == 'link']
+        yield pd.DataFrame({'source': chunk['source'].str.lower(), 'target': chunk['target'].str.lower(), 'n': chunk['n']})
+
+
+class ArticleNotFound(ValueError):
+    """An article without any links in the clickstream"""
+
+
+def _file_hash(path: str, block_size=1 << 24) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ClickstreamStore:
+    """
+    Columnar, memory-mapped copy of the clickstream links.
+    Titles are dictionary encoded into a StringTable, and links are grouped by source in CSR form:
+    the links from title i are targets[offsets[i]:offsets[i + 1]] with counts[offsets[i]:offsets[i + 1]] (in file order).
+    """
+    arrays = ('offsets', 'targets', 'counts', 'target_totals')
+
+    def __init__(self, titles: StringTable, offsets: np.ndarray, targets: np.ndarray, counts: np.ndarray, target_totals: np.ndarray) -> None:
+        self.titles = titles
+        self.offsets = offsets
+        self.targets = targets
+        self.counts = counts
+        self.target_totals = target_totals
+        self.sha256: Optional[str] = None # Of the clickstream TSV, for stores loaded from a cache
+
+    @classmethod
+    def from_links(cls, chunks: Iterable[pd.DataFrame]) -> 'ClickstreamStore':
+        """Builds the store from chunks of (source, target, n) links, only keeping their integer-coded columns"""
+        vocabulary: Dict[str, int] = {}
+        sources, targets, counts = [], [], []
+        for chunk in chunks:
+            codes, uniques = pd.factorize(pd.concat([chunk['source'], chunk['target']], ignore_index=True))
+            ids = np.fromiter((vocabulary.setdefault(title, len(vocabulary)) for title in uniques), dtype=np.int64, count=len(uniques))
+            codes = ids[codes]
+            sources.append(codes[:len(chunk)])
+            targets.append(codes[len(chunk):])
+            counts.append(chunk['n'].to_numpy(dtype=np.uint32))
+        titles = np.array(list(vocabulary), dtype=object)
+        del vocabulary
+        # Renumber titles in sorted order, as required by the StringTable
+        order = np.argsort(titles)
+        rank = np.empty(len(titles), dtype=np.int64)
+        rank[order] = np.arange(len(titles))
+        sources = rank[np.concatenate(sources or [np.array([], dtype=np.int64)])]
+        targets = rank[np.concatenate(targets or [np.array([], dtype=np.int64)])].astype(np.int32)
+        counts = np.concatenate(counts or [np.array([], dtype=np.uint32)])
+        link_order = np.argsort(sources, kind='stable')
+        offsets = np.zeros(len(titles) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(titles)), out=offsets[1:])
+        target_totals = np.bincount(targets, weights=counts, minlength=len(titles)).astype(np.uint64)
+        return cls(StringTable.from_strings(titles[order]), offsets, targets[link_order], counts[link_order], target_totals)
+
+    @classmethod
+    def open(cls, path: str, cache_dir: Optional[str] = None, chunksize=1_000_000, verify=False) -> 'ClickstreamStore':
+        """
+        Memory-maps the cached store for a clickstream TSV, (re)building it if the TSV has changed.
+        Changes are detected from the TSV's size & mtime, so a rewrite keeping both isn't noticed unless verify is set,
+        which always compares the TSV's sha256 (reading the whole file)
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join('datasets/generated', os.path.splitext(os.path.basename(path))[0])
+        if not cls._is_current(path, cache_dir, verify):
+            logging.info(f"Building clickstream cache for {path}...")
+            cls.from_links(_get_ct_links(path, chunksize)).save(cache_dir)
+            cls._write_meta(path, cache_dir, _file_hash(path))
+        return cls.load(cache_dir)
+
+    @staticmethod
+    def _is_current(path: str, cache_dir: str, verify=False) -> bool:
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        stat = os.stat(path)
+        if not verify and (meta['size'], meta['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            return True
+        # The hash only keeps the cache when the file looks modified but its contents are the same (e.g. touched or copied)
+        if meta['size'] != stat.st_size or meta['sha256'] != _file_hash(path):
+            return False
+        ClickstreamStore._write_meta(path, cache_dir, meta['sha256'])
+        return True
+
+    @staticmethod
+    def _write_meta(path: str, cache_dir: str, sha256: str) -> None:
+        stat = os.stat(path)
+        with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+            json.dump({'source': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}, f)
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path) # Invalidates the cache until it is completely written
+        self.titles.save(path, 'titles')
+        for name in self.arrays:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str, mmap_mode='r') -> 'ClickstreamStore':
+        titles = StringTable.load(path, 'titles', mmap_mode)
+        arrays = [np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in cls.arrays]
+        store = cls(titles, *arrays)
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                store.sha256 = json.load(f)['sha256']
+        return store
+
+    def links(self, source: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Target ids & counts of the links from an article"""
+        source_id = self.titles.lookup(source)
+        if source_id < 0:
+            return self.targets[:0], self.counts[:0]
+        start, stop = self.offsets[source_id], self.offsets[source_id + 1]
+        return self.targets[start:stop], self.counts[start:stop]
+
+    def to_frame(self) -> pd.DataFrame:
+        titles = np.array(list(self.titles), dtype=object)
+        sources = np.repeat(np.arange(len(self.titles)), np.diff(self.offsets))
+        return pd.DataFrame({'source': titles[sources], 'target': titles[self.targets], 'n': self.counts})
+
+
+class TopicSets(Mapping):
+    """
+    Thresholded clickthrough rates of many articles, mapping each article to a Series like get_clickthrough_rates' (best first, ties in file order).
+    Stored in CSR form over the clickstream store's title ids: the targets of sources[i] (sorted) are
+    targets[offsets[i]:offsets[i + 1]], with their scores (float64, so they equal get_clickthrough_rates').
+    clickstream_sha256 identifies the clickstream they were computed from, so saved sets are only loaded with the same one.
+    """
+    arrays = ('sources', 'offsets', 'targets', 'scores')
+
+    def __init__(self, titles: StringTable, sources: np.ndarray, offsets: np.ndarray, targets: np.ndarray, scores: np.ndarray,
+                 score_threshold: float, top_k: Optional[int] = None, normalization='source', clickstream_sha256: Optional[str] = None) -> None:
+        self.titles = titles
+        self.sources = sources
+        self.offsets = offsets
+        self.targets = targets
+        self.scores = scores
+        self.score_threshold = score_threshold
+        self.top_k = top_k
+        self.normalization = normalization
+        self.clickstream_sha256 = clickstream_sha256
+
+    def covers(self, score_threshold: float, normalization='source') -> bool:
+        """Whether every rate above score_threshold is kept, so the sets can stand in for get_clickthrough_rates"""
+        return self.top_k is None and self.normalization == normalization and self.score_threshold <= score_threshold
+
+    def _position(self, wiki_id: str) -> int:
+        source_id = self.titles.lookup(wiki_id)
+        i = int(np.searchsorted(self.sources, source_id))
+        return i if source_id >= 0 and i < len(self.sources) and self.sources[i] == source_id else -1
+
+    def __getitem__(self, wiki_id: str) -> pd.Series:
+        i = self._position(wiki_id)
+        if i < 0:
+            raise KeyError(wiki_id)
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        index = pd.Index([self.titles[target_id] for target_id in self.targets[start:stop]], dtype=object, name='target')
+        return pd.Series(self.scores[start:stop], index=index, name='n')
+
+    def __contains__(self, wiki_id: object) -> bool:
+        return isinstance(wiki_id, str) and self._position(wiki_id) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for source_id in self.sources:
+            yield self.titles[source_id]
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, num_titles=len(self.titles), clickstream_sha256=self.clickstream_sha256 or '', score_threshold=self.score_threshold,
+                 top_k=-1 if self.top_k is None else self.top_k, normalization=self.normalization, **{name: getattr(self, name) for name in self.arrays})
+
+    @classmethod
+    def load(cls, path: str, store: ClickstreamStore) -> 'TopicSets':
+        """Loads topic sets saved from the same clickstream as the store, raising a ValueError for those from any other"""
+        with np.load(path) as data: # Reading an array copies it out of the file
+            saved_sha256 = str(data['clickstream_sha256']) if 'clickstream_sha256' in data.files else ''
+            if not saved_sha256 or saved_sha256 != (store.sha256 or '') or int(data['num_titles']) != len(store.titles):
+                raise ValueError(f'Topic sets in {path} were not computed from this clickstream')
+            top_k = int(data['top_k'])
+            return cls(store.titles, *[data[name] for name in cls.arrays], float(data['score_threshold']), None if top_k < 0 else top_k,
+                       str(data['normalization']), saved_sha256)
 
 
 class WikiMap:
-    def __init__(self, path='datasets/raw/clickstream-enwiki-2023-05.tsv') -> None:
-        self.ct_links = _get_ct_links(path)
+    def __init__(self, path='datasets/raw/clickstream-enwiki-2023-05.tsv', cache_dir=None, chunksize=1_000_000, verify=False) -> None:
+        self.store = ClickstreamStore.open(path, cache_dir, chunksize, verify)
+
+    def to_frame(self) -> pd.DataFrame:
+        """All links as a (source, target, n) DataFrame, materialized from the store on every call"""
+        return self.store.to_frame()
 
+    def _target_titles(self, target_ids: np.ndarray) -> pd.Index:
+        return pd.Index([self.store.titles[target_id] for target_id in target_ids], dtype=object, name='target')
+
+    @timed('wiki.get_clickthrough_links')
     def get_clickthrough_links(self, wiki_id: str) -> List[str]:
-        links = self.ct_links[self.ct_links['source'] == wiki_id]['target']
-        if len(links) == 0:
-            raise ValueError(f'Article not found: {wiki_id}')
-        return links.to_list()
+        targets, _ = self.store.links(wiki_id)
+        if len(targets) == 0:
+            raise ArticleNotFound(f'Article not found: {wiki_id}')
+        return self._target_titles(targets).to_list()
 
     @staticmethod
     def link_to_title(text: str) -> str:
@@ -29,22 +238,71 @@ class WikiMap:
         cleaned_text = cleaned_text.replace('_',' ')
         return normalized_lemma_to_string(cleaned_text).strip() # Removes parenthesis, makes lowercase
 
+    @timed('wiki.get_clickthrough_rates')
     def get_clickthrough_rates(self, wiki_id: str, target_normalized=False, source_normalized=False) -> pd.Series:
         if source_normalized and target_normalized:
             raise ValueError('Cannot normalize based on both source and target')
-        ctr = self.ct_links[self.ct_links['source'] == wiki_id].set_index('target')['n']
-        if len(ctr) == 0:
-            raise ValueError(f'Article not found: {wiki_id}')
+        targets, counts = self.store.links(wiki_id)
+        if len(targets) == 0:
+            raise ArticleNotFound(f'Article not found: {wiki_id}')
+        ctr = np.array(counts, dtype=np.int64)
         # Normalize based on source clicks (i.e. portion of source out-traffic going to target)
         # This favours popular links, typically related
         if source_normalized:
-            ctr /= ctr.sum()
+            ctr = ctr / ctr.sum()
         # Normalize based on target clicks (i.e. portion of target in-traffic is coming from source)
         # This favours niche links
         if target_normalized:
-            ct_link_totals = self.ct_links[self.ct_links['target'].isin(ctr.index)].groupby('target')['n'].sum()
-            ctr /= ct_link_totals
-        return ctr
+            ctr = ctr / np.asarray(self.store.target_totals[targets])
+        return pd.Series(ctr, index=self._target_titles(targets), name='n')
+
+    @timed('wiki.get_topic_sets')
+    def get_topic_sets(self, wiki_ids: Optional[Iterable[str]] = None, score_threshold=0.02, top_k: Optional[int] = None,
+                       target_normalized=False, source_normalized=True, path: Optional[str] = None, chunksize=100_000) -> TopicSets:
+        """
+        Clickthrough rates above score_threshold (only the best top_k, if given) of many articles, or all of them, at once.
+        Same as get_clickthrough_rates, thresholded & sorted for each article, but done in vectorized passes over chunksize articles at a time.
+        Articles without links are left out. Saved to path (.npz) if given.
+        """
+        if source_normalized and target_normalized:
+            raise ValueError('Cannot normalize based on both source and target')
+        store = self.store
+        if wiki_ids is None:
+            sources = np.flatnonzero(np.diff(store.offsets))
+        else:
+            sources = store.titles.lookup_many(wiki_ids)
+            sources = np.unique(sources[sources >= 0])
+            sources = sources[store.offsets[sources + 1] > store.offsets[sources]]
+        lengths, targets, scores = [], [], []
+        for start in range(0, len(sources), chunksize):
+            chunk = sources[start:start + chunksize]
+            num_links, positions = csr_positions(store.offsets, chunk)
+            owners = np.repeat(np.arange(len(chunk)), num_links)
+            chunk_targets = store.targets[positions]
+            chunk_scores = store.counts[positions].astype(np.float64)
+            if source_normalized:
+                chunk_scores /= np.bincount(owners, weights=chunk_scores, minlength=len(chunk))[owners]
+            if target_normalized:
+                chunk_scores /= np.asarray(store.target_totals)[chunk_targets]
+            keep = chunk_scores > score_threshold
+            owners, chunk_targets, chunk_scores = owners[keep], chunk_targets[keep], chunk_scores[keep]
+            order = np.lexsort((-chunk_scores, owners)) # Best first within each article
+            owners, chunk_targets, chunk_scores = owners[order], chunk_targets[order], chunk_scores[order]
+            if top_k is not None:
+                starts = np.searchsorted(owners, owners) # Position of each article's first target
+                keep = np.arange(len(owners)) - starts < top_k
+                owners, chunk_targets, chunk_scores = owners[keep], chunk_targets[keep], chunk_scores[keep]
+            lengths.append(np.bincount(owners, minlength=len(chunk)))
+            targets.append(chunk_targets.astype(np.int32))
+            scores.append(chunk_scores)
+        offsets = np.zeros(len(sources) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(lengths or [np.zeros(0, dtype=np.int64)]), out=offsets[1:])
+        normalization = 'source' if source_normalized else 'target' if target_normalized else 'none'
+        topic_sets = TopicSets(store.titles, sources, offsets, np.concatenate(targets or [np.zeros(0, dtype=np.int32)]),
+                               np.concatenate(scores or [np.zeros(0, dtype=np.float64)]), score_threshold, top_k, normalization, store.sha256)
+        if path is not None:
+            topic_sets.save(path)
+        return topic_sets
 
 
 if __name__ == '__main__':